@@ -1,10 +1,19 @@
 import tkinter as tk
+import multiprocessing
 from tkinter import ttk
 from threading import Thread
 
 from app_helper import ControlManager, ModelManager, MediaManager
 from app_config import ConfigurationManager
 from app_db import DatabaseManager
+from app_ratelimit import RateLimitManager
+from app_cache import CacheManager
+from app_batch import BatchManager
+from app_prompt import PromptManager
+from app_embedding import EmbeddingManager
+from app_inference import InferenceManager
+from app_backlog import BacklogManager
+from app_retention import RetentionManager
 from app_screenshot import ScreenshotManager
 from app_audio import AudioManager
 from app_photo import PhotoManager
@@ -16,6 +25,7 @@ def start_primary_process():
     print(f'Started!\n')
 
     controlManager.start()
+    inferenceManager.start()
     screenshot_thread = Thread(target=screenshotManager.screenshot_loop)
     screenshot_thread.start()
     photo_thread = Thread(target=photoManager.photo_loop)
@@ -24,38 +34,77 @@ def start_primary_process():
     audio_thread.start()
     agent_thread = Thread(target=agentManager.agent_loop)
     agent_thread.start()
+    backlog_thread = Thread(target=backlogManager.backlog_loop)
+    backlog_thread.start()
+    embedding_thread = Thread(target=embeddingManager.embedding_loop)
+    embedding_thread.start()
+    retention_thread = Thread(target=retentionManager.retention_loop)
+    retention_thread.start()
 def stop_primary_process():
     print(f'Stopped!\n')
     
     controlManager.stop()
+    inferenceManager.stop()
 # endregion
 
 if __name__ == "__main__":
+    # OCR pool workers of a frozen build re-run this file, they have to stop here instead of starting the app again
+    multiprocessing.freeze_support()
     print(f'Starting EYES...\n')
 
     configManager = ConfigurationManager()
 
-    databaseManager = DatabaseManager()
+    databaseManager = DatabaseManager(
+        configManager
+    )
     databaseManager.initialize_db()
+    # Anything still in flight belongs to a previous run that crashed or was killed
+    databaseManager.reset_in_flight_rows()
 
-    controlManager = ControlManager()
+    controlManager = ControlManager(
+        configManager
+    )
+    inferenceManager = InferenceManager(
+        configManager, databaseManager
+    )
     mediaManager = MediaManager(
 
+    )
+    rateLimitManager = RateLimitManager(
+        configManager
+    )
+    cacheManager = CacheManager(
+        configManager
     )
     modelManager = ModelManager(
+        configManager, rateLimitManager, cacheManager
+    )
+    batchManager = BatchManager(
+        configManager, modelManager
+    )
+    promptManager = PromptManager(
         configManager
     )
+    embeddingManager = EmbeddingManager(
+        configManager, controlManager, databaseManager
+    )
     agentManager = AgentManager(
-        configManager, controlManager, modelManager, databaseManager, mediaManager
+        configManager, controlManager, modelManager, promptManager, embeddingManager, databaseManager, mediaManager
     )
     screenshotManager = ScreenshotManager(
-        configManager, controlManager, modelManager, databaseManager, mediaManager
+        configManager, controlManager, modelManager, batchManager, promptManager, databaseManager, mediaManager, inferenceManager
     )
     photoManager = PhotoManager(
-        configManager, controlManager, modelManager, databaseManager, mediaManager
+        configManager, controlManager, modelManager, databaseManager, mediaManager, inferenceManager
     )
     audioManager = AudioManager(
-        configManager, controlManager, modelManager, databaseManager, mediaManager
+        configManager, controlManager, modelManager, batchManager, promptManager, databaseManager, mediaManager, inferenceManager
+    )
+    backlogManager = BacklogManager(
+        configManager, controlManager, databaseManager, inferenceManager, rateLimitManager, cacheManager, batchManager, screenshotManager, photoManager, audioManager
+    )
+    retentionManager = RetentionManager(
+        configManager, controlManager, databaseManager, mediaManager
     )
 
     app = UIManager(
@@ -1,16 +1,23 @@
 import os
+import re
 import time
+import hashlib
+import threading
 import datetime
 import sqlite3
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 class AgentManager:
-    def __init__(self, configManager, controlManager, modelManager, databaseManager, mediaManager):
+    def __init__(self, configManager, controlManager, modelManager, promptManager, embeddingManager, databaseManager, mediaManager):
         self.configManager = configManager
         self.controlManager = controlManager
         self.modelManager = modelManager
+        self.promptManager = promptManager
+        self.embeddingManager = embeddingManager
         self.databaseManager = databaseManager
         self.mediaManager = mediaManager
 
@@ -20,6 +27,41 @@ class AgentManager:
         self.agent_livesummary_hour_to_send_summary = self.configManager.get_config("agent_livesummary_hour_to_send_summary")
         self.agent_livesummary_sent_email_for_day = self.configManager.get_config("agent_livesummary_sent_email_for_day")
 
+        # Map/reduce summarization, rows are cut into chunks by time window and token budget
+        self.agent_summary_chunk_window_in_min = self.configManager.get_config("agent_summary_chunk_window_in_min", 10)
+        self.agent_summary_chunk_max_tokens = self.configManager.get_config("agent_summary_chunk_max_tokens", 2000)
+        self.agent_summary_chunk_summary_max_tokens = self.configManager.get_config("agent_summary_chunk_summary_max_tokens", 200)
+        self.agent_summary_reduce_max_tokens = self.configManager.get_config("agent_summary_reduce_max_tokens", 3000)
+        self.agent_summary_map_worker_count = self.configManager.get_config("agent_summary_map_worker_count", 4)
+
+        # Question answering, keyword and embedding hits are fused by reciprocal rank
+        self.agent_qa_text_model = self.configManager.get_config("agent_qa_text_model", self.agent_livesummary_text_model)
+        self.agent_qa_retrieve_count = self.configManager.get_config("agent_qa_retrieve_count", 50)
+        self.agent_qa_context_count = self.configManager.get_config("agent_qa_context_count", 30)
+        self.agent_qa_rrf_k = self.configManager.get_config("agent_qa_rrf_k", 60)
+        # Keyword hits weaker than this bm25 only share common words with the question, e.g. one frequent term
+        self.agent_qa_min_bm25 = self.configManager.get_config("agent_qa_min_bm25", 3.0)
+        self.agent_qa_max_tokens = self.configManager.get_config("agent_qa_max_tokens", 400)
+        self.agent_qa_context_cache_size = self.configManager.get_config("agent_qa_context_cache_size", 64)
+        # Windows reaching into the present keep gaining rows, their cached context goes stale after this
+        self.agent_qa_context_cache_ttl_in_sec = self.configManager.get_config("agent_qa_context_cache_ttl_in_sec", 60)
+
+        self.qa_context_cache = OrderedDict()
+        self.qa_context_cache_lock = threading.Lock()
+        self.question_stopwords = {
+            'a', 'about', 'an', 'and', 'any', 'are', 'at', 'be', 'by', 'can', 'did', 'do', 'does', 'for', 'from', 'had', 'has', 'have',
+            'how', 'i', 'in', 'is', 'it', 'me', 'my', 'of', 'on', 'or', 'so', 'that', 'the', 'there', 'this', 'to', 'was', 'we', 'were',
+            'what', 'when', 'where', 'which', 'who', 'why', 'with', 'you'
+        }
+        self.context_labels = {
+            ('screenshots', 'ocr_text'): 'Screen text',
+            ('screenshots', 'description_text'): 'Screenshot',
+            ('photos', 'description_text'): 'Photo',
+            ('audio', 'transcript_text'): 'Audio',
+            ('audio', 'description_text'): 'Audio summary',
+            ('summary', 'content_text'): 'Summary',
+        }
+
         self.default_system_prompt = """
             You are the user's helper who is inside their desktop.
             You are provided with some or all the following:
@@ -29,21 +71,222 @@ class AgentManager:
             - Transcripts of their desktop's audio
             Summarize with cool details. Be precise.
         """
+        self.chunk_system_prompt = """
+            You are the user's helper who is inside their desktop.
+            You get a time ordered slice of their activity log: screenshot descriptions, webcam image descriptions and audio transcripts,
+            or summaries of consecutive earlier slices.
+            Summarize it in a few sentences. Keep times, apps, websites, people and topics. Be precise.
+        """
+        self.question_system_prompt = """
+            You are the user's helper who is inside their desktop.
+            You get excerpts of their activity log that were found relevant to their question: screenshot descriptions,
+            screen text, webcam image descriptions, audio transcripts and earlier summaries, each with its time.
+            Answer the question from these excerpts only, mention when things happened. If they do not contain the answer, say so.
+        """
     
+    # region Map/Reduce Summarization
+    def estimate_tokens(self, text):
+        return self.promptManager.count_tokens(text, self.agent_livesummary_text_model) + 1
+    def get_summary_window_in_sec(self, level):
+        # Windows widen with each level (10 min, 1 h, 6 h...) so summaries of neighbouring chunks can merge
+        return self.agent_summary_chunk_window_in_min * 60 * 6 ** level
+    def build_summary_chunks(self, rows, level=0):
+        """Cut time ordered (timestamp, label, text) rows into chunks that stay inside one time window and the token budget."""
+
+        window_in_sec = self.get_summary_window_in_sec(level)
+        chunks = []
+        chunk = None
+        for row in rows:
+            # Summary rows carry the end of the span they cover as a fourth field
+            timestamp, label, text = row[:3]
+            line = f"[{timestamp}] {label}: {text}"
+            line_tokens = self.estimate_tokens(line)
+            window = int(time.mktime(time.strptime(timestamp, '%Y-%m-%d %H:%M:%S')) // window_in_sec)
+            if chunk is None or chunk["window"] != window or chunk["tokens"] + line_tokens > self.agent_summary_chunk_max_tokens:
+                chunk = {"window": window, "tokens": 0, "lines": [], "from_timestamp": timestamp}
+                chunks.append(chunk)
+            chunk["lines"].append(line)
+            chunk["tokens"] += line_tokens
+            chunk["to_timestamp"] = row[3] if len(row) > 3 else timestamp
+        return chunks
+    def summarize_chunk(self, level, from_timestamp, to_timestamp, lines):
+        """Summarize one chunk, reusing the stored summary when the same input was summarized before."""
+
+        content_text = '\n'.join(lines)
+        chunk_key = hashlib.sha256(f"{self.agent_livesummary_text_model}\n{level}\n{content_text}".encode('utf-8')).hexdigest()
+        chunk_summary = self.databaseManager.retrieve_summary_chunk(chunk_key)
+        if chunk_summary is not None:
+            return chunk_summary
+
+        payload = {
+            "model": self.agent_livesummary_text_model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": self.chunk_system_prompt
+                },
+                {
+                    "role": "user",
+                    "content": content_text
+                }
+            ],
+            "max_tokens": self.agent_summary_chunk_summary_max_tokens,
+            "temperature": 0.1
+        }
+        chunk_summary = self.modelManager.send_text_to_llm_api(payload, priority='summary')
+        self.databaseManager.save_summary_chunk(chunk_key, level, from_timestamp, to_timestamp, len(lines), chunk_summary)
+        return chunk_summary
+    def map_summary_chunks(self, level, chunks):
+        with ThreadPoolExecutor(max_workers=self.agent_summary_map_worker_count) as executor:
+            futures = [
+                executor.submit(self.summarize_chunk, level, chunk["from_timestamp"], chunk["to_timestamp"], chunk["lines"])
+                for chunk in chunks
+            ]
+            return [future.result() for future in futures]
+    def reduce_rows(self, rows):
+        """Summarize rows level by level until what is left fits the final prompt, returns the text for it."""
+
+        lines = [f"[{row[0]}] {row[1]}: {row[2]}" for row in rows]
+        level = 0
+        while sum(self.estimate_tokens(line) for line in lines) > self.agent_summary_reduce_max_tokens:
+            chunks = self.build_summary_chunks(rows, level)
+            # Rows spread thinly get a window each, widen it until the chunks are half full on average instead of paying a call per row
+            span_in_sec = time.mktime(time.strptime(rows[-1][0], '%Y-%m-%d %H:%M:%S')) - time.mktime(time.strptime(rows[0][0], '%Y-%m-%d %H:%M:%S'))
+            while sum(chunk["tokens"] for chunk in chunks) < len(chunks) * self.agent_summary_chunk_max_tokens / 2 and self.get_summary_window_in_sec(level) <= span_in_sec:
+                level += 1
+                chunks = self.build_summary_chunks(rows, level)
+            # Each level has to shrink the input or another pass would not help
+            if len(chunks) >= len(rows):
+                break
+            print(f'Summarizing {len(rows)} items in {len(chunks)} chunks at level {level}...')
+            chunk_summaries = self.map_summary_chunks(level, chunks)
+            rows = [
+                (chunk["from_timestamp"], f"Summary until {chunk['to_timestamp']}", chunk_summary, chunk["to_timestamp"])
+                for chunk, chunk_summary in zip(chunks, chunk_summaries)
+            ]
+            lines = [f"[{row[0]}] {row[1]}: {row[2]}" for row in rows]
+            level += 1
+        return '\n'.join(lines)
+    # endregion
+
+    # region Question Answering
+    def retrieve_context(self, question, from_timestamp=None, to_timestamp=None):
+        """Activity log lines most relevant to question within the window, keyword and embedding hits fused by reciprocal rank."""
+
+        cache_key = (' '.join(question.lower().split()), from_timestamp, to_timestamp)
+        # A window that closed in the past can not gain rows, its context stays valid
+        window_closed = to_timestamp is not None and to_timestamp < time.strftime('%Y-%m-%d %H:%M:%S')
+        with self.qa_context_cache_lock:
+            cached = self.qa_context_cache.get(cache_key)
+            if cached is not None and (window_closed or time.time() - cached[0] < self.agent_qa_context_cache_ttl_in_sec):
+                self.qa_context_cache.move_to_end(cache_key)
+                print(f'Reusing context for "{question}"')
+                return cached[1]
+
+        # Any keyword may match, bm25 puts the rows matching most of them first. Both lists drop weak matches,
+        # a question about something never captured gets an empty context rather than the least bad rows
+        keywords = [word for word in re.findall(r'\w+', question.lower()) if word not in self.question_stopwords]
+        ranked_lists = []
+        if keywords:
+            keyword_rows = self.databaseManager.search_text(' '.join(keywords), from_timestamp, to_timestamp, limit=self.agent_qa_retrieve_count, match_any=True)
+            # bm25 is negative, more negative is better
+            ranked_lists.append([row for row in keyword_rows if row[5] <= -self.agent_qa_min_bm25])
+        ranked_lists.append(self.embeddingManager.search_similar(question, from_timestamp, to_timestamp, limit=self.agent_qa_retrieve_count, min_similarity=self.embeddingManager.get_min_similarity()))
+
+        fused_scores = {}
+        for ranked_list in ranked_lists:
+            for rank, (source, field, rowid, *_) in enumerate(ranked_list):
+                fused_scores[(source, field, rowid)] = fused_scores.get((source, field, rowid), 0) + 1 / (self.agent_qa_rrf_k + rank + 1)
+        top_keys = sorted(fused_scores, key=fused_scores.get, reverse=True)[:self.agent_qa_context_count]
+
+        codes = {(table_name, column_name): code for code, table_name, column_name in self.databaseManager.search_fields}
+        line_scores = {}
+        for _, source, field, rowid, timestamp, content in self.databaseManager.retrieve_search_entries([rowid * 16 + codes[(source, field)] for source, field, rowid in top_keys]):
+            line = f"[{timestamp}] {self.context_labels[(source, field)]}: {' '.join(content.split())}"
+            line_scores[line] = fused_scores[(source, field, rowid)]
+
+        # Read as a timeline, the least relevant lines go first when it does not fit
+        context_text = self.promptManager.pack_text(
+            self.agent_qa_text_model, '\n'.join(sorted(line_scores)),
+            reserved_texts=(self.question_system_prompt, question),
+            rank=lambda line: line_scores.get(line, 0), split_sentences=False, label='question context'
+        )
+
+        with self.qa_context_cache_lock:
+            self.qa_context_cache[cache_key] = (time.time(), context_text)
+            self.qa_context_cache.move_to_end(cache_key)
+            while len(self.qa_context_cache) > self.agent_qa_context_cache_size:
+                self.qa_context_cache.popitem(last=False)
+        return context_text
+    def answer_question(self, question, from_timestamp=None, to_timestamp=None):
+        """Answer a question about past activity from the captures relevant to it."""
+
+        print(f'Answering "{question}"...')
+        start_time = time.time()
+
+        context_text = self.retrieve_context(question, from_timestamp, to_timestamp)
+        retrieval_time = time.time() - start_time
+
+        # Only the date, so repeating a question within the day can still hit the response cache
+        user_prompt = (
+            f"Today: {time.strftime('%Y-%m-%d')}\n"
+            f"Time range: {from_timestamp or 'beginning'} to {to_timestamp or 'now'}\n"
+            f"Activity log:\n{context_text or '(nothing relevant found)'}\n\n"
+            f"Question: {question}"
+        )
+        payload = {
+            "model": self.agent_qa_text_model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": self.question_system_prompt
+                },
+                {
+                    "role": "user",
+                    "content": user_prompt
+                }
+            ],
+            "max_tokens": self.agent_qa_max_tokens,
+            "temperature": 0.1
+        }
+        answer_text = self.modelManager.send_text_to_llm_api(payload, priority='question')
+
+        elapsed_time = time.time() - start_time
+        print(f'Answered in {elapsed_time:.2f} seconds ({retrieval_time:.2f} retrieving).\n')
+
+        return answer_text
+    # endregion
+
     def agent_live_summarizer(self):
         print(f'Live Summarizer\n')
 
         timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-        to_timestamp, screenshots_description_text_rows, photos_description_text_rows, audio_transcript_text_rows = self.databaseManager.retrieve_all_sources_text_content_for_livesummary(timestamp)
-        last_summary = self.databaseManager.retrieve_last_summary_for_livesummary()
+        to_timestamp, screenshots_description_text_rows, photos_description_text_rows, audio_transcript_text_rows, last_summary, watermarks = self.databaseManager.retrieve_all_sources_text_content_for_livesummary()
 
-        # FIXME: Figure out how to improve this
-        len_filter = 100
-        screenshots_description_text = '\n'.join(screenshots_description_text_rows[:len_filter])
-        photos_description_text = '\n'.join(photos_description_text_rows[:len_filter])
-        audio_transcript_text = '\n'.join(audio_transcript_text_rows[:len_filter])
+        if not watermarks:
+            print(f'Nothing new to summarize\n')
+            return
+        # Only duplicates and "-" descriptions, nothing worth an LLM call but they are read now
+        if not (screenshots_description_text_rows or photos_description_text_rows or audio_transcript_text_rows):
+            print(f'No usable text in the new rows, skipping summary\n')
+            self.databaseManager.advance_livesummary_watermarks(watermarks)
+            return
 
-        default_user_prompt = f"Running Summary:\n{last_summary}\nScreenshots Descriptions:\n{screenshots_description_text}\nPhotos Descriptions:\n{photos_description_text}\nAudio Transcripts:\n{audio_transcript_text}"
+        # Every new row is covered, long gaps are summarized chunk by chunk before the final reduce
+        rows = sorted(
+            [(row[1], "Screenshot", row[2]) for row in screenshots_description_text_rows] +
+            [(row[1], "Photo", row[2]) for row in photos_description_text_rows] +
+            [(row[1], "Audio", row[2]) for row in audio_transcript_text_rows]
+        )
+        activity_text = self.reduce_rows(rows)
+
+        # Lines start with their timestamp, ranking by the line itself keeps the most recent ones if something still has to go
+        activity_text = self.promptManager.pack_text(
+            self.agent_livesummary_text_model, activity_text,
+            reserved_texts=(self.default_system_prompt, f"Running Summary:\n{last_summary}\nActivity:\n"),
+            rank=lambda line: line, split_sentences=False, label='live summary'
+        )
+        default_user_prompt = f"Running Summary:\n{last_summary}\nActivity:\n{activity_text}"
         print(f"default_user_prompt\n{default_user_prompt}\n")
 
         # Take all text and summarize
@@ -63,10 +306,10 @@ class AgentManager:
             "temperature": 0.1
         }
         # print(f"payload: {payload}")
-        summarize_text = self.modelManager.send_text_to_llm_api(payload)
+        summarize_text = self.modelManager.send_text_to_llm_api(payload, priority='summary')
 
-        # Save to SQL
-        self.databaseManager.save_to_summary_db(timestamp, to_timestamp, timestamp, str(payload), summarize_text)
+        # Save to SQL and advance the watermarks in the same commit
+        self.databaseManager.save_to_summary_db(timestamp, to_timestamp, timestamp, str(payload), summarize_text, watermarks)
         
     def agent_day_summary_ping(self):
         print(f'Day Summary Ping\n')
@@ -78,6 +321,9 @@ class AgentManager:
         if current_time.hour == self.agent_livesummary_hour_to_send_summary and not self.agent_livesummary_sent_email_for_day:
             print(f'Current Hour: {current_time.hour}\n')
             last_summary = self.databaseManager.retrieve_last_summary_for_livesummary()
+            if last_summary is None:
+                print(f'No summary to send yet\n')
+                return
             self.send_html_email(
                 subject="lifelog.ai Summary",
                 recipient_email=self.send_to_email_id,
@@ -137,7 +383,11 @@ class AgentManager:
         while self.controlManager.is_running():        
             print(f'Running Agent Loop')
             
-            self.agent_live_summarizer()
+            # A failed summary leaves the watermarks alone, the next tick picks the same rows up again
+            try:
+                self.agent_live_summarizer()
+            except Exception as e:
+                print("Live Summary Error:", e)
             self.agent_day_summary_ping()
             
             if self.controlManager.stop_event.wait(self.agent_livesummary_loop_time_in_min):
@@ -2,15 +2,109 @@ import os
 import wave
 import time
 import pyaudio
+import threading
+import numpy as np
+
+try:
+    # libsndfile encoder for FLAC/Opus archives, plain 16 kHz WAV without it
+    import soundfile
+except ImportError:
+    soundfile = None
+
+# region AudioRingBuffer
+class AudioRingBuffer:
+    def __init__(self, capacity_in_bytes):
+        # Allocated once, the capture callback and the disk writer only move positions around it
+        self.buffer = bytearray(capacity_in_bytes)
+        self.capacity = capacity_in_bytes
+        self.read_position = 0
+        self.write_position = 0
+        self.dropped_bytes = 0
+        self.condition = threading.Condition()
+
+    def write(self, data):
+        """Copy captured bytes in, overwriting the oldest unread audio if the writer fell a full buffer behind."""
+        with self.condition:
+            data = memoryview(data)
+            if len(data) > self.capacity:
+                self.dropped_bytes += len(data) - self.capacity
+                data = data[-self.capacity:]
+
+            overflow = (self.write_position - self.read_position) + len(data) - self.capacity
+            if overflow > 0:
+                self.read_position += overflow
+                self.dropped_bytes += overflow
+
+            start = self.write_position % self.capacity
+            first_length = min(len(data), self.capacity - start)
+            self.buffer[start:start + first_length] = data[:first_length]
+            self.buffer[:len(data) - first_length] = data[first_length:]
+            self.write_position += len(data)
+            self.condition.notify()
+
+    def read(self, max_bytes, timeout=None):
+        """Wait for audio and return up to max_bytes of it, empty bytes on timeout."""
+        with self.condition:
+            if self.write_position == self.read_position:
+                self.condition.wait(timeout)
+
+            length = min(self.write_position - self.read_position, max_bytes)
+            start = self.read_position % self.capacity
+            first_length = min(length, self.capacity - start)
+            data = bytes(self.buffer[start:start + first_length]) + bytes(self.buffer[:length - first_length])
+            self.read_position += length
+            return data
+# endregion
+
+# region AudioResampler
+class AudioResampler:
+    def __init__(self, input_rate, output_rate, channels, taps=63):
+        self.step = input_rate / output_rate
+        self.channels = channels
+
+        # Windowed sinc low-pass below the new Nyquist so the decimation doesn't alias
+        cutoff = 0.9 * min(input_rate, output_rate) / 2 / input_rate
+        n = np.arange(taps) - (taps - 1) / 2
+        self.kernel = (2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)).astype(np.float32)
+        self.kernel /= self.kernel.sum()
+
+        # Carried between chunks so segment boundaries don't click
+        self.history = np.zeros(taps - 1, dtype=np.float32)
+        self.last_sample = np.float32(0)
+        self.position = 1.0
+
+    def process(self, data):
+        """Downmix interleaved int16 bytes to mono and resample, returns int16 samples at the output rate."""
+        # No input means no output, convolving the history alone would emit stale samples and shift the phase
+        if not data:
+            return np.zeros(0, dtype=np.int16)
+
+        mono = np.frombuffer(data, dtype=np.int16).reshape(-1, self.channels).astype(np.float32).mean(axis=1)
+        signal = np.concatenate((self.history, mono))
+        filtered = np.convolve(signal, self.kernel, mode='valid')
+        self.history = signal[len(signal) - len(self.history):]
+
+        # Index 0 is the previous chunk's last sample so interpolation spans the boundary
+        samples = np.concatenate(([self.last_sample], filtered))
+        positions = np.arange(self.position, len(samples) - 1, self.step)
+        resampled = np.interp(positions, np.arange(len(samples)), samples)
+        self.position = (positions[-1] + self.step if len(positions) else self.position) - (len(samples) - 1)
+        self.last_sample = samples[-1]
+
+        return np.clip(np.round(resampled), -32768, 32767).astype(np.int16)
+# endregion
 
 # region AudioManager
 class AudioManager:
-    def __init__(self, configManager, controlManager, modelManager, databaseManager, mediaManager):
+    def __init__(self, configManager, controlManager, modelManager, batchManager, promptManager, databaseManager, mediaManager, inferenceManager):
         self.configManager = configManager
         self.controlManager = controlManager
         self.modelManager = modelManager
+        self.batchManager = batchManager
+        self.promptManager = promptManager
         self.databaseManager = databaseManager
         self.mediaManager = mediaManager
+        self.inferenceManager = inferenceManager
 
         self.audio_loop_time_in_min = self.configManager.get_config("audio_loop_time_in_min") * 60
         self.audio_audio_model = self.configManager.get_config("audio_audio_model")
@@ -21,72 +115,317 @@ class AudioManager:
         self.mia_channels = 2
         self.frame_length = 1024
         self.sample_rate = 44100
+        self.sample_width = pyaudio.get_sample_size(self.audio_format)
+        self.frame_size = self.mia_channels * self.sample_width
+        # Archived segments are mono at speech rate, audio_compression_perc is a quality like the image ones,
+        # so a higher value means a lower libsndfile compression level (bigger, higher bitrate Opus)
+        self.audio_encoding_format = self.configManager.get_config("audio_encoding_format", "flac")
+        self.audio_encoding_sample_rate = self.configManager.get_config("audio_encoding_sample_rate", 16000)
+        self.audio_compression_perc = self.configManager.get_config("audio_compression_perc", 50)
+        self.audio_encodings = {
+            "flac": ("FLAC", "PCM_16", "flac"),
+            "opus": ("OGG", "OPUS", "ogg"),
+            "wav": ("WAV", "PCM_16", "wav"),
+        }
         self.default_system_prompt = "You have the audio transcript of my Windows desktop's microphone. It can be a youtube video, rick and morty series, conversation between the user and someone next to them, a zoom call and many others. Describe the transcript and answer with cool details. If you don't know return '-'"
 
-        # Set up recorder
+        # 'batch' transcribes each segment once it closes, 'streaming' transcribes overlapping chunks while recording
+        self.audio_transcription_mode = self.configManager.get_config("audio_transcription_mode", "batch")
+
+        # Voice activity detection, silent segments are never uploaded
+        self.audio_vad_enabled = self.configManager.get_config("audio_vad_enabled", True)
+        self.audio_vad_energy_threshold_in_db = self.configManager.get_config("audio_vad_energy_threshold_in_db", -45)
+        self.audio_vad_min_speech_in_sec = self.configManager.get_config("audio_vad_min_speech_in_sec", 0.5)
+        self.audio_vad_padding_in_sec = self.configManager.get_config("audio_vad_padding_in_sec", 0.5)
+        # Room noise floor followed across segments and chunks, it falls at once and rises slowly so a long stretch of speech never becomes the floor
+        self.audio_vad_noise_floor_rise = self.configManager.get_config("audio_vad_noise_floor_rise", 0.05)
+        # Steady sounds (fans, hum) rise it fast instead, they become the floor once they settle
+        self.audio_vad_noise_floor_steady_rise = self.configManager.get_config("audio_vad_noise_floor_steady_rise", 0.5)
+        self.noise_floor_in_db = None
+        self.noise_floor_lock = threading.Lock()
+
+        # Segment length follows audio energy between the min and max intervals, loud audio also pulls the other captures forward
+        self.audio_min_interval_in_sec = self.configManager.get_config("audio_min_interval_in_sec", self.audio_loop_time_in_min / 4)
+        self.audio_max_interval_in_sec = self.configManager.get_config("audio_max_interval_in_sec", self.audio_loop_time_in_min * 4)
+        self.audio_activity_energy_threshold_in_db = self.configManager.get_config("audio_activity_energy_threshold_in_db", -35)
+        self.controlManager.register_capture('audio', self.audio_loop_time_in_min, self.audio_min_interval_in_sec, self.audio_max_interval_in_sec)
+
+        # Seconds of audio the writer can fall behind before the oldest samples get overwritten
+        self.audio_ring_buffer_in_sec = self.configManager.get_config("audio_ring_buffer_in_sec", 30)
+        self.ring_buffer = AudioRingBuffer(int(self.audio_ring_buffer_in_sec * self.sample_rate) * self.frame_size)
+
+        # Set up recorder, PyAudio's own thread drains the device into the ring buffer
         self.p = pyaudio.PyAudio()
         self.stream = self.p.open(
             format=self.audio_format,
             channels=self.mia_channels,
             rate=self.sample_rate,
             frames_per_buffer=self.frame_length,
-            input=True
+            input=True,
+            start=False,
+            stream_callback=self.stream_callback
+        )
+    
+    def stream_callback(self, in_data, frame_count, time_info, status):
+        if status & pyaudio.paInputOverflow:
+            print('Audio input overflow')
+        self.ring_buffer.write(in_data)
+        return (None, pyaudio.paContinue)
+    def open_segment(self):
+        filename = time.strftime('%Y-%m-%d-%H-%M-%S')
+
+        if soundfile is None or self.audio_encoding_format not in self.audio_encodings:
+            if self.audio_encoding_format != "wav":
+                print(f'Cannot encode {self.audio_encoding_format}, saving WAV instead')
+            audio_filename = f"{filename}.wav"
+            wf = wave.open(os.path.join(self.audio_folder_path, audio_filename), 'wb')
+            wf.setnchannels(1)
+            wf.setsampwidth(self.sample_width)
+            wf.setframerate(self.audio_encoding_sample_rate)
+            return audio_filename, wf
+
+        file_format, subtype, extension = self.audio_encodings[self.audio_encoding_format]
+        audio_filename = f"{filename}.{extension}"
+        wf = soundfile.SoundFile(
+            os.path.join(self.audio_folder_path, audio_filename), 'w',
+            samplerate=self.audio_encoding_sample_rate, channels=1,
+            format=file_format, subtype=subtype,
+            compression_level=1 - self.audio_compression_perc / 100 if file_format != "WAV" else None
         )
+        return audio_filename, wf
+    def write_segment(self, wf, samples):
+        if isinstance(wf, wave.Wave_write):
+            wf.writeframesraw(samples.tobytes())
+        else:
+            wf.write(samples)
+    def close_segment(self, audio_filename, wf, written_bytes):
+        wf.close()
+        audio_path = os.path.join(self.audio_folder_path, audio_filename)
+
+        # Stopped before any audio came in
+        if written_bytes == 0:
+            os.remove(audio_path)
+            return
+
+        encoded_size = os.path.getsize(audio_path)
+        print(f'Saved {audio_filename}: {encoded_size / 1e6:.2f} MB, {written_bytes / max(encoded_size, 1):.1f}x smaller than the raw capture')
+
+        # Save to SQL as pending, transcript and description are filled in by the inference workers
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+        rowid = self.databaseManager.save_to_audio_db(timestamp, audio_filename, None, None)
+        self.inferenceManager.submit_row('audio', rowid, self.process_audio, audio_filename)
     
+    def track_noise_floor(self, samples, sample_rate, channels):
+        """Fold the quiet end of a segment or chunk into the running noise floor and return the floor to judge it against."""
+        with self.noise_floor_lock:
+            self.noise_floor_in_db = self.mediaManager.update_noise_floor(
+                self.noise_floor_in_db, samples, sample_rate, channels,
+                rise=self.audio_vad_noise_floor_rise,
+                steady_rise=self.audio_vad_noise_floor_steady_rise
+            )
+            return self.noise_floor_in_db
+    def is_speech(self, samples, sample_rate):
+        return self.mediaManager.detect_speech(
+            samples, sample_rate, 1,
+            energy_threshold_in_db=self.audio_vad_energy_threshold_in_db,
+            min_speech_in_sec=self.audio_vad_min_speech_in_sec,
+            padding_in_sec=0,
+            noise_floor_in_db=self.track_noise_floor(samples, sample_rate, 1)
+        ) is not None
+    def open_transcription_stream(self, audio_filename):
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+        rowid = self.databaseManager.save_streaming_audio_to_db(timestamp, audio_filename)
+
+        def on_transcript(transcript_text, latency):
+            self.databaseManager.append_audio_transcript(rowid, transcript_text)
+            print(f'Appended streamed transcript to audio row {rowid}, {latency:.2f}s after capture')
+
+        stream = self.modelManager.open_transcription_stream(
+            self.audio_audio_model, self.audio_encoding_sample_rate, on_transcript,
+            vad=self.is_speech if self.audio_vad_enabled else None
+        )
+        return rowid, stream
+    def close_transcription_stream(self, rowid, stream, audio_filename, written_bytes):
+        # Runs off the writer thread, the last chunks may still be transcribing
+        try:
+            stream.close()
+        except Exception as e:
+            # The whole segment is on disk, the batch path transcribes it instead
+            print("Transcription Stream Error:", e)
+            self.databaseManager.restart_streaming_audio(rowid)
+            self.inferenceManager.submit_row('audio', rowid, self.process_audio, audio_filename)
+            return
+
+        # Stopped before any audio came in, nothing to keep and no row left streaming to hold the summary back
+        if written_bytes == 0:
+            self.databaseManager.delete_streaming_audio(rowid)
+            os.remove(os.path.join(self.audio_folder_path, audio_filename))
+            return
+
+        # Same VAD record as a batch segment, a stream with no speech chunk is done without any further call
+        if self.audio_vad_enabled:
+            speech_in_sec = stream.speech_length / stream.sample_rate
+            silent_in_sec = stream.silent_length / stream.sample_rate
+            if speech_in_sec == 0:
+                print(f'VAD: {silent_in_sec:.1f}s of streamed silence, nothing to describe')
+                self.databaseManager.update_audio_vad_db(rowid, 'silent', 0.0, silent_in_sec)
+                self.databaseManager.update_audio_db(rowid, None, None)
+                return
+            self.databaseManager.update_audio_vad_db(rowid, 'speech', speech_in_sec, silent_in_sec)
+        elif self.databaseManager.retrieve_audio_transcript(rowid) is None:
+            print(f'Stream transcribed no words, nothing to describe')
+            self.databaseManager.update_audio_db(rowid, None, None)
+            return
+
+        # Transcript is complete, the inference workers only have to describe it
+        self.databaseManager.finish_streaming_audio(rowid)
+        self.inferenceManager.submit_row('audio', rowid, self.process_audio, audio_filename)
+
+    def read_audio(self, audio_path):
+        """Interleaved int16 samples, sample rate and channel count of a saved segment."""
+        if soundfile is not None:
+            samples, sample_rate = soundfile.read(audio_path, dtype='int16', always_2d=True)
+            return samples.reshape(-1), sample_rate, samples.shape[1]
+
+        with wave.open(audio_path, 'rb') as wf:
+            channels = wf.getnchannels()
+            sample_rate = wf.getframerate()
+            recording_data = wf.readframes(wf.getnframes())
+        return np.frombuffer(recording_data, dtype=np.int16), sample_rate, channels
+    def write_audio(self, audio_path, samples, sample_rate, channels):
+        if soundfile is not None:
+            soundfile.write(audio_path, samples.reshape(-1, channels), sample_rate)
+            return
+
+        with wave.open(audio_path, 'wb') as wf:
+            wf.setnchannels(channels)
+            wf.setsampwidth(self.sample_width)
+            wf.setframerate(sample_rate)
+            wf.writeframes(samples.tobytes())
+
+    def trim_silence(self, rowid, audio_path):
+        """Run the VAD over a saved segment, returns the path to transcribe or None when it is all silence."""
+
+        samples, sample_rate, channels = self.read_audio(audio_path)
+        total_in_sec = len(samples) / channels / sample_rate
+
+        start_time = time.time()
+        speech_range = self.mediaManager.detect_speech(
+            samples, sample_rate, channels,
+            energy_threshold_in_db=self.audio_vad_energy_threshold_in_db,
+            min_speech_in_sec=self.audio_vad_min_speech_in_sec,
+            padding_in_sec=self.audio_vad_padding_in_sec,
+            noise_floor_in_db=self.track_noise_floor(samples, sample_rate, channels)
+        )
+        elapsed_time = time.time() - start_time
+
+        if speech_range is None:
+            print(f'VAD: {total_in_sec:.1f}s of silence, skipping transcription ({elapsed_time * 1000:.1f} ms)')
+            self.databaseManager.update_audio_vad_db(rowid, 'silent', 0.0, total_in_sec)
+            return None
+
+        start, end = speech_range
+        speech_in_sec = (end - start) / sample_rate
+        print(f'VAD: {speech_in_sec:.1f}s of speech in {total_in_sec:.1f}s ({elapsed_time * 1000:.1f} ms)')
+        self.databaseManager.update_audio_vad_db(rowid, 'speech', speech_in_sec, total_in_sec - speech_in_sec)
+        if start == 0 and end * channels == len(samples):
+            return audio_path
+
+        # Upload only the trimmed span, the full recording stays on disk
+        audio_root, audio_extension = os.path.splitext(audio_path)
+        trimmed_path = f"{audio_root}.speech{audio_extension}"
+        self.write_audio(trimmed_path, samples[start * channels:end * channels], sample_rate, channels)
+        return trimmed_path
+    def process_audio(self, rowid, audio_filename):
+        audio_path = os.path.join(self.audio_folder_path, audio_filename)
+
+        # Streamed segments already have their transcript
+        transcript_text = self.databaseManager.retrieve_audio_transcript(rowid)
+        if transcript_text is None:
+            # Drop silence before any network call
+            transcribe_path = audio_path
+            if self.audio_vad_enabled:
+                transcribe_path = self.trim_silence(rowid, audio_path)
+                if transcribe_path is None:
+                    self.databaseManager.update_audio_db(rowid, None, None)
+                    return
+
+            # Pass through transcribe API
+            try:
+                transcript_text = self.modelManager.send_audio_to_api(transcribe_path, self.audio_audio_model)
+            finally:
+                if transcribe_path != audio_path:
+                    os.remove(transcribe_path)
+            if transcript_text is None:
+                raise ValueError(f"No transcript from {self.audio_audio_model}")
+        
+        # Pass transcript through LLM, batched with other rows described around the same time
+        prompt_text = self.promptManager.pack_text(self.audio_text_model, transcript_text, reserved_texts=(self.default_system_prompt,), label='audio transcript')
+        description_text = self.batchManager.describe(self.audio_text_model, self.default_system_prompt, prompt_text, max_tokens=300, temperature=0.1)
+
+        # Save to SQL
+        self.databaseManager.update_audio_db(rowid, transcript_text, description_text)
+
     def audio_loop(self):
         print(f'Audio Loop...\n')
 
         if not os.path.exists(self.audio_folder_path):
             os.makedirs(self.audio_folder_path)
 
+        segment_in_sec = self.audio_loop_time_in_min
+        activity_amplitude = 32768 * 10 ** (self.audio_activity_energy_threshold_in_db / 20)
+        read_length_in_bytes = self.frame_length * self.frame_size
+        dropped_bytes = self.ring_buffer.dropped_bytes
+        resampler = AudioResampler(self.sample_rate, self.audio_encoding_sample_rate, self.mia_channels)
+
+        self.stream.start_stream()
         while self.controlManager.is_running():
-            rec = []
-            current = time.time()
-            end = time.time() + self.audio_loop_time_in_min
-            
-            while current <= end:
-                data = self.stream.read(self.frame_length)
-                current = time.time()
-                rec.append(data)
-        
-            # Pull data
-            timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-            filename = time.strftime('%Y-%m-%d-%H-%M-%S')
-            recording_data = b''.join(rec)
+            print(f'Running Audio Loop')
 
-            # Save orginal audio to filepath
-            audio_filename = f"{filename}.wav"
-            audio_path = os.path.join(self.audio_folder_path, audio_filename)
-            wf = wave.open(audio_path, 'wb')
-            wf.setnchannels(self.mia_channels)
-            wf.setsampwidth(self.p.get_sample_size(self.audio_format))
-            wf.setframerate(self.sample_rate)
-            wf.writeframes(recording_data)
-            wf.close()
+            # Segments are cut by sample count so no audio falls between two files
+            segment_length_in_bytes = int(segment_in_sec * self.sample_rate) * self.frame_size
+            audio_filename, wf = self.open_segment()
+            stream = None
+            if self.audio_transcription_mode == "streaming":
+                rowid, stream = self.open_transcription_stream(audio_filename)
 
-            # Pass through transcribe API
-            transcript_text = self.modelManager.send_audio_to_api(audio_path, self.audio_audio_model)
-            
-            # Pass transcript through LLM
-            payload = {
-                "model": self.audio_text_model,
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": self.default_system_prompt
-                    },
-                    {
-                        "role": "user",
-                        "content": transcript_text
-                    }
-                ],
-                "max_tokens": 300,
-                "temperature": 0.1
-            }
-            description_text = self.modelManager.send_text_to_llm_api(payload)
-
-            # Save to SQL
-            self.databaseManager.save_to_audio_db(timestamp, audio_filename, transcript_text, description_text)
-
-            if self.controlManager.stop_event.wait(0):
-                break
\ No newline at end of file
+            written_bytes = 0
+            energy_total = 0.0
+            energy_sample_count = 0
+            segment_activity = 0.0
+            while written_bytes < segment_length_in_bytes and self.controlManager.is_running():
+                data = self.ring_buffer.read(min(read_length_in_bytes, segment_length_in_bytes - written_bytes), timeout=1)
+                if not data:
+                    continue
+
+                samples = resampler.process(data)
+                self.write_segment(wf, samples)
+                if stream is not None:
+                    stream.feed(samples)
+                written_bytes += len(data)
+
+                # RMS over roughly a second of audio as the activity signal
+                energy_total += float(np.dot(samples, samples.astype(np.float64)))
+                energy_sample_count += len(samples)
+                if energy_sample_count >= self.audio_encoding_sample_rate:
+                    activity = (energy_total / energy_sample_count) ** 0.5 / activity_amplitude
+                    self.controlManager.report_activity('audio', activity)
+                    segment_activity = max(segment_activity, activity)
+                    energy_total = 0.0
+                    energy_sample_count = 0
+
+            if self.ring_buffer.dropped_bytes > dropped_bytes:
+                print(f'Audio writer fell behind, dropped {(self.ring_buffer.dropped_bytes - dropped_bytes) / self.frame_size / self.sample_rate:.2f} seconds')
+                dropped_bytes = self.ring_buffer.dropped_bytes
+
+            if stream is None:
+                self.close_segment(audio_filename, wf, written_bytes)
+            else:
+                wf.close()
+                threading.Thread(target=self.close_transcription_stream, args=(rowid, stream, audio_filename, written_bytes), daemon=True).start()
+
+            # Any loud second in this segment keeps the next one short
+            self.controlManager.report_activity('audio', segment_activity)
+            segment_in_sec = self.controlManager.plan_next_capture('audio')
+        self.stream.stop_stream()
+# endregion
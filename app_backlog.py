@@ -0,0 +1,89 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# region BacklogManager
+class BacklogManager:
+    def __init__(self, configManager, controlManager, databaseManager, inferenceManager, rateLimitManager, cacheManager, batchManager, screenshotManager, photoManager, audioManager):
+        self.configManager = configManager
+        self.controlManager = controlManager
+        self.databaseManager = databaseManager
+        self.inferenceManager = inferenceManager
+        self.rateLimitManager = rateLimitManager
+        self.cacheManager = cacheManager
+        self.batchManager = batchManager
+
+        self.backlog_loop_time_in_min = self.configManager.get_config("backlog_loop_time_in_min", 5) * 60
+        self.backlog_worker_count = self.configManager.get_config("backlog_worker_count", 2)
+        self.backlog_batch_size = self.configManager.get_config("backlog_batch_size", 50)
+        # Fresh rows belong to the live pipeline, the backlog only takes rows older than this
+        self.backlog_min_age_in_sec = self.configManager.get_config("backlog_min_age_in_sec", 120)
+
+        self.sources = [
+            ('screenshots', 'image_path', screenshotManager.process_screenshot),
+            ('photos', 'image_path', photoManager.process_photo),
+            ('audio', 'audio_path', audioManager.process_audio),
+        ]
+
+    def process_backlog(self):
+        """Drain pending rows of every source in batches, returns how many rows were attempted."""
+
+        print(f'Processing Backlog...')
+
+        attempted_count = 0
+        # Backlog model calls queue behind live captures and summaries at the rate limiter
+        with ThreadPoolExecutor(max_workers=self.backlog_worker_count, initializer=self.rateLimitManager.set_thread_priority, initargs=('backfill',)) as executor:
+            for table_name, media_column, job_function in self.sources:
+                # Rows that fail go back to pending, only look past them so they wait for the next pass
+                after_rowid = 0
+                while self.controlManager.is_running():
+                    before_timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() - self.backlog_min_age_in_sec))
+                    rows = self.databaseManager.retrieve_pending_rows(table_name, media_column, after_rowid, before_timestamp, self.backlog_batch_size)
+                    if not rows:
+                        break
+                    after_rowid = rows[-1][0]
+                    print(f'Backlog {table_name}: {len(rows)} pending rows')
+
+                    futures = [
+                        executor.submit(self.inferenceManager.process_row, table_name, rowid, job_function, media_filename)
+                        for rowid, media_filename in rows
+                    ]
+                    for future in futures:
+                        try:
+                            future.result()
+                        except Exception as e:
+                            print(f"Backlog Error ({table_name}):", e)
+                    attempted_count += len(rows)
+
+        print(f'Processed {attempted_count} backlog rows!\n')
+
+        return attempted_count
+
+    def log_stats(self):
+        """Print the model call counters kept by the rate limiter, response cache and batcher since start."""
+        for key, stats in self.rateLimitManager.get_stats().items():
+            print(f'Rate limit {key}: {stats["requests"]} requests, {stats["tokens"]} tokens, {stats["throttled"]} throttled for {stats["wait_time_total"]:.1f}s, {stats["retries"]} retries, {stats["errors"]} errors, {stats["waiting"]} waiting')
+
+        stats = self.cacheManager.get_stats()
+        print(f'Response cache: {stats["hits"]} hits, {stats["misses"]} misses ({stats["hit_rate"]:.0%} hit rate), {stats["inserts"]} inserts, {stats["evicted"]} evicted')
+
+        stats = self.batchManager.get_stats()
+        print(f'Batching: {stats["items"]} items in {stats["batches"]} batches, {stats["cached_items"]} cached, {stats["fallback_items"]} retried alone when missing from a batch reply\n')
+
+    def backlog_loop(self):
+        print(f'Backlog Loop\n')
+
+        while self.controlManager.is_running():
+            print(f'Running Backlog Loop')
+
+            self.process_backlog()
+            self.log_stats()
+
+            # Cold partitions leave data.db once everything in them is processed and summarized
+            try:
+                self.databaseManager.archive_partitions()
+            except Exception as e:
+                print("Archive Error:", e)
+
+            if self.controlManager.stop_event.wait(self.backlog_loop_time_in_min):
+                break
+# endregion
@@ -0,0 +1,181 @@
+import re
+import json
+import time
+import threading
+from concurrent.futures import Future
+
+# region BatchManager
+class BatchManager:
+    def __init__(self, configManager, modelManager):
+        self.configManager = configManager
+        self.modelManager = modelManager
+
+        self.batch_enabled = self.configManager.get_config("batch_enabled", True)
+        # How long the first item of a batch waits for company
+        self.batch_window_in_ms = self.configManager.get_config("batch_window_in_ms", 1000)
+        self.batch_max_items = self.configManager.get_config("batch_max_items", 8)
+        self.batch_max_tokens = self.configManager.get_config("batch_max_tokens", 4000)
+        # Longest a caller waits for its answer, covers the rate limiter queue and the retries behind it
+        self.batch_timeout_in_sec = self.configManager.get_config("batch_timeout_in_sec", 600)
+
+        self.batch_instructions = (
+            "\n\nYou will get several independent items as a JSON array of objects with an \"id\" and a \"text\". "
+            "Handle every item on its own as described above. Answer with only a JSON object of the form "
+            "{\"results\": [{\"id\": <id>, \"response\": \"<your answer for that item>\"}]} with exactly one result per item."
+        )
+
+        # Open batches by (model, system prompt, max_tokens, temperature, priority)
+        self.batches = {}
+        self.batches_lock = threading.Lock()
+
+        self.stats_lock = threading.Lock()
+        self.item_count = 0
+        self.cached_item_count = 0
+        self.batch_count = 0
+        self.fallback_item_count = 0
+
+    def build_payload(self, model, system_prompt, text, max_tokens, temperature):
+        # Same shape the capture managers always sent, so single calls and the cache keep their keys
+        return {
+            "model": model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": system_prompt
+                },
+                {
+                    "role": "user",
+                    "content": text
+                }
+            ],
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+
+    def describe(self, model, system_prompt, text, max_tokens=300, temperature=0.1):
+        """Get the model's answer for one text, sharing a request with other texts that arrive within the batch window."""
+
+        payload = self.build_payload(model, system_prompt, text, max_tokens, temperature)
+        if not self.batch_enabled:
+            return self.modelManager.send_text_to_llm_api(payload)
+
+        # Items answered before never join a batch
+        cache_key = self.modelManager.cacheManager.make_key(payload)
+        cached_text = self.modelManager.cacheManager.get(cache_key)
+        with self.stats_lock:
+            self.item_count += 1
+            if cached_text is not None:
+                self.cached_item_count += 1
+        if cached_text is not None:
+            return cached_text
+
+        priority = self.modelManager.rateLimitManager.get_thread_priority()
+        batch_key = (model, system_prompt, max_tokens, temperature, priority)
+        item = {"payload": payload, "cache_key": cache_key, "tokens": len(text) // 4 + 1, "future": Future()}
+
+        ready_batches = []
+        with self.batches_lock:
+            batch = self.batches.get(batch_key)
+            if batch is not None and batch["tokens"] + item["tokens"] > self.batch_max_tokens:
+                # Would not fit, send what is there now and start over
+                ready_batches.append(self.batches.pop(batch_key))
+                batch = None
+            if batch is None:
+                batch = {"items": [], "tokens": 0, "timer": threading.Timer(self.batch_window_in_ms / 1000, self.flush, (batch_key,))}
+                batch["timer"].daemon = True
+                batch["timer"].start()
+                self.batches[batch_key] = batch
+            batch["items"].append(item)
+            batch["tokens"] += item["tokens"]
+            if len(batch["items"]) >= self.batch_max_items:
+                ready_batches.append(self.batches.pop(batch_key))
+
+        for ready_batch in ready_batches:
+            ready_batch["timer"].cancel()
+            threading.Thread(target=self.send_batch, args=(ready_batch["items"], priority), daemon=True).start()
+
+        # Raises TimeoutError so the inference job fails and the row goes back to pending
+        return item["future"].result(timeout=self.batch_timeout_in_sec)
+    def flush(self, batch_key):
+        with self.batches_lock:
+            batch = self.batches.pop(batch_key, None)
+        if batch is not None:
+            self.send_batch(batch["items"], batch_key[-1])
+
+    def parse_results(self, response_text, item_count):
+        """Map ids to answers from the model's JSON, tolerating code fences around it."""
+        match = re.search(r'\{.*\}', response_text or '', re.DOTALL)
+        if match is None:
+            return {}
+        results = json.loads(match.group(0))["results"]
+        return {
+            int(result["id"]): str(result["response"])
+            for result in results
+            if str(result.get("id", "")).isdigit() and 0 <= int(result["id"]) < item_count and result.get("response") is not None
+        }
+    def send_batch(self, items, priority):
+        try:
+            if len(items) == 1:
+                self.send_single(items[0], priority)
+                return
+
+            print(f'Sending batch of {len(items)} items...')
+            start_time = time.time()
+
+            first_payload = items[0]["payload"]
+            batch_payload = self.build_payload(
+                first_payload["model"],
+                first_payload["messages"][0]["content"] + self.batch_instructions,
+                json.dumps([{"id": index, "text": item["payload"]["messages"][1]["content"]} for index, item in enumerate(items)], ensure_ascii=False),
+                first_payload["max_tokens"] * len(items),
+                first_payload["temperature"]
+            )
+
+            results = {}
+            try:
+                results = self.parse_results(self.modelManager.send_text_to_llm_api(batch_payload, priority), len(items))
+            except Exception as e:
+                print("Batch Error:", e)
+
+            for index, item in enumerate(items):
+                if index in results:
+                    # Cached under the single item key so a repeat is served without batching
+                    self.modelManager.cacheManager.set(item["cache_key"], item["payload"]["model"], results[index])
+                    item["future"].set_result(results[index])
+
+            missing_items = [item for index, item in enumerate(items) if index not in results]
+            with self.stats_lock:
+                self.batch_count += 1
+                self.fallback_item_count += len(missing_items)
+
+            elapsed_time = time.time() - start_time
+            print(f'Batch of {len(items)} answered {len(items) - len(missing_items)} items in {elapsed_time:.2f} seconds.')
+
+            # Whatever the batch could not answer goes out on its own
+            for item in missing_items:
+                self.send_single(item, priority)
+        except Exception as e:
+            print("Send Batch Error:", e)
+            for item in items:
+                if not item["future"].done():
+                    item["future"].set_exception(e)
+        finally:
+            # Nobody waits forever on an item this batch dropped
+            for item in items:
+                if not item["future"].done():
+                    item["future"].set_exception(RuntimeError("Batch ended without an answer for this item"))
+    def send_single(self, item, priority):
+        try:
+            item["future"].set_result(self.modelManager.send_text_to_llm_api(item["payload"], priority))
+        except Exception as e:
+            item["future"].set_exception(e)
+
+    def get_stats(self):
+        with self.stats_lock:
+            return {
+                "items": self.item_count,
+                "cached_items": self.cached_item_count,
+                "batches": self.batch_count,
+                "fallback_items": self.fallback_item_count,
+            }
+# endregion
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# region CacheManager
+class CacheManager:
+    def __init__(self, configManager):
+        self.configManager = configManager
+
+        self.cache_db_path = 'data/sql/cache.db'
+        self.sql_folder_path = 'data/sql/'
+
+        self.cache_enabled = self.configManager.get_config("cache_enabled", True)
+        self.cache_ttl_in_hours = self.configManager.get_config("cache_ttl_in_hours", 24 * 7)
+        self.cache_max_size_in_mb = self.configManager.get_config("cache_max_size_in_mb", 256)
+        # Eviction runs every this many inserts instead of on every one
+        self.cache_eviction_interval = self.configManager.get_config("cache_eviction_interval", 100)
+
+        # Own file so cache traffic never queues behind the capture writer
+        self.local = threading.local()
+        self.stats_lock = threading.Lock()
+        self.hit_count = 0
+        self.miss_count = 0
+        self.insert_count = 0
+        self.evicted_count = 0
+
+    def get_connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # The file is created on first use, so the paths can still be pointed elsewhere after construction
+            if not os.path.exists(self.sql_folder_path):
+                os.makedirs(self.sql_folder_path)
+            conn = sqlite3.connect(self.cache_db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS response_cache
+            (key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, created_at REAL, accessed_at REAL)
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_accessed_at ON response_cache (accessed_at)")
+            self.local.conn = conn
+        return conn
+
+    def make_key(self, payload):
+        """sha256 over the canonical JSON of model, messages and every other request parameter."""
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        if not self.cache_enabled:
+            return None
+
+        start_time = time.time()
+        conn = self.get_connection()
+        row = conn.execute("SELECT response, created_at, accessed_at FROM response_cache WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or now - row[1] > self.cache_ttl_in_hours * 3600:
+            with self.stats_lock:
+                self.miss_count += 1
+            return None
+
+        # Access time only feeds the size eviction, an hour of resolution saves a write on most hits
+        if now - row[2] > 3600:
+            conn.execute("UPDATE response_cache SET accessed_at = ? WHERE key = ?", (now, key))
+
+        with self.stats_lock:
+            self.hit_count += 1
+        elapsed_time = time.time() - start_time
+        print(f'Cache hit {key[:12]} in {elapsed_time * 1e6:.0f} µs')
+        return row[0]
+    def set(self, key, model, response):
+        if not self.cache_enabled or response is None:
+            return
+
+        now = time.time()
+        self.get_connection().execute(
+            "INSERT OR REPLACE INTO response_cache (key, model, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, model, response, len(response.encode('utf-8')), now, now)
+        )
+
+        with self.stats_lock:
+            self.insert_count += 1
+            evict = self.insert_count % self.cache_eviction_interval == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones until the cache fits its size budget."""
+
+        print(f'Evicting Cache...')
+
+        conn = self.get_connection()
+        expired_count = conn.execute("DELETE FROM response_cache WHERE created_at < ?", (time.time() - self.cache_ttl_in_hours * 3600,)).rowcount
+
+        max_size = self.cache_max_size_in_mb * 1024 * 1024
+        total_size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+        oversize_count = 0
+        if total_size > max_size:
+            # Walk from the least recently used entry until enough bytes are freed
+            cutoff = None
+            freed_size = 0
+            for accessed_at, size in conn.execute("SELECT accessed_at, size FROM response_cache ORDER BY accessed_at"):
+                freed_size += size
+                cutoff = accessed_at
+                if total_size - freed_size <= max_size:
+                    break
+            oversize_count = conn.execute("DELETE FROM response_cache WHERE accessed_at <= ?", (cutoff,)).rowcount
+
+        with self.stats_lock:
+            self.evicted_count += expired_count + oversize_count
+
+        print(f'Evicted {expired_count} expired and {oversize_count} least recently used entries!\n')
+
+    def get_stats(self):
+        with self.stats_lock:
+            lookup_count = self.hit_count + self.miss_count
+            return {
+                "hits": self.hit_count,
+                "misses": self.miss_count,
+                "hit_rate": self.hit_count / lookup_count if lookup_count else 0,
+                "inserts": self.insert_count,
+                "evicted": self.evicted_count,
+            }
+# endregion
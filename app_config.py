@@ -14,8 +14,8 @@ class ConfigurationManager:
         except Exception as e:
             print("Error loading config file:", e)
 
-    def get_config(self, key):
-        return self.config_data.get(key)
+    def get_config(self, key, default=None):
+        return self.config_data.get(key, default)
 
     def save_config(self, key, new_val):
         self.config_data[key] = new_val
@@ -1,22 +1,188 @@
 import os
+import gzip
+import json
+import pathlib
+import stat
+import time
+import queue
+import shutil
 import sqlite3
+import datetime
+import threading
+from concurrent.futures import Future
 
 # region DatabaseManager
 class DatabaseManager:
-    def __init__(self):
+    def __init__(self, configManager):
+        self.configManager = configManager
+
         self.db_path = 'data/sql/data.db'
         self.sql_folder_path = 'data/sql/'
 
+        self.db_write_batch_max_size = self.configManager.get_config("db_write_batch_max_size", 64)
+        self.db_write_batch_max_wait_in_ms = self.configManager.get_config("db_write_batch_max_wait_in_ms", 0)
+        self.db_cache_size_in_kb = self.configManager.get_config("db_cache_size_in_kb", 16384)
+
+        # Closed partitions ("month" or "day") move out of data.db into their own read-only shard files
+        self.shard_folder_path = 'data/sql/shards/'
+        self.shard_cache_folder_path = 'data/sql/shards/cache/'
+        self.db_partition_by = self.configManager.get_config("db_partition_by", "month")
+        self.db_archive_after_days = self.configManager.get_config("db_archive_after_days", 30)
+        self.db_shard_compress = self.configManager.get_config("db_shard_compress", False)
+        self.shard_tables = ('screenshots', 'photos', 'audio', 'summary')
+        # Bumped whenever a shard file is rewritten so readers reopen it
+        self.shard_generation = 0
+        # Archiving and media retention both rewrite rows across data.db and the shards, one at a time
+        self.partition_lock = threading.RLock()
+        # Shards made writable for retention updates, sealed again once the pass is over
+        self.unsealed_partitions = set()
+        self.media_tables = (('screenshots', 'image_path'), ('photos', 'image_path'), ('audio', 'audio_path'))
+
+        # One connection per thread for reads, one writer thread owning the only write connection
+        self.local = threading.local()
+        self.write_queue = queue.Queue()
+        self.writer_thread = None
+        self.writer_lock = threading.Lock()
+
+        # Commit latency stats
+        self.stats_lock = threading.Lock()
+        self.commit_count = 0
+        self.committed_unit_count = 0
+        self.commit_time_total = 0.0
+
+        # Ordered schema migrations, each runs once and is recorded in schema_version
+        self.migrations = [
+            (1, 'timestamp epoch columns and indexes', self.migrate_timestamp_epoch),
+            (2, 'livesummary watermark', self.migrate_livesummary_watermark),
+            (3, 'row processing state', self.migrate_processing_state),
+            (4, 'screenshot duplicate references', self.migrate_screenshot_duplicates),
+            (5, 'audio voice activity detection', self.migrate_audio_vad),
+            (6, 'summary chunk cache', self.migrate_summary_chunks),
+            (7, 'full text search index', self.migrate_search_index),
+            (8, 'embedding queue', self.migrate_embedding_queue),
+            (9, 'media retention tier', self.migrate_media_tier),
+        ]
+
+        # Every indexed (table, column) gets a code, search_index rowids are source rowid * 16 + code
+        self.search_fields = [
+            (1, 'screenshots', 'ocr_text'),
+            (2, 'screenshots', 'description_text'),
+            (3, 'photos', 'description_text'),
+            (4, 'audio', 'transcript_text'),
+            (5, 'audio', 'description_text'),
+            (6, 'summary', 'content_text'),
+        ]
+        # Descriptions, transcripts and summaries get embedded, raw OCR is too noisy to be worth a vector
+        self.embedding_field_codes = (2, 3, 4, 5, 6)
+
+    # region Connections
+    def open_connection(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{self.db_cache_size_in_kb}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+    def get_connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.open_connection()
+            self.local.conn = conn
+        return conn
+
+    def start_writer(self):
+        with self.writer_lock:
+            if self.writer_thread is None or not self.writer_thread.is_alive():
+                self.writer_thread = threading.Thread(target=self.writer_loop, name='db-writer', daemon=True)
+                self.writer_thread.start()
+    def writer_loop(self):
+        conn = self.open_connection()
+        # Transactions are managed explicitly so a whole batch shares one commit
+        conn.isolation_level = None
+
+        while True:
+            # Block for the first unit then take whatever queued up while the last commit was running
+            units = [self.write_queue.get()]
+            deadline = time.time() + self.db_write_batch_max_wait_in_ms / 1000
+            while len(units) < self.db_write_batch_max_size:
+                remaining = deadline - time.time()
+                try:
+                    if remaining > 0:
+                        units.append(self.write_queue.get(timeout=remaining))
+                    else:
+                        units.append(self.write_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            start_time = time.time()
+            results = []
+            conn.execute("BEGIN")
+            for statements, future in units:
+                # Savepoint per unit so a failing unit does not roll back the rest of the batch
+                try:
+                    conn.execute("SAVEPOINT unit")
+                    cursor = None
+                    for sql, params in statements:
+                        cursor = conn.execute(sql, params)
+                    conn.execute("RELEASE SAVEPOINT unit")
+                    results.append((future, (cursor.lastrowid, cursor.rowcount) if cursor is not None else (None, 0), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO SAVEPOINT unit")
+                    conn.execute("RELEASE SAVEPOINT unit")
+                    results.append((future, None, e))
+            try:
+                conn.execute("COMMIT")
+            except Exception as e:
+                print("Commit Error:", e)
+                conn.execute("ROLLBACK")
+                results = [(future, None, e) for future, _, _ in results]
+            elapsed_time = time.time() - start_time
+
+            with self.stats_lock:
+                self.commit_count += 1
+                self.committed_unit_count += len(units)
+                self.commit_time_total += elapsed_time
+
+            for future, result, error in results:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+    def execute_write(self, statements):
+        """Queue statements to run as one atomic unit on the writer thread and wait for the group commit."""
+
+        self.start_writer()
+
+        future = Future()
+        self.write_queue.put((statements, future))
+        return future.result()
+
+    def get_commit_stats(self):
+        with self.stats_lock:
+            commit_count = self.commit_count
+            unit_count = self.committed_unit_count
+            commit_time_total = self.commit_time_total
+        return {
+            "commits": commit_count,
+            "units": unit_count,
+            "units_per_commit": unit_count / commit_count if commit_count else 0,
+            "avg_commit_ms": commit_time_total / commit_count * 1000 if commit_count else 0,
+            "avg_commit_ms_per_unit": commit_time_total / unit_count * 1000 if unit_count else 0,
+        }
+    # endregion
+
     def initialize_db(self):
         print(f'Initializing DB...')
 
         if not os.path.exists(self.sql_folder_path):
             os.makedirs(self.sql_folder_path)
 
-        conn = sqlite3.connect(self.db_path)
+        conn = self.open_connection()
         c = conn.cursor()
         c.execute('''
-        CREATE TABLE IF NOT EXISTS screenshots 
+        CREATE TABLE IF NOT EXISTS screenshots
         (timestamp TEXT, image_path TEXT, ocr_text TEXT, description_text TEXT)
         ''')
         c.execute('''
@@ -32,59 +198,750 @@ class DatabaseManager:
         (timestamp TEXT, from_timestamp TEXT, to_timestamp TEXT, payload TEXT, content_text TEXT)
         ''')
         conn.commit()
+
+        self.run_migrations(conn)
         conn.close()
 
+        self.start_writer()
+
         print(f'Initialized!\n')
 
+    # region Migrations
+    def run_migrations(self, conn):
+        conn.isolation_level = None
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version
+        (version INTEGER PRIMARY KEY, name TEXT, applied_at TEXT)
+        ''')
+        applied_versions = {row[0] for row in conn.execute("SELECT version FROM schema_version")}
+
+        for version, name, migration in self.migrations:
+            if version in applied_versions:
+                continue
+
+            print(f'Running migration {version}: {name}...')
+            try:
+                conn.execute("BEGIN")
+                migration(conn)
+                conn.execute("INSERT INTO schema_version VALUES (?, ?, ?)", (version, name, time.strftime('%Y-%m-%d %H:%M:%S')))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            print(f'Migrated!')
+
+    def migrate_timestamp_epoch(self, conn):
+        # Timestamps are stored as local '%Y-%m-%d %H:%M:%S' strings, strftime('%s') keeps that wall clock as epoch seconds
+        for table_name in ('screenshots', 'photos', 'audio', 'summary'):
+            conn.execute(f"ALTER TABLE {table_name} ADD COLUMN timestamp_epoch INTEGER")
+            conn.execute(f"UPDATE {table_name} SET timestamp_epoch = CAST(strftime('%s', timestamp) AS INTEGER)")
+
+        # Covering indexes so the livesummary range scans never touch the table rows
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_screenshots_timestamp_epoch ON screenshots (timestamp_epoch, description_text)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_photos_timestamp_epoch ON photos (timestamp_epoch, description_text)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_audio_timestamp_epoch ON audio (timestamp_epoch, transcript_text)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_summary_timestamp_epoch ON summary (timestamp_epoch)")
+
+    def migrate_livesummary_watermark(self, conn):
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS livesummary_watermark
+        (source TEXT PRIMARY KEY, last_rowid INTEGER)
+        ''')
+
+        # Rows up to the last summary's to_timestamp were already summarized
+        last_summary_row = conn.execute("SELECT to_timestamp FROM summary ORDER BY rowid DESC LIMIT 1").fetchone()
+        if last_summary_row is None:
+            return
+        for table_name in ('screenshots', 'photos', 'audio'):
+            conn.execute(f'''
+            INSERT INTO livesummary_watermark (source, last_rowid)
+            SELECT ?, COALESCE(MAX(rowid), 0) FROM {table_name} WHERE timestamp_epoch <= CAST(strftime('%s', ?) AS INTEGER)
+            ''', (table_name, last_summary_row[0]))
+
+    def migrate_processing_state(self, conn):
+        # pending -> in_flight -> done, or back to pending until the attempts run out and it is failed
+        for table_name, text_column in (('screenshots', 'description_text'), ('photos', 'description_text'), ('audio', 'transcript_text')):
+            conn.execute(f"ALTER TABLE {table_name} ADD COLUMN processing_state TEXT DEFAULT 'pending'")
+            conn.execute(f"ALTER TABLE {table_name} ADD COLUMN attempt_count INTEGER DEFAULT 0")
+            conn.execute(f"ALTER TABLE {table_name} ADD COLUMN last_error TEXT")
+            conn.execute(f"UPDATE {table_name} SET processing_state = CASE WHEN {text_column} IS NULL THEN 'pending' ELSE 'done' END")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_processing_state ON {table_name} (processing_state)")
+
+    def migrate_screenshot_duplicates(self, conn):
+        # Near identical screenshots point at the row whose OCR/description they reuse
+        conn.execute("ALTER TABLE screenshots ADD COLUMN duplicate_of INTEGER")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_screenshots_duplicate_of ON screenshots (duplicate_of) WHERE duplicate_of IS NOT NULL")
+
+    def migrate_audio_vad(self, conn):
+        # 'speech' segments were trimmed and transcribed, 'silent' ones never left the machine
+        conn.execute("ALTER TABLE audio ADD COLUMN vad_decision TEXT")
+        conn.execute("ALTER TABLE audio ADD COLUMN vad_speech_in_sec REAL")
+        conn.execute("ALTER TABLE audio ADD COLUMN vad_saved_in_sec REAL")
+
+    def migrate_summary_chunks(self, conn):
+        # Map/reduce partial summaries keyed by a hash of their input, level 0 summarizes rows, higher levels summarize summaries
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS summary_chunks
+        (chunk_key TEXT PRIMARY KEY, level INTEGER, from_timestamp TEXT, to_timestamp TEXT, item_count INTEGER, content_text TEXT, created_at TEXT)
+        ''')
+
+    def migrate_search_index(self, conn):
+        # The index keeps its own copy of the text so snippets never have to go back to four different tables
+        conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5
+        (content, source UNINDEXED, field UNINDEXED, ref_rowid UNINDEXED, timestamp UNINDEXED, timestamp_epoch UNINDEXED, tokenize = 'porter unicode61 remove_diacritics 2')
+        ''')
+
+        for code, table_name, column_name in self.search_fields:
+            # Duplicate screenshots carry their reference's text, indexing it again would only repeat the same hit
+            condition = "NEW.duplicate_of IS NULL" if table_name == 'screenshots' else "1"
+            select_new = f"SELECT NEW.rowid * 16 + {code}, NEW.{column_name}, '{table_name}', '{column_name}', NEW.rowid, NEW.timestamp, NEW.timestamp_epoch WHERE NEW.{column_name} IS NOT NULL AND NEW.{column_name} != ''"
+            conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS search_index_{table_name}_{column_name}_insert AFTER INSERT ON {table_name} WHEN {condition}
+            BEGIN
+                INSERT INTO search_index (rowid, content, source, field, ref_rowid, timestamp, timestamp_epoch) {select_new};
+            END
+            ''')
+            # Streaming transcripts are appended piece by piece, each append replaces the indexed text
+            conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS search_index_{table_name}_{column_name}_update AFTER UPDATE OF {column_name} ON {table_name} WHEN {condition}
+            BEGIN
+                DELETE FROM search_index WHERE rowid = OLD.rowid * 16 + {code};
+                INSERT INTO search_index (rowid, content, source, field, ref_rowid, timestamp, timestamp_epoch) {select_new};
+            END
+            ''')
+            conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS search_index_{table_name}_{column_name}_delete AFTER DELETE ON {table_name}
+            BEGIN
+                DELETE FROM search_index WHERE rowid = OLD.rowid * 16 + {code};
+            END
+            ''')
+
+        for sql, params in self.get_search_index_fill_statements():
+            conn.execute(sql, params)
+
+    def migrate_embedding_queue(self, conn):
+        # Search index rowids whose text changed since the embedding indexer last looked
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS embedding_queue
+        (id INTEGER PRIMARY KEY AUTOINCREMENT, search_rowid INTEGER)
+        ''')
+
+        for code, table_name, column_name in self.search_fields:
+            if code not in self.embedding_field_codes:
+                continue
+            condition = f"NEW.{column_name} IS NOT NULL AND NEW.{column_name} != ''" + (" AND NEW.duplicate_of IS NULL" if table_name == 'screenshots' else "")
+            for event in ('INSERT', f'UPDATE OF {column_name}'):
+                conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS embedding_queue_{table_name}_{column_name}_{event.split()[0].lower()} AFTER {event} ON {table_name} WHEN {condition}
+                BEGIN
+                    INSERT INTO embedding_queue (search_rowid) VALUES (NEW.rowid * 16 + {code});
+                END
+                ''')
+
+        conn.execute(self.get_embedding_requeue_statement()[0])
+
+    def migrate_media_tier(self, conn):
+        # 'full' as captured, 'thumbnail' once downsampled, 'text' when the file is gone and only the text is left
+        for table_name, media_column in self.media_tables:
+            conn.execute(f"ALTER TABLE {table_name} ADD COLUMN media_tier TEXT DEFAULT 'full'")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_media_tier ON {table_name} (media_tier, timestamp_epoch)")
+            # Duplicate screenshots share their reference's file, paths are updated for every row using them
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_{media_column} ON {table_name} ({media_column})")
+
+        # Shards archived before this migration need the column too, or the next archive into them fails
+        for partition in self.get_shard_partitions():
+            shard_path = self.unseal_shard(partition)
+            shard_conn = sqlite3.connect(pathlib.Path(os.path.abspath(shard_path)).as_uri(), uri=True, timeout=30)
+            for table_name, _ in self.media_tables:
+                columns = [row[1] for row in shard_conn.execute(f"PRAGMA table_info({table_name})")]
+                if columns and 'media_tier' not in columns:
+                    shard_conn.execute(f"ALTER TABLE {table_name} ADD COLUMN media_tier TEXT DEFAULT 'full'")
+            shard_conn.commit()
+            self.seal_shard(shard_conn, shard_path)
+    # endregion
+
     def save_to_screenshot_db(self, timestamp, image_path, ocr_text, description_text):
         print(f'Saving to Screenshots DB...')
 
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute("INSERT INTO screenshots VALUES (?, ?, ?, ?)", (timestamp, image_path, ocr_text, description_text))
-        conn.commit()
-        conn.close()
+        rowid, _ = self.execute_write([
+            ("INSERT INTO screenshots (timestamp, image_path, ocr_text, description_text, timestamp_epoch) VALUES (?, ?, ?, ?, CAST(strftime('%s', ?) AS INTEGER))", (timestamp, image_path, ocr_text, description_text, timestamp))
+        ])
 
         print(f'Saved!\n')
+
+        return rowid
+    def save_duplicate_to_screenshot_db(self, timestamp, reference_rowid):
+        print(f'Saving duplicate to Screenshots DB...')
+
+        # Copies whatever text the reference row has now, update_screenshot_db fills in the rest later
+        rowid, _ = self.execute_write([
+            ("INSERT INTO screenshots (timestamp, image_path, ocr_text, description_text, timestamp_epoch, processing_state, duplicate_of) SELECT ?, image_path, ocr_text, description_text, CAST(strftime('%s', ?) AS INTEGER), 'done', rowid FROM screenshots WHERE rowid = ?", (timestamp, timestamp, reference_rowid))
+        ])
+
+        print(f'Saved!\n')
+
+        return rowid
     def save_to_photo_db(self, timestamp, image_path, description_text):
         print(f'Saving to Photos DB...')
 
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute("INSERT INTO photos VALUES (?, ?, ?)", (timestamp, image_path, description_text))
-        conn.commit()
-        conn.close()
+        rowid, _ = self.execute_write([
+            ("INSERT INTO photos (timestamp, image_path, description_text, timestamp_epoch) VALUES (?, ?, ?, CAST(strftime('%s', ?) AS INTEGER))", (timestamp, image_path, description_text, timestamp))
+        ])
 
         print(f'Saved!\n')
+
+        return rowid
     def save_to_audio_db(self, timestamp, audio_path, transcript_text, description_text):
         print(f'Saving to Audio DB...')
 
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute("INSERT INTO audio VALUES (?, ?, ?, ?)", (timestamp, audio_path, transcript_text, description_text))
-        conn.commit()
-        conn.close()
+        rowid, _ = self.execute_write([
+            ("INSERT INTO audio (timestamp, audio_path, transcript_text, description_text, timestamp_epoch) VALUES (?, ?, ?, ?, CAST(strftime('%s', ?) AS INTEGER))", (timestamp, audio_path, transcript_text, description_text, timestamp))
+        ])
 
         print(f'Saved!\n')
-    def save_to_summary_db(self, timestamp, from_timestamp, to_timestamp, payload, content_text):
+
+        return rowid
+    def save_streaming_audio_to_db(self, timestamp, audio_path):
+        print(f'Saving Streaming Audio to DB...')
+
+        # 'streaming' rows are still being recorded, the backlog leaves them alone and the summary waits for them
+        rowid, _ = self.execute_write([
+            ("INSERT INTO audio (timestamp, audio_path, timestamp_epoch, processing_state) VALUES (?, ?, CAST(strftime('%s', ?) AS INTEGER), 'streaming')", (timestamp, audio_path, timestamp))
+        ])
+
+        print(f'Saved!\n')
+
+        return rowid
+    def save_to_summary_db(self, timestamp, from_timestamp, to_timestamp, payload, content_text, watermarks=None):
         print(f'Saving to Summary DB...')
 
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute("INSERT INTO summary VALUES (?, ?, ?, ?, ?)", (timestamp, from_timestamp, to_timestamp, payload, content_text))
-        conn.commit()
-        conn.close()
+        # The watermarks commit together with the summary that consumed them
+        statements = self.get_watermark_statements(watermarks)
+        statements.append((
+            "INSERT INTO summary (timestamp, from_timestamp, to_timestamp, payload, content_text, timestamp_epoch) VALUES (?, ?, ?, ?, ?, CAST(strftime('%s', ?) AS INTEGER))",
+            (timestamp, from_timestamp, to_timestamp, payload, content_text, timestamp)
+        ))
+        rowid, _ = self.execute_write(statements)
 
         print(f'Saved!\n')
 
+        return rowid
+
+    def get_watermark_statements(self, watermarks):
+        return [
+            (
+                "INSERT INTO livesummary_watermark (source, last_rowid) VALUES (?, ?) ON CONFLICT(source) DO UPDATE SET last_rowid = MAX(last_rowid, excluded.last_rowid)",
+                (source, last_rowid)
+            )
+            for source, last_rowid in (watermarks or {}).items()
+        ]
+    def advance_livesummary_watermarks(self, watermarks):
+        """Move past rows that had nothing to summarize, without a summary row."""
+        self.execute_write(self.get_watermark_statements(watermarks))
+
+    def update_screenshot_db(self, rowid, ocr_text, description_text):
+        print(f'Updating Screenshots DB...')
+
+        self.execute_write([
+            ("UPDATE screenshots SET ocr_text = ?, description_text = ? WHERE duplicate_of = ?", (ocr_text, description_text, rowid)),
+            ("UPDATE screenshots SET ocr_text = ?, description_text = ?, processing_state = 'done', last_error = NULL WHERE rowid = ?", (ocr_text, description_text, rowid))
+        ])
+
+        print(f'Updated!\n')
+    def update_photo_db(self, rowid, description_text):
+        print(f'Updating Photos DB...')
+
+        self.execute_write([
+            ("UPDATE photos SET description_text = ?, processing_state = 'done', last_error = NULL WHERE rowid = ?", (description_text, rowid))
+        ])
+
+        print(f'Updated!\n')
+    def update_audio_db(self, rowid, transcript_text, description_text):
+        print(f'Updating Audio DB...')
+
+        self.execute_write([
+            ("UPDATE audio SET transcript_text = ?, description_text = ?, processing_state = 'done', last_error = NULL WHERE rowid = ?", (transcript_text, description_text, rowid))
+        ])
+
+        print(f'Updated!\n')
+    def append_audio_transcript(self, rowid, transcript_text):
+        self.execute_write([
+            ("UPDATE audio SET transcript_text = COALESCE(transcript_text || ' ', '') || ? WHERE rowid = ?", (transcript_text, rowid))
+        ])
+    def finish_streaming_audio(self, rowid):
+        """Hand a fully recorded streaming row over to the inference workers as pending."""
+        self.execute_write([
+            ("UPDATE audio SET processing_state = 'pending' WHERE rowid = ? AND processing_state = 'streaming'", (rowid,))
+        ])
+    def restart_streaming_audio(self, rowid=None):
+        """Hand streaming rows (all of them without a rowid) to the batch path, their partial transcript is dropped so the saved file is transcribed whole."""
+        row_filter, params = ("AND rowid = ?", (rowid,)) if rowid is not None else ("", ())
+        _, rowcount = self.execute_write([
+            (f"UPDATE audio SET transcript_text = NULL, processing_state = 'pending' WHERE processing_state = 'streaming' {row_filter}", params)
+        ])
+        return rowcount
+    def delete_streaming_audio(self, rowid):
+        """Drop a streaming row that never got any audio."""
+        self.execute_write([
+            ("DELETE FROM audio WHERE rowid = ? AND processing_state = 'streaming'", (rowid,))
+        ])
+    def update_audio_vad_db(self, rowid, vad_decision, vad_speech_in_sec, vad_saved_in_sec):
+        print(f'Updating Audio VAD...')
+
+        self.execute_write([
+            ("UPDATE audio SET vad_decision = ?, vad_speech_in_sec = ?, vad_saved_in_sec = ? WHERE rowid = ?", (vad_decision, vad_speech_in_sec, vad_saved_in_sec, rowid))
+        ])
+
+        print(f'Updated!\n')
+
+    # region Processing State
+    def claim_row(self, table_name, rowid):
+        """Atomically move a pending row to in_flight, returns False if someone else already has it or it is done."""
+
+        _, rowcount = self.execute_write([
+            (f"UPDATE {table_name} SET processing_state = 'in_flight', attempt_count = attempt_count + 1 WHERE rowid = ? AND processing_state = 'pending'", (rowid,))
+        ])
+        return rowcount == 1
+    def release_row(self, table_name, rowid, error, max_attempts):
+        print(f'Releasing {table_name} row {rowid}...')
+
+        self.execute_write([
+            (f"UPDATE {table_name} SET processing_state = CASE WHEN attempt_count >= ? THEN 'failed' ELSE 'pending' END, last_error = ? WHERE rowid = ? AND processing_state = 'in_flight'", (max_attempts, error, rowid))
+        ])
+
+        print(f'Released!\n')
+    def reset_in_flight_rows(self):
+        """Rows left in_flight or streaming by a crash or kill go back to pending, only call before any worker starts."""
+
+        print(f'Resetting in-flight rows...')
+
+        # A stream cut off mid segment has a partial transcript at best, the batch path starts it over from the file
+        streaming_count = self.restart_streaming_audio()
+        for table_name in ('screenshots', 'photos', 'audio'):
+            _, rowcount = self.execute_write([
+                (f"UPDATE {table_name} SET processing_state = 'pending' WHERE processing_state = 'in_flight'", ())
+            ])
+            print(f'{table_name}: {rowcount + (streaming_count if table_name == "audio" else 0)} rows back to pending')
+
+        print(f'Reset!\n')
+    def retrieve_pending_rows(self, table_name, media_column, after_rowid, before_timestamp, limit):
+        c = self.get_connection().cursor()
+        c.execute(f"SELECT rowid, {media_column} FROM {table_name} WHERE processing_state = 'pending' AND rowid > ? AND timestamp_epoch < CAST(strftime('%s', ?) AS INTEGER) ORDER BY rowid LIMIT ?", (after_rowid, before_timestamp, limit))
+        rows = c.fetchall()
+        self.get_connection().commit()
+        return rows
+    # endregion
+
+    def save_summary_chunk(self, chunk_key, level, from_timestamp, to_timestamp, item_count, content_text):
+        self.execute_write([
+            ("INSERT OR REPLACE INTO summary_chunks (chunk_key, level, from_timestamp, to_timestamp, item_count, content_text, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)", (chunk_key, level, from_timestamp, to_timestamp, item_count, content_text, time.strftime('%Y-%m-%d %H:%M:%S')))
+        ])
+    def retrieve_summary_chunk(self, chunk_key):
+        c = self.get_connection().cursor()
+        c.execute("SELECT content_text FROM summary_chunks WHERE chunk_key = ?", (chunk_key,))
+        row = c.fetchone()
+        self.get_connection().commit()
+        return row[0] if row else None
+    def retrieve_audio_transcript(self, rowid):
+        c = self.get_connection().cursor()
+        c.execute("SELECT transcript_text FROM audio WHERE rowid = ?", (rowid,))
+        row = c.fetchone()
+        self.get_connection().commit()
+        return row[0] if row else None
+    # region Search
+    def build_search_query(self, text, match_any=False):
+        """Quote every term so user input like C++ or 3.5-turbo never trips the FTS5 query syntax, all terms must match unless match_any."""
+        terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+        return (' OR ' if match_any else ' ').join(terms)
+    def search_text(self, text, from_timestamp=None, to_timestamp=None, sources=None, limit=20, raw_query=False, match_any=False):
+        """Best bm25 matches as (source, field, rowid, timestamp, snippet, score), optionally within a time range and set of sources."""
+
+        query = text if raw_query else self.build_search_query(text, match_any)
+        if not query:
+            return []
+
+        sql = "SELECT source, field, ref_rowid, timestamp, snippet(search_index, 0, '[', ']', '...', 16), bm25(search_index) FROM search_index WHERE search_index MATCH ?"
+        params = [query]
+        if from_timestamp is not None:
+            sql += " AND timestamp_epoch >= CAST(strftime('%s', ?) AS INTEGER)"
+            params.append(from_timestamp)
+        if to_timestamp is not None:
+            sql += " AND timestamp_epoch <= CAST(strftime('%s', ?) AS INTEGER)"
+            params.append(to_timestamp)
+        if sources:
+            sql += f" AND source IN ({', '.join('?' for _ in sources)})"
+            params.extend(sources)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
+
+        # Shards only when the range reaches into them, each keeps its own index. Their bm25 statistics are per file,
+        # close enough to merge on, and a row caught mid-archive in both files only counts once
+        rows = {}
+        for conn in [self.get_connection()] + [self.get_shard_connection(partition) for partition in self.get_shard_partitions(from_timestamp, to_timestamp)]:
+            for row in conn.execute(sql, params).fetchall():
+                rows.setdefault((row[0], row[1], row[2]), row)
+            conn.commit()
+        return sorted(rows.values(), key=lambda row: row[5])[:limit]
+    def get_search_index_fill_statements(self):
+        # FTS5 flushes its pending terms at every trigger statement, bulk loads are far faster as one INSERT ... SELECT per field
+        statements = []
+        for code, table_name, column_name in self.search_fields:
+            statements.append((f'''
+            INSERT INTO search_index (rowid, content, source, field, ref_rowid, timestamp, timestamp_epoch)
+            SELECT rowid * 16 + {code}, {column_name}, '{table_name}', '{column_name}', rowid, timestamp, timestamp_epoch FROM {table_name}
+            WHERE {column_name} IS NOT NULL AND {column_name} != '' {"AND duplicate_of IS NULL" if table_name == 'screenshots' else ""}
+            ''', ()))
+        statements.append(("INSERT INTO search_index (search_index) VALUES ('optimize')", ()))
+        return statements
+    def rebuild_search_index(self):
+        """Index every row from scratch, for imports that went around the triggers."""
+        self.execute_write([("DELETE FROM search_index", ())] + self.get_search_index_fill_statements())
+    def get_embedding_requeue_statement(self):
+        return (f"INSERT INTO embedding_queue (search_rowid) SELECT rowid FROM search_index WHERE rowid % 16 IN ({', '.join(str(code) for code in self.embedding_field_codes)}) ORDER BY rowid", ())
+    def requeue_embeddings(self):
+        """Queue every embeddable text again, archived ones included, after the embedding model changed."""
+
+        # The queue lives in data.db, archived texts go in first since they are the oldest
+        statements = [("DELETE FROM embedding_queue", ())]
+        for partition in self.get_shard_partitions():
+            shard_conn = self.get_shard_connection(partition)
+            search_rowids = [row[0] for row in shard_conn.execute(f"SELECT rowid FROM search_index WHERE rowid % 16 IN ({', '.join(str(code) for code in self.embedding_field_codes)}) ORDER BY rowid")]
+            shard_conn.commit()
+            for offset in range(0, len(search_rowids), 10000):
+                statements.append(("INSERT INTO embedding_queue (search_rowid) SELECT value FROM json_each(?)", (json.dumps(search_rowids[offset:offset + 10000]),)))
+        statements.append(self.get_embedding_requeue_statement())
+        self.execute_write(statements)
+    def retrieve_embedding_queue(self, after_id, limit):
+        # Text gone from the index (row deleted or emptied) comes back as NULL
+        conn = self.get_connection()
+        rows = conn.execute('''
+        SELECT embedding_queue.id, embedding_queue.search_rowid, search_index.content, search_index.timestamp_epoch
+        FROM embedding_queue LEFT JOIN search_index ON search_index.rowid = embedding_queue.search_rowid
+        WHERE embedding_queue.id > ? ORDER BY embedding_queue.id LIMIT ?
+        ''', (after_id, limit)).fetchall()
+        conn.commit()
+
+        # Rows archived since they were queued, or queued again by requeue_embeddings, are read from their shard
+        missing_rowids = [search_rowid for _, search_rowid, content, _ in rows if content is None]
+        archived_entries = {}
+        for partition in self.get_shard_partitions() if missing_rowids else []:
+            shard_conn = self.get_shard_connection(partition)
+            for offset in range(0, len(missing_rowids), 500):
+                search_rowids = missing_rowids[offset:offset + 500]
+                for search_rowid, content, timestamp_epoch in shard_conn.execute(f"SELECT rowid, content, timestamp_epoch FROM search_index WHERE rowid IN ({', '.join('?' for _ in search_rowids)})", search_rowids):
+                    archived_entries.setdefault(search_rowid, (content, timestamp_epoch))
+            shard_conn.commit()
+        return [
+            (queue_id, search_rowid, *archived_entries[search_rowid]) if content is None and search_rowid in archived_entries else (queue_id, search_rowid, content, timestamp_epoch)
+            for queue_id, search_rowid, content, timestamp_epoch in rows
+        ]
+    def delete_embedding_queue(self, up_to_id):
+        self.execute_write([
+            ("DELETE FROM embedding_queue WHERE id <= ?", (up_to_id,))
+        ])
+    def retrieve_search_entries(self, search_rowids):
+        """(search_rowid, source, field, rowid, timestamp, content) for index entries that still exist, archived ones included."""
+
+        rows = []
+        missing_rowids = list(search_rowids)
+        for conn in [self.get_connection()] + [self.get_shard_connection(partition) for partition in self.get_shard_partitions()]:
+            if not missing_rowids:
+                break
+            found_rows = conn.execute(
+                f"SELECT rowid, source, field, ref_rowid, timestamp, content FROM search_index WHERE rowid IN ({', '.join('?' for _ in missing_rowids)})",
+                missing_rowids
+            ).fetchall()
+            conn.commit()
+            rows += found_rows
+            found_rowids = {row[0] for row in found_rows}
+            missing_rowids = [search_rowid for search_rowid in missing_rowids if search_rowid not in found_rowids]
+        return rows
+    def optimize_search_index(self):
+        """Merge the index b-trees into one, worth running after large imports."""
+        self.execute_write([
+            ("INSERT INTO search_index (search_index) VALUES ('optimize')", ())
+        ])
+    # endregion
+
+    # region Partitions
+    def get_partition(self, timestamp):
+        return timestamp[:7] if self.db_partition_by == "month" else timestamp[:10]
+    def get_partition_bounds(self, partition):
+        """First timestamp of the partition and of the one after it."""
+        if self.db_partition_by == "month":
+            start = datetime.datetime.strptime(partition, '%Y-%m')
+            end = (start + datetime.timedelta(days=32)).replace(day=1)
+        else:
+            start = datetime.datetime.strptime(partition, '%Y-%m-%d')
+            end = start + datetime.timedelta(days=1)
+        return start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S')
+    def get_read_only_uri(self, path):
+        # as_uri keeps Windows drive letters and spaces valid
+        return pathlib.Path(os.path.abspath(path)).as_uri() + '?mode=ro'
+    def get_shard_path(self, partition):
+        return os.path.join(self.shard_folder_path, f'data-{partition}.db')
+    def get_shard_partitions(self, from_timestamp=None, to_timestamp=None):
+        """Partitions that have a shard file and overlap the range, oldest first."""
+
+        if not os.path.exists(self.shard_folder_path):
+            return []
+        partitions = set()
+        for filename in os.listdir(self.shard_folder_path):
+            if filename.startswith('data-') and (filename.endswith('.db') or filename.endswith('.db.gz')):
+                partitions.add(filename[len('data-'):].split('.')[0])
+
+        overlapping_partitions = []
+        for partition in sorted(partitions):
+            start_timestamp, end_timestamp = self.get_partition_bounds(partition)
+            if (from_timestamp is None or end_timestamp > from_timestamp) and (to_timestamp is None or start_timestamp <= to_timestamp):
+                overlapping_partitions.append(partition)
+        return overlapping_partitions
+    def get_shard_connection(self, partition):
+        """Read-only connection to a shard, opened on demand and kept per thread."""
+
+        shard_connections = getattr(self.local, 'shard_connections', None)
+        if shard_connections is None or getattr(self.local, 'shard_generation', None) != self.shard_generation:
+            for conn in (shard_connections or {}).values():
+                conn.close()
+            shard_connections = self.local.shard_connections = {}
+            self.local.shard_generation = self.shard_generation
+
+        conn = shard_connections.get(partition)
+        if conn is None:
+            shard_path = self.get_shard_path(partition)
+            if not os.path.exists(shard_path):
+                # Compressed shards are read from a decompressed copy
+                shard_path = os.path.join(self.shard_cache_folder_path, os.path.basename(shard_path))
+                if not os.path.exists(shard_path):
+                    if not os.path.exists(self.shard_cache_folder_path):
+                        os.makedirs(self.shard_cache_folder_path)
+                    with gzip.open(self.get_shard_path(partition) + '.gz', 'rb') as source_file, open(shard_path + '.tmp', 'wb') as target_file:
+                        shutil.copyfileobj(source_file, target_file)
+                    os.replace(shard_path + '.tmp', shard_path)
+            conn = sqlite3.connect(self.get_read_only_uri(shard_path), uri=True, timeout=30)
+            conn.execute(f"PRAGMA cache_size=-{self.db_cache_size_in_kb // 4}")
+            shard_connections[partition] = conn
+        return conn
+
+    def archive_partitions(self):
+        """Move every partition that closed more than db_archive_after_days ago out of data.db, returns how many rows moved."""
+
+        cutoff_timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() - self.db_archive_after_days * 86400))
+        conn = self.get_connection()
+        oldest_timestamps = [conn.execute(f"SELECT MIN(timestamp) FROM {table_name}").fetchone()[0] for table_name in self.shard_tables]
+        conn.commit()
+        oldest_timestamps = [timestamp for timestamp in oldest_timestamps if timestamp]
+        if not oldest_timestamps:
+            return 0
+
+        moved_count = 0
+        partition = self.get_partition(min(oldest_timestamps))
+        while True:
+            _, end_timestamp = self.get_partition_bounds(partition)
+            if end_timestamp > cutoff_timestamp:
+                break
+            moved_count += self.archive_partition(partition)
+            partition = self.get_partition(end_timestamp)
+
+        # Deleted index entries are only tombstones until the segments merge
+        if moved_count:
+            self.optimize_search_index()
+        return moved_count
+    def archive_partition(self, partition):
+        """Copy the partition's finished rows into its shard, then delete them from data.db. Returns how many rows moved."""
+
+        with self.partition_lock:
+            return self.archive_partition_locked(partition)
+    def get_archive_rowids_sql(self, table_name, schema, selection='COUNT(*)'):
+        """Rows of a table in the partition between the two bound parameters that may leave data.db, attached as schema."""
+
+        # Only rows nothing will touch again: processed, summarized, and never the newest row of a table
+        # so rowids keep counting up in data.db and stay unique across shards
+        condition = "1"
+        if table_name != 'summary':
+            condition = f"processing_state IN ('done', 'failed') AND rowid <= COALESCE((SELECT last_rowid FROM {schema}.livesummary_watermark WHERE source = '{table_name}'), 0)"
+        return f'''
+        SELECT {selection} FROM {schema}.{table_name}
+        WHERE timestamp_epoch >= CAST(strftime('%s', ?) AS INTEGER) AND timestamp_epoch < CAST(strftime('%s', ?) AS INTEGER)
+        AND rowid < (SELECT MAX(rowid) FROM {schema}.{table_name}) AND {condition}
+        '''
+    def archive_partition_locked(self, partition):
+        start_timestamp, end_timestamp = self.get_partition_bounds(partition)
+        shard_path = self.get_shard_path(partition)
+        if not os.path.exists(self.shard_folder_path):
+            os.makedirs(self.shard_folder_path)
+
+        # Same rows the move below takes, nothing is unsealed or created for a partition with none ready
+        conn = self.get_connection()
+        candidate_count = sum(
+            conn.execute(self.get_archive_rowids_sql(table_name, 'main'), (start_timestamp, end_timestamp)).fetchone()[0]
+            for table_name in self.shard_tables
+        )
+        conn.commit()
+        if candidate_count == 0:
+            return 0
+
+        print(f'Archiving {partition}...')
+        start_time = time.time()
+
+        # An existing shard takes the rows that finished late, it is made writable again for that
+        self.unseal_shard(partition)
+
+        shard_conn = sqlite3.connect(pathlib.Path(os.path.abspath(shard_path)).as_uri(), uri=True, timeout=30, isolation_level=None)
+        # VACUUM would renumber the rowids the shard's search index refers to, auto vacuum frees pages without touching them (new shards only)
+        shard_conn.execute("PRAGMA auto_vacuum = FULL")
+        shard_conn.execute("ATTACH DATABASE ? AS hot", (self.get_read_only_uri(self.db_path),))
+        moved_rowids = {}
+        try:
+            shard_conn.execute("BEGIN")
+            for table_name in self.shard_tables + ('search_index',):
+                create_sql = shard_conn.execute("SELECT sql FROM hot.sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone()[0]
+                shard_conn.execute(create_sql.replace(f'CREATE TABLE {table_name}', f'CREATE TABLE IF NOT EXISTS {table_name}', 1).replace('CREATE VIRTUAL TABLE search_index', 'CREATE VIRTUAL TABLE IF NOT EXISTS search_index', 1))
+
+            for table_name in self.shard_tables:
+                columns = ', '.join(row[1] for row in shard_conn.execute(f"PRAGMA hot.table_info({table_name})"))
+                moved_rowids[table_name] = [row[0] for row in shard_conn.execute(self.get_archive_rowids_sql(table_name, 'hot', 'rowid'), (start_timestamp, end_timestamp))]
+                for offset in range(0, len(moved_rowids[table_name]), 500):
+                    rowids = moved_rowids[table_name][offset:offset + 500]
+                    shard_conn.execute(f"INSERT OR IGNORE INTO main.{table_name} (rowid, {columns}) SELECT rowid, {columns} FROM hot.{table_name} WHERE rowid IN ({', '.join('?' for _ in rowids)})", rowids)
+
+            # The shard's index covers whatever the shard holds
+            shard_conn.execute("DELETE FROM main.search_index")
+            for sql, params in self.get_search_index_fill_statements():
+                shard_conn.execute(sql, params)
+            shard_conn.execute("COMMIT")
+        except Exception:
+            shard_conn.execute("ROLLBACK")
+            raise
+        finally:
+            shard_conn.execute("DETACH DATABASE hot")
+
+        # The shard is committed first, a crash before this delete only leaves rows in both files until the next run
+        statements = []
+        for table_name, rowids in moved_rowids.items():
+            for offset in range(0, len(rowids), 500):
+                statements.append((f"DELETE FROM {table_name} WHERE rowid IN ({', '.join('?' for _ in rowids[offset:offset + 500])})", rowids[offset:offset + 500]))
+        if statements:
+            self.execute_write(statements)
+
+        self.seal_shard(shard_conn, shard_path)
+
+        moved_count = sum(len(rowids) for rowids in moved_rowids.values())
+        elapsed_time = time.time() - start_time
+        print(f'Archived {moved_count} rows of {partition} to {shard_path} in {elapsed_time:.2f} seconds!\n')
+
+        return moved_count
+    def unseal_shard(self, partition):
+        """Decompress a shard if needed and make it writable again, returns its path."""
+
+        shard_path = self.get_shard_path(partition)
+        if os.path.exists(shard_path + '.gz'):
+            with gzip.open(shard_path + '.gz', 'rb') as source_file, open(shard_path + '.tmp', 'wb') as target_file:
+                shutil.copyfileobj(source_file, target_file)
+            os.replace(shard_path + '.tmp', shard_path)
+            os.remove(shard_path + '.gz')
+            # Readers of the decompressed copy move over to the real file
+            cached_path = os.path.join(self.shard_cache_folder_path, os.path.basename(shard_path))
+            if os.path.exists(cached_path):
+                os.remove(cached_path)
+            self.shard_generation += 1
+        if os.path.exists(shard_path):
+            os.chmod(shard_path, stat.S_IREAD | stat.S_IWRITE)
+        return shard_path
+    def seal_shard(self, shard_conn, shard_path):
+        """Make a shard that was just written read-only and optionally compress it."""
+
+        shard_conn.execute("PRAGMA journal_mode=DELETE")
+        shard_conn.close()
+        os.chmod(shard_path, stat.S_IREAD)
+
+        if self.db_shard_compress:
+            with open(shard_path, 'rb') as source_file, gzip.open(shard_path + '.gz.tmp', 'wb') as target_file:
+                shutil.copyfileobj(source_file, target_file)
+            os.replace(shard_path + '.gz.tmp', shard_path + '.gz')
+            os.chmod(shard_path, stat.S_IREAD | stat.S_IWRITE)
+            os.remove(shard_path)
+
+        # Decompressed copies and open readers of the old file are stale now
+        cached_path = os.path.join(self.shard_cache_folder_path, os.path.basename(shard_path))
+        if os.path.exists(cached_path):
+            os.remove(cached_path)
+        self.shard_generation += 1
+    # endregion
+
+    # region Retention
+    def retrieve_media_rows(self, table_name, media_column, media_tier, before_timestamp, limit):
+        """Finished rows still at media_tier and captured before before_timestamp, as (rowid, timestamp, path), shards first then data.db."""
+
+        # Duplicates follow their reference row, they share its file
+        duplicate_condition = "AND duplicate_of IS NULL" if table_name == 'screenshots' else ""
+        sql = f'''
+        SELECT rowid, timestamp, {media_column} FROM {table_name}
+        WHERE media_tier = ? AND timestamp_epoch < CAST(strftime('%s', ?) AS INTEGER)
+        AND processing_state IN ('done', 'failed') AND {media_column} IS NOT NULL {duplicate_condition}
+        ORDER BY timestamp_epoch LIMIT ?
+        '''
+
+        rows = []
+        connections = [self.get_shard_connection(partition) for partition in self.get_shard_partitions(None, before_timestamp)]
+        for conn in connections + [self.get_connection()]:
+            rows += conn.execute(sql, (media_tier, before_timestamp, limit - len(rows))).fetchall()
+            conn.commit()
+            if len(rows) >= limit:
+                break
+        return rows
+    def update_media_paths(self, table_name, media_column, changes):
+        """Point every row using an old path at its new path and tier, changes are (old_path, new_path, media_tier)."""
+
+        if not changes:
+            return
+        old_paths = [old_path for old_path, _, _ in changes]
+        statements = [
+            (f"UPDATE {table_name} SET {media_column} = ?, media_tier = ? WHERE {media_column} = ?", (new_path, media_tier, old_path))
+            for old_path, new_path, media_tier in changes
+        ]
+
+        # One transaction per file, data.db through the writer and any shard holding the paths directly
+        with self.partition_lock:
+            self.execute_write(statements)
+
+            for partition in self.get_shard_partitions():
+                conn = self.get_shard_connection(partition)
+                found_row = conn.execute(f"SELECT 1 FROM {table_name} WHERE {media_column} IN ({', '.join('?' for _ in old_paths)}) LIMIT 1", old_paths).fetchone()
+                conn.commit()
+                if found_row is None:
+                    continue
+
+                shard_path = self.unseal_shard(partition)
+                self.unsealed_partitions.add(partition)
+                shard_conn = sqlite3.connect(pathlib.Path(os.path.abspath(shard_path)).as_uri(), uri=True, timeout=30, isolation_level=None)
+                try:
+                    shard_conn.execute("BEGIN")
+                    for sql, params in statements:
+                        shard_conn.execute(sql, params)
+                    shard_conn.execute("COMMIT")
+                except Exception:
+                    shard_conn.execute("ROLLBACK")
+                    raise
+                finally:
+                    shard_conn.close()
+    def seal_shards(self):
+        """Seal the shards update_media_paths left writable."""
+
+        with self.partition_lock:
+            for partition in sorted(self.unsealed_partitions):
+                shard_path = self.get_shard_path(partition)
+                self.seal_shard(sqlite3.connect(pathlib.Path(os.path.abspath(shard_path)).as_uri(), uri=True, timeout=30), shard_path)
+            self.unsealed_partitions.clear()
+    # endregion
+
     def retrieve_image_paths_from_db(self, table_name):
         print(f'Retrieving image paths from {table_name}...')
 
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        c = self.get_connection().cursor()
         c.execute(f"SELECT image_path FROM {table_name} WHERE api_response IS NULL OR api_response = '' OR LENGTH(api_response)=0")
         rows = c.fetchall()
-        conn.close()
 
         print(f'Retrieved!\n')
 
@@ -92,71 +949,82 @@ class DatabaseManager:
     def retrieve_contents_from_db(self, table_name):
         print(f'Retrieving contents from {table_name}...')
 
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        c = self.get_connection().cursor()
         c.execute(f"SELECT content FROM {table_name} WHERE content IS NOT NULL OR content != '' OR LENGTH(content)>0")
         rows = c.fetchall()
-        conn.close()
 
         print(f'Retrieved!\n')
 
         return [row[0] for row in rows]
-    
-    def retrieve_all_sources_text_content_for_livesummary(self, current_timestamp):
-        conn = sqlite3.connect(self.db_path)
+
+    def retrieve_all_sources_text_content_for_livesummary(self):
+        """Read the rows added since the last summary and the last summary itself in one round trip."""
+
+        conn = self.get_connection()
         cursor = conn.cursor()
 
-        # Check if the summary table is empty
-        cursor.execute("SELECT * FROM summary")
-        summary_rows = cursor.fetchall()
-
-        # If summary table is empty
-        if not summary_rows:
-            cursor.execute("SELECT MIN(timestamp) FROM (SELECT MIN(timestamp) AS timestamp FROM screenshots UNION ALL SELECT MIN(timestamp) AS timestamp FROM audio UNION ALL SELECT MIN(timestamp) AS timestamp FROM photos)")
-            to_timestamp = cursor.fetchone()[0]
-
-            cursor.execute("SELECT description_text FROM screenshots")
-            screenshots_description_text_rows = cursor.fetchall()
-            cursor.execute("SELECT description_text FROM photos")
-            photos_description_text_rows = cursor.fetchall()
-            cursor.execute("SELECT transcript_text FROM audio")
-            audio_transcript_text_rows = cursor.fetchall()
-        else:
-            # Get the last timestamp from the summary table
-            cursor.execute("SELECT to_timestamp FROM summary ORDER BY to_timestamp DESC LIMIT 1")
-            to_timestamp = cursor.fetchone()[0]
-
-            # Pull rows less than current timestamp and greater than last timestamp
-            cursor.execute("SELECT description_text FROM screenshots WHERE timestamp > ? AND timestamp < ?", (to_timestamp, current_timestamp))
-            screenshots_description_text_rows = cursor.fetchall()
-            cursor.execute("SELECT description_text FROM photos WHERE timestamp > ? AND timestamp < ?", (to_timestamp, current_timestamp))
-            photos_description_text_rows = cursor.fetchall()
-            cursor.execute("SELECT transcript_text FROM audio WHERE timestamp > ? AND timestamp < ?", (to_timestamp, current_timestamp))
-            audio_transcript_text_rows = cursor.fetchall()
+        # Every branch is a rowid range seek past the persisted watermark of its source,
+        # stopping before the first row the inference workers have not filled in yet.
+        # Duplicate screenshots come back without text so they only advance the watermark
+        cursor.execute("""
+        WITH watermark AS (
+            SELECT
+                COALESCE((SELECT last_rowid FROM livesummary_watermark WHERE source = 'screenshots'), 0) AS screenshots,
+                COALESCE((SELECT last_rowid FROM livesummary_watermark WHERE source = 'photos'), 0) AS photos,
+                COALESCE((SELECT last_rowid FROM livesummary_watermark WHERE source = 'audio'), 0) AS audio
+        ),
+        pending AS (
+            SELECT
+                COALESCE((SELECT MIN(rowid) FROM screenshots WHERE rowid > (SELECT screenshots FROM watermark) AND processing_state IN ('pending', 'in_flight')), 9223372036854775807) AS screenshots,
+                COALESCE((SELECT MIN(rowid) FROM photos WHERE rowid > (SELECT photos FROM watermark) AND processing_state IN ('pending', 'in_flight')), 9223372036854775807) AS photos,
+                COALESCE((SELECT MIN(rowid) FROM audio WHERE rowid > (SELECT audio FROM watermark) AND processing_state IN ('pending', 'in_flight', 'streaming')), 9223372036854775807) AS audio
+        )
+        SELECT 'screenshots', rowid, timestamp, CASE WHEN duplicate_of IS NULL THEN description_text END FROM screenshots WHERE rowid > (SELECT screenshots FROM watermark) AND rowid < (SELECT screenshots FROM pending)
+        UNION ALL
+        SELECT 'photos', rowid, timestamp, description_text FROM photos WHERE rowid > (SELECT photos FROM watermark) AND rowid < (SELECT photos FROM pending)
+        UNION ALL
+        SELECT 'audio', rowid, timestamp, transcript_text FROM audio WHERE rowid > (SELECT audio FROM watermark) AND rowid < (SELECT audio FROM pending)
+        UNION ALL
+        SELECT * FROM (SELECT 'summary', rowid, to_timestamp, content_text FROM summary ORDER BY rowid DESC LIMIT 1)
+        """)
+        rows = cursor.fetchall()
 
         conn.commit()
-        conn.close()
 
-        screenshots_description_text_rows = [row[0] for row in screenshots_description_text_rows if row[0] is not None and row[0] != "-"]
-        photos_description_text_rows = [row[0] for row in photos_description_text_rows if row[0] is not None and row[0] != "-"]
-        audio_transcript_text_rows = [row[0] for row in audio_transcript_text_rows if row[0] is not None and row[0] != "-"]
-        # print(f"screenshots_description_text_rows: {len(screenshots_description_text_rows)}")
-        # print(f"photos_description_text_rows: {len(photos_description_text_rows)}")
-        # print(f"audio_transcript_text_rows: {len(audio_transcript_text_rows)}")
+        source_rows = {'screenshots': [], 'photos': [], 'audio': []}
+        watermarks = {}
+        to_timestamp = None
+        last_summary = None
+        for source, rowid, timestamp, text in rows:
+            if source == 'summary':
+                to_timestamp = timestamp
+                last_summary = text
+                continue
+            # Advance past every row read, only keep the ones with usable text
+            watermarks[source] = max(watermarks.get(source, 0), rowid)
+            if text is not None and text != "-":
+                source_rows[source].append((rowid, timestamp, text))
 
-        return to_timestamp, screenshots_description_text_rows, photos_description_text_rows, audio_transcript_text_rows
+        # First summary starts from the oldest capture
+        if to_timestamp is None:
+            timestamps = [row[1] for rows in source_rows.values() for row in rows]
+            to_timestamp = min(timestamps) if timestamps else None
+        # print(f"source_rows: { {source: len(rows) for source, rows in source_rows.items()} }")
+
+        return to_timestamp, source_rows['screenshots'], source_rows['photos'], source_rows['audio'], last_summary, watermarks
     def retrieve_last_summary_for_livesummary(self):
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         cursor = conn.cursor()
 
-        cursor.execute("SELECT content_text FROM summary ORDER BY timestamp DESC LIMIT 1")
-        last_summary_rows = cursor.fetchall()
-        last_summary_rows = last_summary_rows[0]
+        cursor.execute("SELECT content_text FROM summary ORDER BY rowid DESC LIMIT 1")
+        last_summary_row = cursor.fetchone()
 
         conn.commit()
-        conn.close()
 
-        final_output = last_summary_rows[0]
+        if last_summary_row is None:
+            return None
+
+        final_output = last_summary_row[0]
         print(f"final_output\n{final_output}")
 
         return final_output
@@ -164,12 +1032,10 @@ class DatabaseManager:
     def update_api_response(self, table_name, filepath, response, content):
         print(f'Updating {table_name}...')
 
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute(f"UPDATE {table_name} SET api_response = ? WHERE image_path = ?", (response, filepath))
-        c.execute(f"UPDATE {table_name} SET content = ? WHERE image_path = ?", (content, filepath))
-        conn.commit()
-        conn.close()
+        self.execute_write([
+            (f"UPDATE {table_name} SET api_response = ? WHERE image_path = ?", (response, filepath)),
+            (f"UPDATE {table_name} SET content = ? WHERE image_path = ?", (content, filepath))
+        ])
 
         print(f'Updated!\n')
-# endregion
\ No newline at end of file
+# endregion
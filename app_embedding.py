@@ -0,0 +1,358 @@
+import os
+import re
+import json
+import time
+import zlib
+import calendar
+import threading
+import numpy as np
+
+# region EmbeddingManager
+class EmbeddingManager:
+    def __init__(self, configManager, controlManager, databaseManager):
+        self.configManager = configManager
+        self.controlManager = controlManager
+        self.databaseManager = databaseManager
+
+        # Vectors live next to data.db, one float32 row per entry plus its search rowid and timestamp
+        self.sql_folder_path = 'data/sql/'
+        self.vectors_path = 'data/sql/embeddings.f32'
+        self.records_path = 'data/sql/embeddings.ids'
+        self.meta_path = 'data/sql/embeddings.json'
+        self.record_dtype = np.dtype([('search_rowid', '<i8'), ('timestamp_epoch', '<i8')])
+
+        self.embedding_enabled = self.configManager.get_config("embedding_enabled", True)
+        # "hashing" needs nothing beyond NumPy, "sentence-transformers/<model>" loads that model on the CPU,
+        # "auto" takes embedding_auto_model and falls back to hashing when it cannot be loaded
+        self.embedding_model = self.configManager.get_config("embedding_model", "auto")
+        self.embedding_auto_model = self.configManager.get_config("embedding_auto_model", "sentence-transformers/all-MiniLM-L6-v2")
+        self.embedding_hashing_dimensions = self.configManager.get_config("embedding_hashing_dimensions", 512)
+        # Cosine similarity below which a match is noise, hashing vectors of unrelated texts score far closer to zero than a sentence model's
+        self.embedding_min_similarity = self.configManager.get_config("embedding_min_similarity", 0.3)
+        self.embedding_hashing_min_similarity = self.configManager.get_config("embedding_hashing_min_similarity", 0.12)
+        self.embedding_batch_size = self.configManager.get_config("embedding_batch_size", 64)
+        self.embedding_loop_time_in_sec = self.configManager.get_config("embedding_loop_time_in_sec", 10)
+        # Rewrite the files once superseded vectors (re-described rows, growing transcripts) are this share of them
+        self.embedding_compact_ratio = self.configManager.get_config("embedding_compact_ratio", 0.5)
+
+        self.embedders = {
+            "hashing": (self.embed_hashing, self.embedding_hashing_dimensions),
+        }
+
+        self.store_lock = threading.Lock()
+        # Searches score against the maps outside the lock, compaction waits for them before replacing the files
+        self.store_condition = threading.Condition(self.store_lock)
+        self.active_searches = 0
+        # Bumped in embeddings.json by every compaction so readers in other processes know to map the new files
+        self.generation = 0
+        self.read_only = False
+        self.dimensions = None
+        self.vectors = None
+        self.records = None
+        self.valid = None
+        self.latest = {}
+        self.count = 0
+
+    # region Embedders
+    def register_embedder(self, model, embed_function, dimensions):
+        """Plug in an embedding backend, embed_function(texts) returns one float vector of length dimensions per text."""
+        self.embedders[model] = (embed_function, dimensions)
+    def load_sentence_transformer(self, model_name):
+        # Optional, only imported when configured
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model_name, device='cpu')
+        self.register_embedder(
+            model_name,
+            lambda texts: model.encode(texts, batch_size=self.embedding_batch_size, convert_to_numpy=True),
+            model.get_sentence_embedding_dimension()
+        )
+    def get_embedder(self):
+        if self.embedding_model == "auto":
+            # Hashing only matches shared words and word pieces, "budget meeting" never finds "Q3 spend review"
+            try:
+                if self.embedding_auto_model not in self.embedders:
+                    self.load_sentence_transformer(self.embedding_auto_model)
+                self.embedding_model = self.embedding_auto_model
+            except Exception as e:
+                print(f"Could not load {self.embedding_auto_model}, semantic search falls back to word hashing:", e)
+                self.embedding_model = "hashing"
+        elif self.embedding_model not in self.embedders and self.embedding_model.startswith("sentence-transformers/"):
+            self.load_sentence_transformer(self.embedding_model)
+        return self.embedders[self.embedding_model]
+    def embed_hashing(self, texts):
+        """Signed feature hashing of words and their character trigrams, lexical but with no model to download."""
+
+        vectors = np.zeros((len(texts), self.embedding_hashing_dimensions), dtype=np.float32)
+        for index, text in enumerate(texts):
+            for word in re.findall(r'\w+', text.lower()):
+                # Trigrams let "review" meet "reviewed" and survive OCR typos
+                padded_word = f'#{word}#'
+                features = [word] + [padded_word[offset:offset + 3] for offset in range(len(padded_word) - 2)]
+                for feature_index, feature in enumerate(features):
+                    feature_hash = zlib.crc32(feature.encode('utf-8'))
+                    weight = 1.0 if feature_index == 0 else 0.5
+                    vectors[index, feature_hash % self.embedding_hashing_dimensions] += weight if feature_hash & 0x80000000 else -weight
+        return vectors
+    def get_min_similarity(self):
+        self.get_embedder()
+        return self.embedding_hashing_min_similarity if self.embedding_model == "hashing" else self.embedding_min_similarity
+    def embed(self, texts):
+        embed_function, _ = self.get_embedder()
+        vectors = np.asarray(embed_function(texts), dtype=np.float32)
+        # Unit length so a dot product is the cosine similarity
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+    # endregion
+
+    # region Store
+    def open_store(self, read_only=False):
+        """Map the vector files, starting over (and re-queueing every text) when the embedding model changed."""
+
+        _, dimensions = self.get_embedder()
+        if not os.path.exists(self.sql_folder_path):
+            os.makedirs(self.sql_folder_path)
+
+        meta = {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as file:
+                meta = json.load(file)
+        model_changed = meta.get("model") != self.embedding_model or meta.get("dimensions") != dimensions
+        self.generation = meta.get("generation", 0)
+        self.read_only = read_only
+        # Other processes such as the CLI only read, the app may be appending to the files meanwhile
+        if read_only:
+            if model_changed:
+                print(f'Embeddings on disk are not from {self.embedding_model}, semantic search is off until the app re-embeds them')
+            count = 0 if model_changed else min(os.path.getsize(self.vectors_path) // (dimensions * 4), os.path.getsize(self.records_path) // self.record_dtype.itemsize)
+            self.load_store(dimensions, count)
+            return
+        if model_changed:
+            print(f'Starting embedding store for {self.embedding_model} ({dimensions} dimensions)...')
+            for path in (self.vectors_path, self.records_path):
+                open(path, 'wb').close()
+            self.write_meta(dimensions)
+            if meta:
+                self.databaseManager.requeue_embeddings()
+
+        # A crash between the two appends leaves one file longer, the shorter one decides
+        count = min(os.path.getsize(self.vectors_path) // (dimensions * 4), os.path.getsize(self.records_path) // self.record_dtype.itemsize)
+        for path, row_size in ((self.vectors_path, dimensions * 4), (self.records_path, self.record_dtype.itemsize)):
+            if os.path.getsize(path) != count * row_size:
+                os.truncate(path, count * row_size)
+
+        self.load_store(dimensions, count)
+    def write_meta(self, dimensions):
+        with open(self.meta_path + '.tmp', 'w') as file:
+            json.dump({"model": self.embedding_model, "dimensions": dimensions, "generation": self.generation}, file)
+        os.replace(self.meta_path + '.tmp', self.meta_path)
+    def read_generation(self):
+        try:
+            with open(self.meta_path, 'r') as file:
+                return json.load(file).get("generation", 0)
+        except (OSError, ValueError):
+            return self.generation
+    def load_store(self, dimensions, count):
+        with self.store_lock:
+            self.dimensions = dimensions
+            self.count = count
+            self.map_store()
+            # Later entries for the same text supersede earlier ones
+            self.latest = {}
+            self.valid = np.zeros(count, dtype=bool)
+            for index, search_rowid in enumerate(self.records['search_rowid'].tolist()):
+                previous_index = self.latest.get(search_rowid)
+                if previous_index is not None:
+                    self.valid[previous_index] = False
+                self.latest[search_rowid] = index
+                self.valid[index] = True
+    def map_store(self):
+        if self.count == 0:
+            self.vectors = np.zeros((0, self.dimensions), dtype=np.float32)
+            self.records = np.zeros(0, dtype=self.record_dtype)
+            return
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(self.count, self.dimensions))
+        self.records = np.memmap(self.records_path, dtype=self.record_dtype, mode='r', shape=(self.count,))
+    def append_vectors(self, search_rowids, timestamp_epochs, vectors):
+        records = np.zeros(len(search_rowids), dtype=self.record_dtype)
+        records['search_rowid'] = search_rowids
+        records['timestamp_epoch'] = timestamp_epochs
+
+        with self.store_lock:
+            for path, data in ((self.vectors_path, vectors), (self.records_path, records)):
+                with open(path, 'ab') as file:
+                    file.write(data.tobytes())
+                    file.flush()
+                    os.fsync(file.fileno())
+
+            start_index = self.count
+            self.count += len(search_rowids)
+            self.valid = np.concatenate([self.valid, np.ones(len(search_rowids), dtype=bool)])
+            for index, search_rowid in enumerate(search_rowids, start_index):
+                previous_index = self.latest.get(search_rowid)
+                if previous_index is not None:
+                    self.valid[previous_index] = False
+                self.latest[search_rowid] = index
+            self.map_store()
+    def remove_vectors(self, search_rowids):
+        with self.store_lock:
+            for search_rowid in search_rowids:
+                index = self.latest.pop(search_rowid, None)
+                if index is not None:
+                    self.valid[index] = False
+    def compact_store(self):
+        """Rewrite the files with only the live entries."""
+
+        with self.store_condition:
+            if self.count == 0 or 1 - len(self.latest) / self.count < self.embedding_compact_ratio:
+                return
+            print(f'Compacting embeddings, {self.count - len(self.latest)} of {self.count} superseded...')
+
+            keep_indexes = np.flatnonzero(self.valid)
+            for path, data in ((self.vectors_path, self.vectors), (self.records_path, self.records)):
+                with open(path + '.tmp', 'wb') as file:
+                    for offset in range(0, len(keep_indexes), 65536):
+                        file.write(np.ascontiguousarray(data[keep_indexes[offset:offset + 65536]]).tobytes())
+                    file.flush()
+                    os.fsync(file.fileno())
+            del data
+
+            # Windows refuses to replace a mapped file, so every map has to be gone first
+            while self.active_searches:
+                self.store_condition.wait()
+            self.vectors = None
+            self.records = None
+            try:
+                os.replace(self.vectors_path + '.tmp', self.vectors_path)
+            except PermissionError as e:
+                # Another process (the search CLI) still maps both files, keep them and try again next round
+                print("Compaction postponed, embeddings are in use:", e)
+                for path in (self.vectors_path, self.records_path):
+                    if os.path.exists(path + '.tmp'):
+                        os.remove(path + '.tmp')
+                self.map_store()
+                return
+            os.replace(self.records_path + '.tmp', self.records_path)
+
+            self.count = len(keep_indexes)
+            self.generation += 1
+            self.write_meta(self.dimensions)
+            self.map_store()
+            self.valid = np.ones(self.count, dtype=bool)
+            self.latest = {search_rowid: index for index, search_rowid in enumerate(self.records['search_rowid'].tolist())}
+
+            print(f'Compacted!\n')
+    # endregion
+
+    # region Indexing
+    def process_queue(self):
+        """Embed every queued text, returns how many were embedded."""
+
+        embedded_count = 0
+        after_id = 0
+        while True:
+            rows = self.databaseManager.retrieve_embedding_queue(after_id, self.embedding_batch_size * 4)
+            if not rows:
+                break
+            after_id = rows[-1][0]
+
+            # Streaming transcripts queue up once per appended piece, only their final text matters
+            entries = {}
+            for _, search_rowid, content, timestamp_epoch in rows:
+                entries[search_rowid] = (content, timestamp_epoch)
+            removed_rowids = [search_rowid for search_rowid, (content, _) in entries.items() if content is None]
+            entries = [(search_rowid, content, timestamp_epoch) for search_rowid, (content, timestamp_epoch) in entries.items() if content is not None]
+            self.remove_vectors(removed_rowids)
+
+            start_time = time.time()
+            for offset in range(0, len(entries), self.embedding_batch_size):
+                batch = entries[offset:offset + self.embedding_batch_size]
+                vectors = self.embed([content for _, content, _ in batch])
+                self.append_vectors([search_rowid for search_rowid, _, _ in batch], [timestamp_epoch or 0 for _, _, timestamp_epoch in batch], vectors)
+            if entries:
+                print(f'Embedded {len(entries)} texts in {time.time() - start_time:.2f} seconds.')
+            embedded_count += len(entries)
+
+            # Only forget queue rows once their vectors are on disk
+            self.databaseManager.delete_embedding_queue(after_id)
+
+        self.compact_store()
+        return embedded_count
+
+    def embedding_loop(self):
+        print(f'Embedding Loop\n')
+
+        if not self.embedding_enabled:
+            return
+        self.open_store()
+
+        while self.controlManager.is_running():
+            try:
+                self.process_queue()
+            except Exception as e:
+                print("Embedding Error:", e)
+
+            if self.controlManager.stop_event.wait(self.embedding_loop_time_in_sec):
+                break
+    # endregion
+
+    # region Query
+    def to_epoch(self, timestamp):
+        # Same wall clock as epoch seconds mapping as the timestamp_epoch columns
+        return calendar.timegm(time.strptime(timestamp, '%Y-%m-%d %H:%M:%S'))
+    def search_similar(self, text, from_timestamp=None, to_timestamp=None, sources=None, limit=20, min_similarity=None):
+        """Top cosine matches as (source, field, rowid, timestamp, text, score), optionally within a time range, set of sources and similarity floor."""
+
+        if self.vectors is None or (self.read_only and self.read_generation() != self.generation):
+            self.open_store(read_only=True)
+        query_vector = self.embed([text])[0]
+
+        with self.store_lock:
+            vectors = self.vectors
+            records = self.records
+            mask = self.valid.copy()
+            self.active_searches += 1
+        try:
+            return self.score_store(query_vector, vectors, records, mask, from_timestamp, to_timestamp, sources, limit, min_similarity)
+        finally:
+            # Drop the maps before letting a waiting compaction replace their files
+            del vectors, records
+            with self.store_condition:
+                self.active_searches -= 1
+                self.store_condition.notify_all()
+    def score_store(self, query_vector, vectors, records, mask, from_timestamp, to_timestamp, sources, limit, min_similarity):
+        if len(mask) == 0:
+            return []
+
+        if from_timestamp is not None:
+            mask &= records['timestamp_epoch'] >= self.to_epoch(from_timestamp)
+        if to_timestamp is not None:
+            mask &= records['timestamp_epoch'] <= self.to_epoch(to_timestamp)
+        if sources:
+            codes = [code for code, table_name, _ in self.databaseManager.search_fields if table_name in sources]
+            mask &= np.isin(records['search_rowid'] % 16, codes)
+
+        # Blocks keep the temporary scores small however large the map is
+        scores = np.full(len(mask), -np.inf, dtype=np.float32)
+        for offset in range(0, len(mask), 262144):
+            block_mask = mask[offset:offset + 262144]
+            if block_mask.any():
+                block_scores = vectors[offset:offset + 262144] @ query_vector
+                scores[offset:offset + 262144] = np.where(block_mask, block_scores, -np.inf)
+
+        if min_similarity is not None:
+            scores[scores < min_similarity] = -np.inf
+        candidate_count = min(limit, int(np.isfinite(scores).sum()))
+        if candidate_count == 0:
+            return []
+        top_indexes = np.argpartition(-scores, candidate_count - 1)[:candidate_count]
+        top_indexes = top_indexes[np.argsort(-scores[top_indexes])]
+
+        search_rowids = [int(records['search_rowid'][index]) for index in top_indexes]
+        entries = {entry[0]: entry[1:] for entry in self.databaseManager.retrieve_search_entries(search_rowids)}
+        return [
+            (*entries[search_rowid], float(scores[index]))
+            for search_rowid, index in zip(search_rowids, top_indexes)
+            if search_rowid in entries
+        ]
+    # endregion
+# endregion
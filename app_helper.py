@@ -1,38 +1,173 @@
 import os
 import io
-import json
+import cv2
+import wave
+import queue
 import time
 import base64
 import requests
 import tempfile
 import threading
+import numpy as np
 from PIL import Image
 from openai import OpenAI
+from urllib.parse import urlparse
 from gradio_client import Client
-from deepgram import DeepgramClient, PrerecordedOptions, FileSource
+from requests.adapters import HTTPAdapter
 
 class ControlManager:
-    def __init__(self):
+    def __init__(self, configManager):
+        self.configManager = configManager
+
         self._running = False
         self.stop_event = threading.Event()
 
+        # Capture scheduler, intervals shrink to the minimum on activity and double towards the maximum while idle
+        self.scheduler_enabled = self.configManager.get_config("scheduler_enabled", True)
+        self.scheduler_backoff_factor = self.configManager.get_config("scheduler_backoff_factor", 2)
+        self.schedules = {}
+        self.schedule_condition = threading.Condition()
+
     def start(self):
         self._running = True
+        self.stop_event.clear()
     def stop(self):
         self._running = False
         self.stop_event.set()
+        with self.schedule_condition:
+            self.schedule_condition.notify_all()
 
     def is_running(self):
         return self._running
 
+    # region Capture Scheduler
+    def register_capture(self, source, base_interval, min_interval, max_interval):
+        with self.schedule_condition:
+            self.schedules[source] = {
+                "base_interval": base_interval,
+                "min_interval": min(min_interval, base_interval),
+                "max_interval": max(max_interval, base_interval),
+                "interval": base_interval,
+                "activity": 0.0,
+                "activity_at": 0.0,
+            }
+    def report_activity(self, source, activity):
+        """Record a capture's change signal, normalised so 1.0 is the source's own activity threshold."""
+        with self.schedule_condition:
+            schedule = self.schedules[source]
+            schedule["activity"] = activity
+            schedule["activity_at"] = time.time()
+            # Activity anywhere can pull the other captures forward
+            if activity >= 1:
+                self.schedule_condition.notify_all()
+    def get_capture_interval(self, source):
+        with self.schedule_condition:
+            return self.schedules[source]["interval"]
+    def is_active_elsewhere(self, source, since):
+        return any(
+            other_schedule["activity"] >= 1 and other_schedule["activity_at"] > since
+            for other_source, other_schedule in self.schedules.items() if other_source != source
+        )
+    def plan_next_capture(self, source):
+        """Pick the source's next interval from its own and the other sources' recent activity."""
+
+        with self.schedule_condition:
+            schedule = self.schedules[source]
+            now = time.time()
+
+            if not self.scheduler_enabled:
+                interval, reason = schedule["base_interval"], "fixed"
+            elif schedule["activity"] >= 1:
+                interval, reason = schedule["min_interval"], "active"
+            elif self.is_active_elsewhere(source, now - schedule["interval"]):
+                interval, reason = max(schedule["interval"] / self.scheduler_backoff_factor, schedule["min_interval"]), "active elsewhere"
+            else:
+                interval, reason = min(schedule["interval"] * self.scheduler_backoff_factor, schedule["max_interval"]), "idle"
+            schedule["interval"] = interval
+            print(f'Next {source} capture in {interval:.0f} seconds ({reason})')
+
+            return interval
+    def wait_for_next_capture(self, source):
+        """Sleep until the source's next capture is due, returns True when stopping like stop_event.wait."""
+
+        interval = self.plan_next_capture(source)
+        with self.schedule_condition:
+            schedule = self.schedules[source]
+            now = time.time()
+            deadline = now + interval
+            while self._running:
+                if self.scheduler_enabled and self.is_active_elsewhere(source, now):
+                    # Burst, capture as soon as the minimum interval allows
+                    deadline = min(deadline, now + schedule["min_interval"])
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.schedule_condition.wait(remaining)
+
+        return self.stop_event.is_set()
+    # endregion
+
 class ModelManager:
-    def __init__(self, configManager):
+    def __init__(self, configManager, rateLimitManager, cacheManager):
         self.configManager = configManager
+        self.rateLimitManager = rateLimitManager
+        self.cacheManager = cacheManager
 
         self.openai_api_key = self.configManager.get_config("openai_api_key")
         self.together_api_key = self.configManager.get_config("together_api_key")
         self.deepgram_api_key = self.configManager.get_config("deepgram_api_key")
 
+        # Keep-alive HTTP pool, one session per host capped at http_pool_max_size connections
+        self.http_pool_max_size = self.configManager.get_config("http_pool_max_size", 4)
+        self.http_connect_timeout_in_sec = self.configManager.get_config("http_connect_timeout_in_sec", 10)
+        self.http_read_timeout_in_sec = self.configManager.get_config("http_read_timeout_in_sec", 120)
+        self.http_sessions = {}
+        self.clients_lock = threading.Lock()
+        self.openai_client = None
+        self.moondream_client = None
+
+        # Transcription backends by audio model name, each takes an audio file path and returns the transcript
+        self.audio_local_whisper_url = self.configManager.get_config("audio_local_whisper_url", "http://127.0.0.1:8080/v1/audio/transcriptions")
+        self.audio_local_whisper_model = self.configManager.get_config("audio_local_whisper_model", "whisper-1")
+        self.audio_stream_chunk_in_sec = self.configManager.get_config("audio_stream_chunk_in_sec", 5)
+        self.audio_stream_overlap_in_sec = self.configManager.get_config("audio_stream_overlap_in_sec", 1)
+        self.transcribers = {
+            "deepgram": self.call_deepgram_api,
+            "whisper": self.call_whisper_api,
+            "local_whisper": self.call_local_whisper_api,
+        }
+
+    def get_http_session(self, url):
+        host = urlparse(url).netloc
+
+        with self.clients_lock:
+            session = self.http_sessions.get(host)
+            if session is None:
+                # pool_block makes callers wait for a free connection instead of opening extra ones
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.http_pool_max_size, pool_block=True)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.http_sessions[host] = session
+        return session
+    def post_to_api(self, url, headers, **kwargs):
+        session = self.get_http_session(url)
+        return session.post(url, headers=headers, timeout=(self.http_connect_timeout_in_sec, self.http_read_timeout_in_sec), **kwargs)
+
+    def get_openai_client(self):
+        with self.clients_lock:
+            if self.openai_client is None:
+                self.openai_client = OpenAI(
+                    api_key=self.openai_api_key,
+                    timeout=self.http_read_timeout_in_sec
+                )
+        return self.openai_client
+    def get_moondream_client(self):
+        with self.clients_lock:
+            if self.moondream_client is None:
+                self.moondream_client = Client("https://niknair31-moondream1.hf.space/--replicas/frktd/")
+        return self.moondream_client
+
     def send_image_to_api(self, base64_encoded_image, image_model_name, system_prompt):
         """Determine which API to call based on the model selection and send the screenshot."""
 
@@ -79,19 +214,30 @@ class ModelManager:
             "max_tokens": 300
         }
         
-        response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
+        # Same image with the same prompt, e.g. an unchanged webcam view
+        cache_key = self.cacheManager.make_key(payload)
+        cached_text = self.cacheManager.get(cache_key)
+        if cached_text is not None:
+            return cached_text
+
+        rate_limit_key = f"openai/{payload['model']}"
+        estimated_tokens = self.estimate_payload_tokens(payload)
+        response = self.rateLimitManager.call(rate_limit_key, estimated_tokens, lambda: self.post_to_api("https://api.openai.com/v1/chat/completions", headers, json=payload))
         # print(response.json())
         
         # Time calculation
         elapsed_time = time.time() - start_time
         print(f'Received GPT4V response in {elapsed_time:.2f} seconds.')
         
-        return response.json()['choices'][0]['message']['content']
+        response_text = self.read_chat_completion(response, rate_limit_key, estimated_tokens)
+        self.cacheManager.set(cache_key, payload["model"], response_text)
+        return response_text
     def call_moondream_api(self, base64_encoded_image, system_prompt):
         print(f'Calling Moondream API...')
         
         start_time = time.time()
 
+        tmpfile_path = None
         try:
             # Decode the base64 string to bytes
             image_bytes = base64.b64decode(base64_encoded_image)
@@ -105,8 +251,8 @@ class ModelManager:
                 tmpfile_path = tmpfile.name
                 img.close()
 
-            # Initialize the Gradio client with your Moondream API URL
-            client = Client("https://niknair31-moondream1.hf.space/--replicas/frktd/")
+            # Reuse the Gradio client for your Moondream API URL
+            client = self.get_moondream_client()
 
             result = client.predict(
                 tmpfile_path,
@@ -119,17 +265,47 @@ class ModelManager:
 
             return result
         except Exception as e:
+            # Raised so the inference job fails and the row goes back to pending instead of done with no description
             print("An error occurred while calling Moondream API:", str(e))
-            return ""
+            raise
         finally:
             # Delay the deletion to here, ensuring all references are released
-            if os.path.exists(tmpfile_path):
+            if tmpfile_path is not None and os.path.exists(tmpfile_path):
                 os.unlink(tmpfile_path)
 
-    def send_text_to_llm_api(self, payload):
+    def estimate_payload_tokens(self, payload):
+        """Rough upfront token count for the rate limiter, ~4 characters per token plus the completion budget."""
+        prompt_tokens = 0
+        for message in payload["messages"]:
+            content = message["content"]
+            if isinstance(content, str):
+                prompt_tokens += len(content) // 4
+                continue
+            for part in content:
+                # Low detail images are billed at a flat 85 tokens
+                prompt_tokens += len(part.get("text", "")) // 4 if part["type"] == "text" else 85
+        return prompt_tokens + payload.get("max_tokens", 256)
+    def read_chat_completion(self, response, rate_limit_key, estimated_tokens):
+        # Anything left after the retries is an error the caller has to see, not a KeyError on 'choices'
+        response.raise_for_status()
+        response_json = response.json()
+
+        usage = response_json.get("usage")
+        if usage and "total_tokens" in usage:
+            self.rateLimitManager.record_usage(rate_limit_key, estimated_tokens, usage["total_tokens"])
+
+        return response_json['choices'][0]['message']['content']
+
+    def send_text_to_llm_api(self, payload, priority=None):
         print(f'Calling LLM API...')
         
         start_time = time.time()
+
+        # Keyed before the model name is rewritten below, so the provider prefix is part of the key
+        cache_key = self.cacheManager.make_key(payload)
+        cached_text = self.cacheManager.get(cache_key)
+        if cached_text is not None:
+            return cached_text
         
         model_name = payload["model"]
         # print(f"model_name: {model_name}")
@@ -139,18 +315,21 @@ class ModelManager:
         # print(f"actual_model_name: {actual_model_name}")
 
         if "local" in model_source:
+            provider = "local"
             url = "http://localhost:1234/v1/chat/completions"
             headers = {
                 "Content-Type": "application/json"
             }
         else:
             if "gpt" in actual_model_name:
+                provider = "openai"
                 url = "https://api.openai.com/v1/chat/completions"
                 headers = {
                     "Content-Type": "application/json",
                     "Authorization": f"Bearer {self.openai_api_key}"
                 }
             else:
+                provider = "together"
                 url = "https://api.together.xyz/v1/chat/completions"
                 headers = {
                     "Content-Type": "application/json",
@@ -160,52 +339,60 @@ class ModelManager:
         payload["model"] = actual_model_name
         # print(f"payload: {payload}")
 
-        response = requests.post(url, headers=headers, json=payload)
+        # One budget per provider/model shared by every thread
+        rate_limit_key = f"{provider}/{actual_model_name}"
+        estimated_tokens = self.estimate_payload_tokens(payload)
+        response = self.rateLimitManager.call(rate_limit_key, estimated_tokens, lambda: self.post_to_api(url, headers, json=payload), priority)
         # print(f"response.json()\n{response.json()}")
         
         elapsed_time = time.time() - start_time
         print(f'Received Together response in {elapsed_time:.2f} seconds.')
         
-        return response.json()['choices'][0]['message']['content']
+        response_text = self.read_chat_completion(response, rate_limit_key, estimated_tokens)
+        self.cacheManager.set(cache_key, model_name, response_text)
+        return response_text
 
     def send_audio_to_api(self, audio_path, audio_model):
         """Determine which API to call based on the model selection and send the screenshot."""
 
         print(f'Sending Audio to API...')
         
-        if audio_model == "deepgram":
-            response = self.call_deepgram_api(audio_path)
-        elif audio_model == "whisper":
-            response = self.call_whisper_api(audio_path)
-        else:
+        transcriber = self.transcribers.get(audio_model)
+        if transcriber is None:
             print(f"Invalid model selection: {audio_model}")
             return None
         
-        return response
+        return transcriber(audio_path)
+    def register_transcriber(self, audio_model, transcriber):
+        """Plug in a transcription backend, transcriber(audio_path) returns the transcript text."""
+        self.transcribers[audio_model] = transcriber
+    def open_transcription_stream(self, audio_model, sample_rate, on_transcript, vad=None):
+        """Start transcribing mono int16 audio as it is fed, on_transcript(text, latency_in_sec) gets each new piece in order."""
+        return TranscriptionStream(self, audio_model, sample_rate, self.audio_stream_chunk_in_sec, self.audio_stream_overlap_in_sec, on_transcript, vad)
     def call_deepgram_api(self, audio_path):
         print(f'Calling Deepgram API...')
 
         start_time = time.time()
 
-        deepgram = DeepgramClient(self.deepgram_api_key)
-        
-        with open(audio_path, "rb") as file:
-            buffer_data = file.read()
-        payload: FileSource = {
-            "buffer": buffer_data,
+        # Deepgram's REST API directly so the upload goes over the pooled keep-alive session
+        content_types = {".wav": "audio/wav", ".flac": "audio/flac", ".ogg": "audio/ogg"}
+        headers = {
+            "Content-Type": content_types.get(os.path.splitext(audio_path)[1], "application/octet-stream"),
+            "Authorization": f"Token {self.deepgram_api_key}"
         }
-        options = PrerecordedOptions(
-            model="nova-2-general"
-            # smart_format=True,
-            # diarize=True,
-            # dictation=True,
-            # filler_words=True,
-            # profanity_filter=False,
-            # punctuate=True
-            # summarize="v2"
-        )
-
-        response = deepgram.listen.prerecorded.v("1").transcribe_file(payload, options)
+        params = {
+            "model": "nova-2-general"
+            # "smart_format": "true",
+            # "diarize": "true",
+            # "dictation": "true",
+            # "filler_words": "true",
+            # "profanity_filter": "false",
+            # "punctuate": "true"
+            # "summarize": "v2"
+        }
+        # Streamed from disk, the file is never held in memory whole
+        with open(audio_path, "rb") as file:
+            response = self.post_to_api("https://api.deepgram.com/v1/listen", headers, params=params, data=file).json()
         
         elapsed_time = time.time() - start_time
         print(f'Received Deepgram response in {elapsed_time:.2f} seconds.')
@@ -215,16 +402,30 @@ class ModelManager:
         print(f'Calling Whisper API...')
 
         start_time = time.time()
-        client = OpenAI(self.openai_api_key)
+        client = self.get_openai_client()
 
-        audio_file= open(audio_path, "rb")
-        response = client.audio.transcriptions.create(
-            model="whisper-1", 
-            file=audio_file
-        )
+        with open(audio_path, "rb") as audio_file:
+            response = client.audio.transcriptions.create(
+                model="whisper-1", 
+                file=audio_file
+            )
         
         elapsed_time = time.time() - start_time
-        print(f'Received Deepgram response in {elapsed_time:.2f} seconds.')
+        print(f'Received Whisper response in {elapsed_time:.2f} seconds.')
+
+        return response.text
+    def call_local_whisper_api(self, audio_path):
+        print(f'Calling Local Whisper API...')
+
+        start_time = time.time()
+
+        # Any server speaking OpenAI's transcription API, e.g. faster-whisper-server or whisper.cpp's server
+        with open(audio_path, "rb") as audio_file:
+            files = {"file": (os.path.basename(audio_path), audio_file)}
+            response = self.post_to_api(self.audio_local_whisper_url, {}, data={"model": self.audio_local_whisper_model}, files=files).json()
+
+        elapsed_time = time.time() - start_time
+        print(f'Received Local Whisper response in {elapsed_time:.2f} seconds.')
 
         return response["text"]
 
@@ -242,27 +443,248 @@ class MediaManager:
         except Exception as e:
             print("Downscaling Image Error:", e)
             return None
-        
-    def negate_image(self, image_bytes):
+    def make_thumbnail(self, image_bytes, max_side=480, quality=60):
+        """Shrink an image to fit max_side pixels and re-encode it as a small JPEG."""
+        try:
+            img = Image.open(io.BytesIO(image_bytes))
+            img.thumbnail((max_side, max_side))
+            img_byte_arr = io.BytesIO()
+            img.convert('RGB').save(img_byte_arr, format='JPEG', quality=quality, optimize=True)
+            return img_byte_arr.getvalue()
+        except Exception as e:
+            print("Thumbnail Error:", e)
+            return None
+
+    def negate_frame(self, frame):
+        """Grayscale + invert a BGRA/BGR/gray frame array in one pass, returns a new uint8 array."""
+        if frame.ndim == 2:
+            negated = frame.copy()
+        elif frame.shape[2] == 4:
+            negated = cv2.cvtColor(frame, cv2.COLOR_BGRA2GRAY)
+        else:
+            negated = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        cv2.bitwise_not(negated, dst=negated)
+        return negated
+    def decode_negated_frame(self, image_bytes):
+        """Decode stored JPEG bytes straight to a negated grayscale array."""
         try:
-            print('Negating Image...')
-            with Image.open(io.BytesIO(image_bytes)) as img:
-                # Convert image to grayscale
-                grayscale_img = img.convert('L')
-                # Invert the grayscale image
-                inverted_img = Image.eval(grayscale_img, lambda x: 255 - x)
-                # Save the inverted image
-                output_img_byte_arr = io.BytesIO()
-                inverted_img.save(output_img_byte_arr, format='JPEG')
-            return output_img_byte_arr.getvalue()
+            gray = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+            cv2.bitwise_not(gray, dst=gray)
+            return gray
         except Exception as e:
-            print("Negate Image Error:", e)
+            print("Decode Frame Error:", e)
+            return None
+    def encode_frame(self, frame, quality=90):
+        """Encode a BGRA frame array to JPEG bytes without going through an intermediate image file."""
+        try:
+            print('Encoding Frame...')
+            height, width = frame.shape[:2]
+            img = Image.frombuffer('RGB', (width, height), frame, 'raw', 'BGRX', 0, 1)
+            img_byte_arr = io.BytesIO()
+            img.save(img_byte_arr, format='JPEG', quality=quality)
+            return img_byte_arr.getvalue()
+        except Exception as e:
+            print("Encode Frame Error:", e)
+            return None
+
+    def compute_array_signature(self, gray_array, downsample_factor=8):
+        """Block-mean downsample of a 2D grayscale array, cheap enough to diff every capture."""
+        target_size = (max(gray_array.shape[1] // downsample_factor, 1), max(gray_array.shape[0] // downsample_factor, 1))
+        return cv2.resize(gray_array, target_size, interpolation=cv2.INTER_AREA).astype(np.int16)
+    def compute_signature_change(self, previous_signature, signature, pixel_threshold=16):
+        """Fraction of signature pixels that moved by more than pixel_threshold grey levels."""
+        if previous_signature is None or signature is None or previous_signature.shape != signature.shape:
+            return 1.0
+        changed_pixels = np.abs(signature - previous_signature) > pixel_threshold
+        return np.count_nonzero(changed_pixels) / changed_pixels.size
+    def split_bands(self, gray_array, band_count, edge_threshold=32):
+        """Split a 2D grayscale array into band_count (top, bottom) row ranges cut on the emptiest nearby pixel rows."""
+        height = gray_array.shape[0]
+        if band_count <= 1 or height < band_count:
+            return [(0, height)]
+
+        # Ink per row counted as sharp horizontal steps, the gaps between text lines have next to none
+        row_ink = np.count_nonzero(np.abs(np.diff(gray_array.astype(np.int16), axis=1)) > edge_threshold, axis=1)
+        search_length = height // band_count // 4
+        cuts = [0]
+        for band in range(1, band_count):
+            nominal_cut = band * height // band_count
+            low = max(nominal_cut - search_length, cuts[-1] + 1)
+            high = min(nominal_cut + search_length, height - 1)
+            window = row_ink[low:high + 1]
+            # Of the emptiest rows in reach, the one closest to the even split keeps bands balanced
+            candidates = np.flatnonzero(window == window.min()) + low
+            cuts.append(int(candidates[np.argmin(np.abs(candidates - nominal_cut))]))
+        cuts.append(height)
+        return list(zip(cuts[:-1], cuts[1:]))
+
+    def compute_frame_energy(self, samples, sample_rate, channels, frame_in_ms=30):
+        """Per-frame energy in dB and zero-crossing rate over interleaved int16 samples, with the frame and mono sample counts."""
+        mono = samples.reshape(-1, channels).astype(np.float32).mean(axis=1) / 32768.0
+        frame_length = max(int(sample_rate * frame_in_ms / 1000), 1)
+        frame_count = len(mono) // frame_length
+        frames = mono[:frame_count * frame_length].reshape(frame_count, frame_length)
+
+        energy_in_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+        zero_crossing_rate = np.mean(np.signbit(frames[:, 1:]) != np.signbit(frames[:, :-1]), axis=1)
+        return energy_in_db, zero_crossing_rate, frame_length, len(mono)
+    def estimate_noise_floor(self, samples, sample_rate, channels, frame_in_ms=30):
+        """Energy in dB of the quietest tenth of the frames, or None for less than one frame."""
+        energy_in_db, _, _, _ = self.compute_frame_energy(samples, sample_rate, channels, frame_in_ms)
+        if len(energy_in_db) == 0:
+            return None
+        return float(np.percentile(energy_in_db, 10))
+    def update_noise_floor(self, noise_floor_in_db, samples, sample_rate, channels, rise=0.05, steady_rise=0.5, steady_spread_in_db=2, frame_in_ms=30):
+        """Fold the quiet end of a segment into a running noise floor, returns the new floor."""
+        energy_in_db, _, _, _ = self.compute_frame_energy(samples, sample_rate, channels, frame_in_ms)
+        if len(energy_in_db) == 0:
+            return noise_floor_in_db
+        segment_floor_in_db = float(np.percentile(energy_in_db, 10))
+        if noise_floor_in_db is None or segment_floor_in_db < noise_floor_in_db:
+            return segment_floor_in_db
+        # A sound holding its level through the whole segment (a fan, mains hum, a test tone) is background,
+        # the floor climbs to it within a few segments instead of keeping it speech for good
+        if np.percentile(energy_in_db, 90) - segment_floor_in_db < steady_spread_in_db:
+            rise = steady_rise
+        return noise_floor_in_db + (segment_floor_in_db - noise_floor_in_db) * rise
+    def detect_speech(self, samples, sample_rate, channels, energy_threshold_in_db=-45, min_speech_in_sec=0.5, padding_in_sec=0.5, frame_in_ms=30, noise_floor_in_db=None):
+        """Energy/zero-crossing VAD over interleaved int16 samples, returns the padded (start, end) frame range with speech or None."""
+        energy_in_db, zero_crossing_rate, frame_length, sample_count = self.compute_frame_energy(samples, sample_rate, channels, frame_in_ms)
+        if len(energy_in_db) == 0:
+            return None
+
+        # Without a room floor tracked across segments, the quiet end of this one stands in for it,
+        # above the absolute threshold it was measured on speech and judging the audio against itself would call all of it silence
+        if noise_floor_in_db is None:
+            noise_floor_in_db = np.percentile(energy_in_db, 10)
+            if noise_floor_in_db > energy_threshold_in_db:
+                noise_floor_in_db = None
+        # A tracked floor is trusted even above the absolute threshold, a steady background sound it has absorbed is not speech
+        if noise_floor_in_db is None:
+            threshold_in_db = energy_threshold_in_db
+        else:
+            threshold_in_db = max(energy_threshold_in_db, noise_floor_in_db + 6)
+
+        # Loud enough above the threshold, and not flat hiss
+        speech_frames = (energy_in_db > threshold_in_db) & (zero_crossing_rate < 0.4)
+        if np.count_nonzero(speech_frames) * frame_length < min_speech_in_sec * sample_rate:
             return None
 
+        speech_indices = np.flatnonzero(speech_frames)
+        padding = int(padding_in_sec * sample_rate)
+        start = max(speech_indices[0] * frame_length - padding, 0)
+        end = min((speech_indices[-1] + 1) * frame_length + padding, sample_count)
+        return int(start), int(end)
+
     def encode_image(self, image_bytes):
         """Encode image bytes to base64."""
         try:
             return base64.b64encode(image_bytes).decode('utf-8')
         except Exception as e:
             print("Encode Image Error:", e)
-            return None
\ No newline at end of file
+            return None
+
+class TranscriptionStream:
+    def __init__(self, modelManager, audio_model, sample_rate, chunk_in_sec, overlap_in_sec, on_transcript, vad=None):
+        self.modelManager = modelManager
+        self.audio_model = audio_model
+        self.sample_rate = sample_rate
+        self.chunk_length = int(chunk_in_sec * sample_rate)
+        self.overlap_length = int(overlap_in_sec * sample_rate)
+        self.on_transcript = on_transcript
+        # vad(samples, sample_rate) returns False for chunks not worth sending
+        self.vad = vad
+
+        self.pending_samples = []
+        self.pending_length = 0
+        self.overlap_samples = np.zeros(0, dtype=np.int16)
+        self.previous_words = []
+
+        # One worker per stream keeps the pieces in capture order
+        self.chunk_queue = queue.Queue()
+        self.worker = threading.Thread(target=self.worker_loop, daemon=True)
+        self.worker.start()
+
+        self.latencies = []
+        # Samples of new audio the vad let through or held back, chunk overlaps are counted once
+        self.speech_length = 0
+        self.silent_length = 0
+
+    def feed(self, samples):
+        self.pending_samples.append(samples)
+        self.pending_length += len(samples)
+        if self.pending_length >= self.chunk_length:
+            self.flush()
+    def flush(self):
+        if self.pending_length == 0:
+            return
+        new_samples = np.concatenate(self.pending_samples)
+        chunk = np.concatenate((self.overlap_samples, new_samples))
+        self.pending_samples = []
+        self.pending_length = 0
+
+        # The tail is sent again at the start of the next chunk so words on the cut are not lost
+        self.overlap_samples = chunk[-self.overlap_length:] if self.overlap_length else np.zeros(0, dtype=np.int16)
+        self.chunk_queue.put((chunk, len(new_samples), time.time()))
+    def close(self):
+        """Send what is left and wait until every piece has been delivered."""
+        self.flush()
+        self.chunk_queue.put(None)
+        self.worker.join()
+
+        if self.latencies:
+            print(f'Streamed {len(self.latencies)} chunks, latency avg {sum(self.latencies) / len(self.latencies):.2f}s, max {max(self.latencies):.2f}s')
+
+    def merge_overlap(self, text, max_overlap_words=20):
+        """Drop the words at the start of text that repeat the end of what was already delivered."""
+        words = text.split()
+        normalized_words = [word.strip('.,!?;:"\'').lower() for word in words]
+        for overlap in range(min(max_overlap_words, len(words), len(self.previous_words)), 0, -1):
+            if normalized_words[:overlap] == self.previous_words[-overlap:]:
+                words = words[overlap:]
+                normalized_words = normalized_words[overlap:]
+                break
+        self.previous_words = (self.previous_words + normalized_words)[-max_overlap_words:]
+        return ' '.join(words)
+
+    def worker_loop(self):
+        while True:
+            item = self.chunk_queue.get()
+            if item is None:
+                break
+            chunk, new_length, captured_at = item
+
+            if self.vad is not None:
+                if not self.vad(chunk, self.sample_rate):
+                    self.silent_length += new_length
+                    continue
+                self.speech_length += new_length
+
+            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as chunk_file:
+                chunk_path = chunk_file.name
+            try:
+                with wave.open(chunk_path, 'wb') as wf:
+                    wf.setnchannels(1)
+                    wf.setsampwidth(2)
+                    wf.setframerate(self.sample_rate)
+                    wf.writeframes(chunk.tobytes())
+                transcript_text = self.modelManager.send_audio_to_api(chunk_path, self.audio_model)
+            except Exception as e:
+                print("Streaming Transcription Error:", e)
+                transcript_text = None
+            finally:
+                os.remove(chunk_path)
+
+            if not transcript_text:
+                continue
+            transcript_text = self.merge_overlap(transcript_text)
+            if not transcript_text:
+                continue
+
+            # From the moment the chunk's last sample was captured to the text being handed over
+            latency = time.time() - captured_at
+            self.latencies.append(latency)
+            try:
+                self.on_transcript(transcript_text, latency)
+            except Exception as e:
+                print("Streaming Transcript Callback Error:", e)
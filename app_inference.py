@@ -0,0 +1,122 @@
+import time
+import queue
+import threading
+
+# region InferenceManager
+class InferenceManager:
+    def __init__(self, configManager, databaseManager):
+        self.configManager = configManager
+        self.databaseManager = databaseManager
+
+        self.inference_max_attempts = self.configManager.get_config("inference_max_attempts", 3)
+        self.inference_worker_count = self.configManager.get_config("inference_worker_count", 4)
+        self.inference_queue_max_size = self.configManager.get_config("inference_queue_max_size", 32)
+
+        # Capture loops only enqueue, the workers do the OCR/LLM/transcription calls
+        self.job_queue = queue.Queue(maxsize=self.inference_queue_max_size)
+        self.workers = []
+        self.workers_lock = threading.Lock()
+        # One per start(), set by stop() so that generation of workers exits once the queue runs dry
+        self.workers_stop_event = threading.Event()
+
+        self.stats_lock = threading.Lock()
+        self.started_at = None
+        self.busy_worker_count = 0
+        self.busy_time_total = 0.0
+        self.completed_job_count = 0
+        self.failed_job_count = 0
+
+    def start(self):
+        print(f'Starting Inference Workers...')
+
+        with self.workers_lock:
+            with self.stats_lock:
+                self.started_at = self.started_at or time.time()
+            if not self.workers:
+                self.workers_stop_event = threading.Event()
+            for index in range(len(self.workers), self.inference_worker_count):
+                worker = threading.Thread(target=self.worker_loop, args=(self.workers_stop_event,), name=f'inference-{index}', daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+        print(f'Started!\n')
+    def stop(self):
+        print(f'Stopping Inference Workers...')
+
+        # Never blocks the caller (the UI thread) on a full queue, the workers finish the pending jobs and exit once it is empty
+        with self.workers_lock:
+            self.workers_stop_event.set()
+            self.workers = []
+
+        print(f'Stopped!\n')
+
+    def submit_row(self, table_name, rowid, job_function, *job_args):
+        """Queue processing of a pending row without blocking, a full queue leaves the row to the backlog."""
+
+        try:
+            self.job_queue.put_nowait((table_name, self.process_row, (table_name, rowid, job_function) + job_args))
+        except queue.Full:
+            print(f'Inference queue full, {table_name} row {rowid} left pending for the backlog')
+            return False
+        print(f'Queued {table_name} job ({self.job_queue.qsize()}/{self.inference_queue_max_size})')
+        return True
+
+    def process_row(self, table_name, rowid, job_function, *job_args):
+        # Only one of the live pipeline and the backlog gets to claim a pending row
+        if not self.databaseManager.claim_row(table_name, rowid):
+            print(f'{table_name} row {rowid} already claimed or done, skipping')
+            return
+
+        try:
+            job_function(rowid, *job_args)
+        except Exception as e:
+            self.databaseManager.release_row(table_name, rowid, str(e), self.inference_max_attempts)
+            raise
+
+    def worker_loop(self, stop_event):
+        while True:
+            try:
+                job = self.job_queue.get(timeout=0.5)
+            except queue.Empty:
+                if stop_event.is_set():
+                    break
+                continue
+
+            job_name, job_function, job_args = job
+            with self.stats_lock:
+                self.busy_worker_count += 1
+            start_time = time.time()
+
+            try:
+                job_function(*job_args)
+                failed = False
+            except Exception as e:
+                print(f"Inference Job Error ({job_name}):", e)
+                failed = True
+
+            elapsed_time = time.time() - start_time
+            with self.stats_lock:
+                self.busy_worker_count -= 1
+                self.busy_time_total += elapsed_time
+                if failed:
+                    self.failed_job_count += 1
+                else:
+                    self.completed_job_count += 1
+
+            stats = self.get_stats()
+            print(f'Finished {job_name} job in {elapsed_time:.2f} seconds. Queue {stats["queue_depth"]}/{stats["queue_max_size"]}, {stats["busy_workers"]}/{stats["workers"]} workers busy, {stats["utilisation"]:.0%} utilisation')
+
+    def get_stats(self):
+        with self.stats_lock:
+            elapsed_time = time.time() - self.started_at if self.started_at else 0
+            worker_count = len(self.workers)
+            return {
+                "queue_depth": self.job_queue.qsize(),
+                "queue_max_size": self.inference_queue_max_size,
+                "workers": worker_count,
+                "busy_workers": self.busy_worker_count,
+                "utilisation": self.busy_time_total / (elapsed_time * worker_count) if elapsed_time and worker_count else 0,
+                "completed_jobs": self.completed_job_count,
+                "failed_jobs": self.failed_job_count,
+            }
+# endregion
@@ -0,0 +1,99 @@
+import os
+import time
+import threading
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# region OCR Worker
+# Lives in each pool process so the engine is loaded once and reused for every tile
+ocr_engine = None
+
+def initialize_ocr_engine(tesseract_cmd):
+    global ocr_engine
+
+    try:
+        # tesserocr keeps one Tesseract instance with its language data loaded in memory
+        import tesserocr
+        # Language data of the installed Tesseract, next to its executable on Windows
+        tessdata_path = os.path.join(os.path.dirname(tesseract_cmd), 'tessdata')
+        ocr_engine = tesserocr.PyTessBaseAPI(path=tessdata_path) if os.path.isdir(tessdata_path) else tesserocr.PyTessBaseAPI()
+        return
+    except ImportError:
+        print("tesserocr is not installed, OCR falls back to one tesseract process per tile")
+    except Exception as e:
+        # Missing tessdata or language, an initializer that raises would break the whole pool
+        print("tesserocr failed to start, OCR falls back to one tesseract process per tile:", e)
+
+    # pytesseract still spawns tesseract per call but the pool runs those in parallel
+    import pytesseract
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    ocr_engine = pytesseract
+
+def recognise_tile(tile):
+    img = Image.fromarray(tile)
+    try:
+        if hasattr(ocr_engine, 'image_to_string'):
+            return ocr_engine.image_to_string(img)
+        ocr_engine.SetImage(img)
+        return ocr_engine.GetUTF8Text()
+    except Exception as e:
+        print("OCR Error:", e)
+        return ''
+# endregion
+
+# region OCRManager
+class OCRManager:
+    def __init__(self, configManager, tesseract_cmd):
+        self.configManager = configManager
+        self.tesseract_cmd = tesseract_cmd
+
+        self.ocr_process_count = self.configManager.get_config("ocr_process_count", os.cpu_count() or 1)
+
+        self.executor = None
+        self.executor_lock = threading.Lock()
+
+    def get_executor(self):
+        with self.executor_lock:
+            if self.executor is None:
+                print(f'Starting {self.ocr_process_count} OCR processes...')
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.ocr_process_count,
+                    initializer=initialize_ocr_engine,
+                    initargs=(self.tesseract_cmd,)
+                )
+        return self.executor
+
+    def reset_executor(self, executor):
+        with self.executor_lock:
+            # Another thread may have replaced the broken pool already
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=False)
+
+    def recognise_tiles(self, tiles):
+        """OCR a list of 2D grayscale arrays across the process pool, results keep the input order."""
+
+        if not tiles:
+            return []
+
+        start_time = time.time()
+        executor = self.get_executor()
+        try:
+            tile_texts = list(executor.map(recognise_tile, tiles))
+        except BrokenProcessPool as e:
+            # A crashed worker breaks the pool for good, start a fresh one and retry once
+            print("OCR process pool broke, restarting it:", e)
+            self.reset_executor(executor)
+            tile_texts = list(self.get_executor().map(recognise_tile, tiles))
+        elapsed_time = time.time() - start_time
+        print(f'Recognised {len(tiles)} tiles on {self.ocr_process_count} processes in {elapsed_time:.2f} seconds.')
+
+        return tile_texts
+
+    def shutdown(self):
+        with self.executor_lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+# endregion
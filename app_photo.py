@@ -6,17 +6,25 @@ from PIL import Image
 from mss import mss
 
 class PhotoManager:
-    def __init__(self, configManager, controlManager, modelManager, databaseManager, mediaManager):
+    def __init__(self, configManager, controlManager, modelManager, databaseManager, mediaManager, inferenceManager):
         self.configManager = configManager
         self.controlManager = controlManager
         self.modelManager = modelManager
         self.databaseManager = databaseManager
         self.mediaManager = mediaManager
+        self.inferenceManager = inferenceManager
 
         self.photo_loop_time_in_min = self.configManager.get_config("photo_loop_time_in_min") * 60
         self.photo_image_model = self.configManager.get_config("photo_image_model")
         self.photo_compression_perc = self.configManager.get_config("photo_compression_perc")
 
+        # Capture rate follows how much the camera view changes between the min and max intervals
+        self.photo_min_interval_in_sec = self.configManager.get_config("photo_min_interval_in_sec", self.photo_loop_time_in_min / 4)
+        self.photo_max_interval_in_sec = self.configManager.get_config("photo_max_interval_in_sec", self.photo_loop_time_in_min * 8)
+        self.photo_activity_change_threshold = self.configManager.get_config("photo_activity_change_threshold", 0.05)
+        self.controlManager.register_capture('photo', self.photo_loop_time_in_min, self.photo_min_interval_in_sec, self.photo_max_interval_in_sec)
+        self.previous_signature = None
+
         self.photos_folder_path = 'data/photos/'
         # FIXME: Compare prompts for moondream API
         self.default_system_prompt = "Describe the image in detail"
@@ -41,6 +49,21 @@ class PhotoManager:
 
         return img_encoded.tobytes()
     
+    def process_photo(self, rowid, image_filename, original_image_bytes=None):
+        # Rows picked up by the backlog only have the saved image left
+        if original_image_bytes is None:
+            with open(os.path.join(self.photos_folder_path, image_filename), 'rb') as f:
+                original_image_bytes = f.read()
+
+        # Pass through Vision LLM
+        original_image_bytes_base64_encoded = self.mediaManager.encode_image(original_image_bytes)
+        description_text = self.modelManager.send_image_to_api(original_image_bytes_base64_encoded, self.photo_image_model, self.default_system_prompt)
+        if description_text is None:
+            raise ValueError(f"No description from {self.photo_image_model}")
+
+        # Save to SQL
+        self.databaseManager.update_photo_db(rowid, description_text)
+
     def photo_loop(self):
         print(f'Photo Loop\n')
 
@@ -54,10 +77,19 @@ class PhotoManager:
             timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
             filename = time.strftime('%Y-%m-%d-%H-%M-%S')
             original_image_bytes = self.take_photo()
-            
-            # Pass through Vision LLM
-            original_image_bytes_base64_encoded = self.mediaManager.encode_image(original_image_bytes)
-            description_text = self.modelManager.send_image_to_api(original_image_bytes_base64_encoded, self.photo_image_model, self.default_system_prompt)
+
+            # A failed camera read counts as no activity, try again on the next capture
+            if original_image_bytes is None:
+                self.controlManager.report_activity('photo', 0.0)
+                if self.controlManager.wait_for_next_capture('photo'):
+                    break
+                continue
+
+            # Change against the previous photo drives the capture rate
+            signature = self.mediaManager.compute_array_signature(self.mediaManager.decode_negated_frame(original_image_bytes))
+            change_ratio = self.mediaManager.compute_signature_change(self.previous_signature, signature)
+            self.controlManager.report_activity('photo', change_ratio / self.photo_activity_change_threshold)
+            self.previous_signature = signature
             
             # Save the original image to the specified path
             downscaled_image_bytes = self.mediaManager.downscale_image(original_image_bytes, quality=self.photo_compression_perc)
@@ -66,8 +98,9 @@ class PhotoManager:
             with open(image_path, 'wb') as f:
                 f.write(downscaled_image_bytes)
 
-            # Save to SQL
-            self.databaseManager.save_to_photo_db(timestamp, image_filename, description_text)
+            # Save to SQL as pending, description is filled in by the inference workers
+            rowid = self.databaseManager.save_to_photo_db(timestamp, image_filename, None)
+            self.inferenceManager.submit_row('photos', rowid, self.process_photo, image_filename, original_image_bytes)
 
-            if self.controlManager.stop_event.wait(self.photo_loop_time_in_min):
+            if self.controlManager.wait_for_next_capture('photo'):
                 break
\ No newline at end of file
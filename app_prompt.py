@@ -0,0 +1,89 @@
+import re
+import threading
+
+# region PromptManager
+class PromptManager:
+    def __init__(self, configManager):
+        self.configManager = configManager
+
+        # Prompt token budgets by model name, with or without the provider prefix
+        self.prompt_token_budgets = self.configManager.get_config("prompt_token_budgets", {})
+        self.prompt_default_token_budget = self.configManager.get_config("prompt_default_token_budget", 3000)
+
+        self.encodings = {}
+        self.encodings_lock = threading.Lock()
+
+    # region Tokens
+    def get_encoding(self, model):
+        with self.encodings_lock:
+            if model not in self.encodings:
+                try:
+                    # tiktoken is optional and fetches its BPE files on first use, either can fail offline
+                    import tiktoken
+                    try:
+                        self.encodings[model] = tiktoken.encoding_for_model(model.split('/')[-1])
+                    except KeyError:
+                        self.encodings[model] = tiktoken.get_encoding("cl100k_base")
+                except Exception as e:
+                    print(f"Tokenizer unavailable for {model}, estimating 4 characters per token:", e)
+                    self.encodings[model] = None
+            return self.encodings[model]
+    def count_tokens(self, text, model):
+        encoding = self.get_encoding(model)
+        if encoding is None:
+            return len(text) // 4 + 1
+        return len(encoding.encode(text, disallowed_special=()))
+    def get_budget(self, model):
+        if model in self.prompt_token_budgets:
+            return self.prompt_token_budgets[model]
+        return self.prompt_token_budgets.get(model.split('/')[-1], self.prompt_default_token_budget)
+    # endregion
+
+    # region Packing
+    def score_line(self, line):
+        """How much a line is worth keeping, OCR noise like borders and stray glyphs scores zero."""
+        words = re.findall(r'[^\W\d_]{3,}', line)
+        return len(words) * len(words) / max(len(line), 1)
+    def split_units(self, text, split_sentences=True):
+        # Lines, with long lines such as audio transcripts further cut into sentences
+        if not split_sentences:
+            return text.splitlines()
+        units = []
+        for line in text.splitlines():
+            units.extend(sentence for sentence in re.split(r'(?<=[.!?])\s+', line) if sentence.strip())
+        return units
+    def pack_lines(self, model, lines, budget, rank=None, label='prompt'):
+        """Deduplicate lines and keep the best ranked ones that fit budget tokens, in their original order."""
+
+        # Repeated lines (static UI, terminal spam, looping captions) only count once
+        seen = set()
+        unique_lines = []
+        for line in lines:
+            normalized_line = ' '.join(line.split()).lower()
+            if normalized_line and normalized_line not in seen:
+                seen.add(normalized_line)
+                unique_lines.append(line.strip())
+
+        if rank is None:
+            # Lines without a single real word are OCR noise
+            rank = self.score_line
+            unique_lines = [line for line in unique_lines if rank(line) > 0]
+        line_tokens = [self.count_tokens(line, model) + 1 for line in unique_lines]
+        original_tokens = sum(self.count_tokens(line, model) + 1 for line in lines)
+
+        kept = set()
+        used_tokens = 0
+        for index in sorted(range(len(unique_lines)), key=lambda index: rank(unique_lines[index]), reverse=True):
+            if used_tokens + line_tokens[index] <= budget:
+                kept.add(index)
+                used_tokens += line_tokens[index]
+
+        packed_lines = [line for index, line in enumerate(unique_lines) if index in kept]
+        print(f'Packed {label} for {model}: {used_tokens} tokens from {original_tokens}, {len(lines) - len(packed_lines)} of {len(lines)} lines dropped (budget {budget})')
+        return packed_lines
+    def pack_text(self, model, text, reserved_texts=(), reserved_tokens=0, rank=None, split_sentences=True, label='prompt'):
+        """Fit text into the model's budget after whatever else goes into the same request."""
+        budget = self.get_budget(model) - reserved_tokens - sum(self.count_tokens(reserved_text, model) for reserved_text in reserved_texts)
+        return '\n'.join(self.pack_lines(model, self.split_units(text or '', split_sentences), max(budget, 0), rank, label))
+    # endregion
+# endregion
@@ -0,0 +1,184 @@
+import time
+import heapq
+import random
+import threading
+
+# region RateLimitManager
+class RateLimitManager:
+    def __init__(self, configManager):
+        self.configManager = configManager
+
+        # Per provider/model budgets, e.g. {"openai/gpt-4-turbo-preview": {"rpm": 500, "tpm": 30000}}
+        self.rate_limits = self.configManager.get_config("rate_limits", {})
+        self.rate_limit_default_rpm = self.configManager.get_config("rate_limit_default_rpm", 60)
+        self.rate_limit_default_tpm = self.configManager.get_config("rate_limit_default_tpm", 60000)
+        self.rate_limit_max_retries = self.configManager.get_config("rate_limit_max_retries", 5)
+        self.rate_limit_backoff_base_in_sec = self.configManager.get_config("rate_limit_backoff_base_in_sec", 1)
+        self.rate_limit_backoff_max_in_sec = self.configManager.get_config("rate_limit_backoff_max_in_sec", 60)
+
+        # Lower value goes first when callers queue up on the same bucket
+        self.priorities = {"question": 0, "summary": 0, "live": 1, "backfill": 2}
+
+        self.buckets = {}
+        self.condition = threading.Condition()
+        self.sequence = 0
+        self.local = threading.local()
+
+    def set_thread_priority(self, priority):
+        """Default priority for calls made from the current thread, e.g. as a thread pool initializer."""
+        self.local.priority = priority
+    def get_thread_priority(self):
+        return getattr(self.local, "priority", "live")
+
+    def get_bucket(self, key):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            limits = self.rate_limits.get(key, {})
+            rpm = limits.get("rpm", self.rate_limit_default_rpm)
+            tpm = limits.get("tpm", self.rate_limit_default_tpm)
+            # Buckets start full and refill continuously at the per-minute rate
+            bucket = {
+                "rpm": rpm,
+                "tpm": tpm,
+                "requests": float(rpm),
+                "tokens": float(tpm),
+                "refilled_at": time.time(),
+                "blocked_until": 0.0,
+                "waiters": [],
+                "request_count": 0,
+                "token_count": 0,
+                "throttled_count": 0,
+                "retry_count": 0,
+                "error_count": 0,
+                "wait_time_total": 0.0,
+            }
+            self.buckets[key] = bucket
+        return bucket
+    def refill(self, bucket):
+        now = time.time()
+        elapsed_time = now - bucket["refilled_at"]
+        bucket["requests"] = min(bucket["rpm"], bucket["requests"] + elapsed_time * bucket["rpm"] / 60)
+        bucket["tokens"] = min(bucket["tpm"], bucket["tokens"] + elapsed_time * bucket["tpm"] / 60)
+        bucket["refilled_at"] = now
+
+    def acquire(self, key, tokens, priority=None):
+        """Block until key's buckets hold one request and tokens, higher priority waiters go first. Returns the time waited."""
+
+        priority = self.priorities.get(priority or self.get_thread_priority(), self.priorities["live"])
+        start_time = time.time()
+
+        with self.condition:
+            bucket = self.get_bucket(key)
+            # A single call larger than the whole budget would never fit
+            tokens = min(tokens, bucket["tpm"])
+            self.sequence += 1
+            waiter = (priority, self.sequence)
+            heapq.heappush(bucket["waiters"], waiter)
+
+            while True:
+                self.refill(bucket)
+                now = time.time()
+                if bucket["waiters"][0] == waiter and now >= bucket["blocked_until"] and bucket["requests"] >= 1 and bucket["tokens"] >= tokens:
+                    break
+
+                # Sleep until this waiter could be served, or until someone else changes the picture
+                wait_time = max(
+                    bucket["blocked_until"] - now,
+                    (1 - bucket["requests"]) * 60 / bucket["rpm"],
+                    (tokens - bucket["tokens"]) * 60 / bucket["tpm"],
+                    0.05
+                )
+                self.condition.wait(min(wait_time, 1.0))
+
+            heapq.heappop(bucket["waiters"])
+            bucket["requests"] -= 1
+            bucket["tokens"] -= tokens
+            bucket["request_count"] += 1
+            bucket["token_count"] += tokens
+            waited_time = time.time() - start_time
+            bucket["wait_time_total"] += waited_time
+            self.condition.notify_all()
+
+        if waited_time > 0.1:
+            print(f'Rate limiter held {key} for {waited_time:.2f} seconds')
+        return waited_time
+    def record_usage(self, key, estimated_tokens, actual_tokens):
+        """Settle the difference between the estimate taken up front and what the API reported."""
+        with self.condition:
+            bucket = self.get_bucket(key)
+            difference = min(estimated_tokens, bucket["tpm"]) - actual_tokens
+            bucket["tokens"] = min(bucket["tpm"], bucket["tokens"] + difference)
+            bucket["token_count"] -= difference
+            self.condition.notify_all()
+    def block(self, key, delay):
+        """Hold every caller of key back, used when the provider itself starts throttling."""
+        with self.condition:
+            bucket = self.get_bucket(key)
+            bucket["blocked_until"] = max(bucket["blocked_until"], time.time() + delay)
+            bucket["requests"] = min(bucket["requests"], 0)
+
+    def call(self, key, tokens, send_request, priority=None):
+        """Run send_request() under key's budget, retrying 429/5xx with jittered exponential backoff. Returns the final response."""
+
+        for attempt in range(self.rate_limit_max_retries + 1):
+            self.acquire(key, tokens, priority)
+
+            try:
+                response = send_request()
+            except Exception as e:
+                response = None
+                error = str(e)
+            else:
+                if response.status_code != 429 and response.status_code < 500:
+                    return response
+                error = f'HTTP {response.status_code}'
+
+            with self.condition:
+                bucket = self.get_bucket(key)
+                if response is not None and response.status_code == 429:
+                    bucket["throttled_count"] += 1
+                else:
+                    bucket["error_count"] += 1
+                if attempt < self.rate_limit_max_retries:
+                    bucket["retry_count"] += 1
+
+            if attempt == self.rate_limit_max_retries:
+                break
+
+            # Full jitter so threads throttled together don't come back together, Retry-After wins when given
+            delay = random.uniform(0, min(self.rate_limit_backoff_base_in_sec * 2 ** attempt, self.rate_limit_backoff_max_in_sec))
+            retry_after = response.headers.get("Retry-After") if response is not None else None
+            if retry_after is not None:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+            if response is not None and response.status_code == 429:
+                self.block(key, delay)
+            print(f'{key} failed ({error}), retrying in {delay:.2f} seconds ({attempt + 1}/{self.rate_limit_max_retries})')
+            time.sleep(delay)
+
+        if response is None:
+            raise ConnectionError(f'{key} failed after {self.rate_limit_max_retries} retries: {error}')
+        return response
+
+    def get_stats(self):
+        with self.condition:
+            stats = {}
+            for key, bucket in self.buckets.items():
+                self.refill(bucket)
+                stats[key] = {
+                    "rpm": bucket["rpm"],
+                    "tpm": bucket["tpm"],
+                    "requests_available": bucket["requests"],
+                    "tokens_available": bucket["tokens"],
+                    "waiting": len(bucket["waiters"]),
+                    "requests": bucket["request_count"],
+                    "tokens": bucket["token_count"],
+                    "throttled": bucket["throttled_count"],
+                    "retries": bucket["retry_count"],
+                    "errors": bucket["error_count"],
+                    "wait_time_total": bucket["wait_time_total"],
+                }
+            return stats
+# endregion
@@ -0,0 +1,226 @@
+import os
+import time
+
+try:
+    # libsndfile encoder for Opus audio thumbnails, audio goes straight from full to text without it
+    import soundfile
+except ImportError:
+    soundfile = None
+
+# region RetentionManager
+class RetentionManager:
+    def __init__(self, configManager, controlManager, databaseManager, mediaManager):
+        self.configManager = configManager
+        self.controlManager = controlManager
+        self.databaseManager = databaseManager
+        self.mediaManager = mediaManager
+
+        # Media is kept at full quality, then as a thumbnail, then only its text stays in the database
+        self.retention_enabled = self.configManager.get_config("retention_enabled", True)
+        self.retention_full_days = self.configManager.get_config("retention_full_days", 7)
+        self.retention_thumbnail_days = self.configManager.get_config("retention_thumbnail_days", 90)
+        # Past this size the oldest media is downsampled early regardless of age, 0 for no quota
+        self.retention_max_media_size_in_mb = self.configManager.get_config("retention_max_media_size_in_mb", 0)
+        self.retention_thumbnail_max_side = self.configManager.get_config("retention_thumbnail_max_side", 480)
+        self.retention_thumbnail_quality = self.configManager.get_config("retention_thumbnail_quality", 60)
+        self.retention_batch_size = self.configManager.get_config("retention_batch_size", 50)
+        # Pause between batches so a large first pass never competes with the capture loops
+        self.retention_batch_pause_in_sec = self.configManager.get_config("retention_batch_pause_in_sec", 1)
+        self.retention_loop_time_in_min = self.configManager.get_config("retention_loop_time_in_min", 60)
+
+        self.media_folders = {
+            'screenshots': 'data/screenshots/',
+            'photos': 'data/photos/',
+            'audio': 'data/audios/',
+        }
+
+        # Opus needs a libsndfile built with it
+        self.audio_thumbnail_enabled = soundfile is not None and 'OPUS' in soundfile.available_subtypes('OGG')
+
+        self.reclaimed_bytes = 0
+        self.thumbnail_count = 0
+        self.removed_count = 0
+
+    def get_stats(self):
+        return {
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "thumbnail_count": self.thumbnail_count,
+            "removed_count": self.removed_count,
+        }
+
+    def get_media_size(self):
+        media_size = 0
+        for folder_path in self.media_folders.values():
+            if not os.path.exists(folder_path):
+                continue
+            with os.scandir(folder_path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        media_size += entry.stat().st_size
+        return media_size
+
+    # region Downsampling
+    def make_thumbnail(self, table_name, filename):
+        """Write the smaller copy of a media file next to it, returns its filename or None when it could not be made."""
+
+        folder_path = self.media_folders[table_name]
+        source_path = os.path.join(folder_path, filename)
+        stem = os.path.splitext(filename)[0]
+
+        if table_name == 'audio':
+            thumbnail_filename = f'{stem}.thumb.ogg'
+            temp_path = os.path.join(folder_path, thumbnail_filename + '.tmp')
+            try:
+                # Mono Opus keeps speech intelligible at a fraction of FLAC or WAV
+                data, sample_rate = soundfile.read(source_path, dtype='int16')
+                if data.ndim > 1:
+                    data = data.mean(axis=1).astype('int16')
+                soundfile.write(temp_path, data, sample_rate, format='OGG', subtype='OPUS')
+            except Exception as e:
+                print("Audio Thumbnail Error:", e)
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                return None
+        else:
+            thumbnail_filename = f'{stem}.thumb.jpeg'
+            temp_path = os.path.join(folder_path, thumbnail_filename + '.tmp')
+            with open(source_path, 'rb') as source_file:
+                thumbnail_bytes = self.mediaManager.make_thumbnail(source_file.read(), self.retention_thumbnail_max_side, self.retention_thumbnail_quality)
+            if thumbnail_bytes is None:
+                return None
+            with open(temp_path, 'wb') as target_file:
+                target_file.write(thumbnail_bytes)
+
+        os.replace(temp_path, os.path.join(folder_path, thumbnail_filename))
+        return thumbnail_filename
+
+    def downsample_rows(self, table_name, media_column, rows, media_tier):
+        """Move the rows' files to media_tier, returns the bytes reclaimed."""
+
+        folder_path = self.media_folders[table_name]
+        changes = []
+        for _, _, filename in rows:
+            source_path = os.path.join(folder_path, filename)
+            if not os.path.exists(source_path):
+                # Nothing left to downsample, the row is text only already
+                changes.append((filename, None, 'text'))
+            elif media_tier == 'text':
+                changes.append((filename, None, 'text'))
+            else:
+                thumbnail_filename = self.make_thumbnail(table_name, filename)
+                # A file that cannot be decoded keeps its path until it ages out to text
+                changes.append((filename, thumbnail_filename or filename, 'thumbnail'))
+
+        # Files are only removed once every row that used them points elsewhere, a crash in between leaves an orphan, never a broken path
+        self.databaseManager.update_media_paths(table_name, media_column, changes)
+
+        reclaimed_bytes = 0
+        for old_filename, new_filename, new_media_tier in changes:
+            if new_filename == old_filename:
+                continue
+            old_path = os.path.join(folder_path, old_filename)
+            if not os.path.exists(old_path):
+                continue
+            reclaimed_bytes += os.path.getsize(old_path)
+            os.remove(old_path)
+            if new_filename:
+                reclaimed_bytes -= os.path.getsize(os.path.join(folder_path, new_filename))
+                self.thumbnail_count += 1
+            else:
+                self.removed_count += 1
+
+        self.reclaimed_bytes += reclaimed_bytes
+        return reclaimed_bytes
+
+    def get_steps(self, table_name):
+        # (current tier, next tier) in the order files go through them, audio without Opus keeps full quality until text-only is due
+        if table_name == 'audio' and not self.audio_thumbnail_enabled:
+            return [('full', 'text'), ('thumbnail', 'text')]
+        return [('full', 'thumbnail'), ('thumbnail', 'text')]
+    # endregion
+
+    # region Policy
+    def apply_age_policy(self):
+        """Downsample everything past its tier's age, batch by batch, returns the bytes reclaimed."""
+
+        now = time.time()
+        cutoff_timestamps = {
+            'thumbnail': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now - self.retention_full_days * 86400)),
+            'text': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now - self.retention_thumbnail_days * 86400)),
+        }
+
+        reclaimed_bytes = 0
+        for table_name, media_column in self.databaseManager.media_tables:
+            for media_tier, next_media_tier in self.get_steps(table_name):
+                while self.controlManager.is_running():
+                    rows = self.databaseManager.retrieve_media_rows(table_name, media_column, media_tier, cutoff_timestamps[next_media_tier], self.retention_batch_size)
+                    if not rows:
+                        break
+                    reclaimed_bytes += self.downsample_rows(table_name, media_column, rows, next_media_tier)
+                    if self.controlManager.stop_event.wait(self.retention_batch_pause_in_sec):
+                        break
+        return reclaimed_bytes
+
+    def apply_quota_policy(self):
+        """Downsample the oldest media of any source until the folders fit the quota, returns the bytes reclaimed."""
+
+        if not self.retention_max_media_size_in_mb:
+            return 0
+        max_media_size = self.retention_max_media_size_in_mb * 1024 * 1024
+        media_size = self.get_media_size()
+        now_timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+
+        reclaimed_bytes = 0
+        # Everything becomes a thumbnail before anything loses its media entirely
+        for target_media_tier in ('thumbnail', 'text'):
+            while media_size > max_media_size and self.controlManager.is_running():
+                candidates = []
+                for table_name, media_column in self.databaseManager.media_tables:
+                    for media_tier, next_media_tier in self.get_steps(table_name):
+                        if next_media_tier != target_media_tier:
+                            continue
+                        for row in self.databaseManager.retrieve_media_rows(table_name, media_column, media_tier, now_timestamp, self.retention_batch_size):
+                            candidates.append((row[1], table_name, media_column, next_media_tier, row))
+                if not candidates:
+                    break
+
+                # Oldest first across sources, grouped back per table for the path updates
+                batches = {}
+                for _, table_name, media_column, next_media_tier, row in sorted(candidates)[:self.retention_batch_size]:
+                    batches.setdefault((table_name, media_column, next_media_tier), []).append(row)
+                for (table_name, media_column, next_media_tier), rows in batches.items():
+                    batch_reclaimed_bytes = self.downsample_rows(table_name, media_column, rows, next_media_tier)
+                    media_size -= batch_reclaimed_bytes
+                    reclaimed_bytes += batch_reclaimed_bytes
+                if self.controlManager.stop_event.wait(self.retention_batch_pause_in_sec):
+                    break
+        return reclaimed_bytes
+
+    def process_retention(self):
+        start_time = time.time()
+        try:
+            reclaimed_bytes = self.apply_age_policy() + self.apply_quota_policy()
+        finally:
+            # Shards touched by the pass go back to read-only in one go
+            self.databaseManager.seal_shards()
+
+        if reclaimed_bytes:
+            print(f'Retention reclaimed {reclaimed_bytes / 1024 / 1024:.1f} MB in {time.time() - start_time:.2f} seconds ({self.reclaimed_bytes / 1024 / 1024:.1f} MB, {self.thumbnail_count} thumbnails, {self.removed_count} removed so far)\n')
+        return reclaimed_bytes
+
+    def retention_loop(self):
+        print(f'Retention Loop\n')
+
+        if not self.retention_enabled:
+            return
+
+        while self.controlManager.is_running():
+            try:
+                self.process_retention()
+            except Exception as e:
+                print("Retention Error:", e)
+
+            if self.controlManager.stop_event.wait(self.retention_loop_time_in_min * 60):
+                break
+    # endregion
+# endregion
@@ -1,24 +1,51 @@
 import os
-import io
 import cv2
 import time
+import threading
 import pytesseract
-from PIL import Image
+import numpy as np
 from mss import mss
+from app_ocr import OCRManager
 
 pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
 class ScreenshotManager:
-    def __init__(self, configManager, controlManager, modelManager, databaseManager, mediaManager):
+    def __init__(self, configManager, controlManager, modelManager, batchManager, promptManager, databaseManager, mediaManager, inferenceManager):
         self.configManager = configManager
         self.controlManager = controlManager
         self.modelManager = modelManager
+        self.batchManager = batchManager
+        self.promptManager = promptManager
         self.databaseManager = databaseManager
         self.mediaManager = mediaManager
+        self.inferenceManager = inferenceManager
 
         self.screenshot_loop_time_in_min = self.configManager.get_config("screenshot_loop_time_in_min") * 60
         self.screenshot_text_model = self.configManager.get_config("screenshot_text_model")
         self.screenshot_compression_perc = self.configManager.get_config("screenshot_compression_perc")
+        self.screenshot_dedup_change_threshold = self.configManager.get_config("screenshot_dedup_change_threshold", 0.0005)
+
+        # Capture rate follows screen activity between the min and max intervals
+        self.screenshot_min_interval_in_sec = self.configManager.get_config("screenshot_min_interval_in_sec", self.screenshot_loop_time_in_min / 4)
+        self.screenshot_max_interval_in_sec = self.configManager.get_config("screenshot_max_interval_in_sec", self.screenshot_loop_time_in_min * 8)
+        self.screenshot_activity_change_threshold = self.configManager.get_config("screenshot_activity_change_threshold", 0.02)
+        self.controlManager.register_capture('screenshot', self.screenshot_loop_time_in_min, self.screenshot_min_interval_in_sec, self.screenshot_max_interval_in_sec)
+
+        # Last frame that went through OCR/LLM, near identical frames only reference its row
+        self.reference_signature = None
+        self.reference_rowid = None
+
+        # Per-tile OCR cache, only tiles that changed since they were last recognised go back through OCR.
+        # Tiles are text bands inside each monitor so lines are not cut at the monitor seam
+        self.screenshot_tile_rows = self.configManager.get_config("screenshot_tile_rows", 8)
+        self.screenshot_tile_cols = self.configManager.get_config("screenshot_tile_cols", 1)
+        self.screenshot_tile_change_threshold = self.configManager.get_config("screenshot_tile_change_threshold", 0.001)
+        self.tile_cache_lock = threading.Lock()
+        self.tile_cache_size = None
+        self.tile_cache = []
+        self.monitor_boxes = None
+
+        self.ocrManager = OCRManager(self.configManager, pytesseract.pytesseract.tesseract_cmd)
 
         self.screenshots_folder_path = 'data/screenshots/'
         self.default_system_prompt = "What do you see? Be precise. You have the OCR text contents of my Windows desktop screenshots. Tell what you see on the screen and text you see in details. It can be a youtube video, rick and morty series, terminal, twitter, vs code, and many others. answer with cool details. If you can't see make best guess."
@@ -34,20 +61,96 @@ class ScreenshotManager:
                 "width": width, 
                 "height": height
             })
-            screenshot = Image.frombytes('RGB', (sct_img.width, sct_img.height), sct_img.rgb)
-        img_byte_arr = io.BytesIO()
-        screenshot.save(img_byte_arr, format='JPEG')
-        return img_byte_arr.getvalue()
+            # Monitor rectangles relative to the grabbed region, used to shard OCR per monitor
+            self.monitor_boxes = self.compute_monitor_boxes(sct.monitors, monitor["left"], monitor["top"], width, height)
+        # BGRA view over mss' own buffer, nothing is copied until grayscale and JPEG encoding
+        return np.frombuffer(sct_img.raw, dtype=np.uint8).reshape(sct_img.height, sct_img.width, 4)
     
-    def extract_text_from_image_tesseract(self, negated_image_bytes):
-        try:
-            with Image.open(io.BytesIO(negated_image_bytes)) as img:
-                extracted_text = pytesseract.image_to_string(img)
-                return extracted_text
-        except Exception as e:
-            print("Error:", e)
-            return ''
+    def compute_monitor_boxes(self, monitors, origin_left, origin_top, width, height):
+        boxes = []
+        for monitor in monitors[1:]:
+            left = max(monitor["left"] - origin_left, 0)
+            top = max(monitor["top"] - origin_top, 0)
+            right = min(monitor["left"] - origin_left + monitor["width"], width)
+            bottom = min(monitor["top"] - origin_top + monitor["height"], height)
+            if right > left and bottom > top:
+                boxes.append((left, top, right, bottom))
+        return boxes or [(0, 0, width, height)]
+    def compute_tile_boxes(self, gray):
+        height, width = gray.shape
+        # Frames loaded from disk by the backlog may not match the current monitor layout
+        monitor_boxes = self.monitor_boxes
+        if not monitor_boxes or max(box[2] for box in monitor_boxes) > width or max(box[3] for box in monitor_boxes) > height:
+            monitor_boxes = [(0, 0, width, height)]
+
+        boxes = []
+        for monitor_left, monitor_top, monitor_right, monitor_bottom in monitor_boxes:
+            monitor_width = monitor_right - monitor_left
+            for col in range(self.screenshot_tile_cols):
+                left = monitor_left + col * monitor_width // self.screenshot_tile_cols
+                right = monitor_left + (col + 1) * monitor_width // self.screenshot_tile_cols
+                # Bands are cut on blank rows between text lines, a line split across two tiles reads as garbage in both
+                for top, bottom in self.mediaManager.split_bands(gray[monitor_top:monitor_bottom, left:right], self.screenshot_tile_rows):
+                    boxes.append((left, monitor_top + top, right, monitor_top + bottom))
+        return boxes
+    def extract_text_from_changed_tiles(self, negated_frame, use_tile_cache=True):
+        gray = negated_frame
+        height, width = gray.shape
+        boxes = self.compute_tile_boxes(gray)
+
+        # The cache pairs each tile's box and pixels with its text, so frames can arrive in any order.
+        # A band whose cut moved to another blank row goes back through OCR on its own
+        start_time = time.time()
+        tile_signatures = [self.mediaManager.compute_array_signature(gray[top:bottom, left:right]) for left, top, right, bottom in boxes]
+        tile_texts = [None] * len(boxes)
+        if use_tile_cache:
+            with self.tile_cache_lock:
+                if self.tile_cache_size != (width, height, len(boxes)):
+                    self.tile_cache_size = (width, height, len(boxes))
+                    self.tile_cache = [None] * len(boxes)
+                for index, signature in enumerate(tile_signatures):
+                    cached_tile = self.tile_cache[index]
+                    if cached_tile is not None and cached_tile[0] == boxes[index] and self.mediaManager.compute_signature_change(cached_tile[1], signature) < self.screenshot_tile_change_threshold:
+                        tile_texts[index] = cached_tile[2]
+        changed_indexes = [index for index, tile_text in enumerate(tile_texts) if tile_text is None]
+
+        # Changed tiles fan out across the OCR process pool, outside the lock so other workers keep going meanwhile
+        changed_texts = self.ocrManager.recognise_tiles([gray[boxes[index][1]:boxes[index][3], boxes[index][0]:boxes[index][2]] for index in changed_indexes])
+        for index, tile_text in zip(changed_indexes, changed_texts):
+            tile_texts[index] = tile_text
+
+        if use_tile_cache:
+            with self.tile_cache_lock:
+                # Skipped when another frame changed the layout in the meantime
+                if self.tile_cache_size == (width, height, len(boxes)):
+                    for index, tile_text in zip(changed_indexes, changed_texts):
+                        self.tile_cache[index] = (boxes[index], tile_signatures[index], tile_text)
+
+        elapsed_time = time.time() - start_time
+        print(f'OCR on {len(changed_indexes)}/{len(boxes)} changed tiles in {elapsed_time:.2f} seconds.')
+
+        return '\n'.join(tile_text.strip() for tile_text in tile_texts if tile_text.strip())
     
+    def process_screenshot(self, rowid, image_filename, negated_frame=None):
+        # Rows picked up by the backlog only have the saved image left
+        use_tile_cache = negated_frame is not None
+        if negated_frame is None:
+            with open(os.path.join(self.screenshots_folder_path, image_filename), 'rb') as f:
+                negated_frame = self.mediaManager.decode_negated_frame(f.read())
+            if negated_frame is None:
+                raise ValueError(f"Could not decode {image_filename}")
+
+        # Pass through OCR, frames from disk are hours away from the live ones and would only evict their tiles
+        ocr_text = self.extract_text_from_changed_tiles(negated_frame, use_tile_cache)
+        
+        # Pass OCR through LLM, batched with other rows described around the same time.
+        # Raw OCR is mostly repeated UI chrome and glyph noise, only the wordiest lines that fit the budget go out
+        prompt_text = self.promptManager.pack_text(self.screenshot_text_model, ocr_text, reserved_texts=(self.default_system_prompt,), label='screenshot OCR')
+        description_text = self.batchManager.describe(self.screenshot_text_model, self.default_system_prompt, prompt_text, max_tokens=300, temperature=0.1)
+
+        # Save to SQL
+        self.databaseManager.update_screenshot_db(rowid, ocr_text, description_text)
+
     def screenshot_loop(self):
         print(f'Screenshot Loop\n')
 
@@ -61,39 +164,35 @@ class ScreenshotManager:
             # Pull data
             timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
             filename = time.strftime('%Y-%m-%d-%H-%M-%S')
-            original_image_bytes = self.take_screenshot()
-            
-            # Pass through OCR
-            negated_image_bytes = self.mediaManager.negate_image(original_image_bytes)
-            ocr_text = self.extract_text_from_image_tesseract(negated_image_bytes)
-            
-            # Pass OCR through LLM
-            payload = {
-                "model": self.screenshot_text_model,
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": self.default_system_prompt
-                    },
-                    {
-                        "role": "user",
-                        "content": ocr_text
-                    }
-                ],
-                "max_tokens": 300,
-                "temperature": 0.1
-            }
-            description_text = self.modelManager.send_text_to_llm_api(payload)
+            frame = self.take_screenshot()
+
+            # Grayscale/invert once on the raw frame, OCR and the change check both work off it
+            negated_frame = self.mediaManager.negate_frame(frame)
+
+            # Skip OCR/LLM and the JPEG when the screen barely changed since the reference frame
+            signature = self.mediaManager.compute_array_signature(negated_frame)
+            change_ratio = self.mediaManager.compute_signature_change(self.reference_signature, signature)
+            self.controlManager.report_activity('screenshot', change_ratio / self.screenshot_activity_change_threshold)
+            if self.reference_rowid is not None and change_ratio < self.screenshot_dedup_change_threshold:
+                print(f'Screen unchanged ({change_ratio:.2%}), referencing row {self.reference_rowid}')
+                self.databaseManager.save_duplicate_to_screenshot_db(timestamp, self.reference_rowid)
+
+                if self.controlManager.wait_for_next_capture('screenshot'):
+                    break
+                continue
             
-            # Save compressed image
-            downscaled_image_bytes = self.mediaManager.downscale_image(original_image_bytes, quality=self.screenshot_compression_perc)
+            # Save compressed image, the only JPEG encode of this frame
+            downscaled_image_bytes = self.mediaManager.encode_frame(frame, quality=self.screenshot_compression_perc)
             image_filename = f"{filename}.jpeg"
             image_path = os.path.join(self.screenshots_folder_path, image_filename)
             with open(image_path, 'wb') as f:
                 f.write(downscaled_image_bytes)
 
-            # Save to SQL
-            self.databaseManager.save_to_screenshot_db(timestamp, image_filename, ocr_text, description_text)
+            # Save to SQL as pending, OCR and description are filled in by the inference workers
+            rowid = self.databaseManager.save_to_screenshot_db(timestamp, image_filename, None, None)
+            self.inferenceManager.submit_row('screenshots', rowid, self.process_screenshot, image_filename, negated_frame)
+            self.reference_signature = signature
+            self.reference_rowid = rowid
 
-            if self.controlManager.stop_event.wait(self.screenshot_loop_time_in_min):
+            if self.controlManager.wait_for_next_capture('screenshot'):
                 break
\ No newline at end of file
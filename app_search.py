@@ -0,0 +1,102 @@
+import time
+import argparse
+
+from app_helper import ControlManager, ModelManager, MediaManager
+from app_config import ConfigurationManager
+from app_db import DatabaseManager
+from app_ratelimit import RateLimitManager
+from app_cache import CacheManager
+from app_prompt import PromptManager
+from app_embedding import EmbeddingManager
+from app_agent import AgentManager
+
+# region Search CLI
+def run_search(configManager, databaseManager, args):
+    start_time = time.time()
+    rows = databaseManager.search_text(
+        args.query, from_timestamp=args.from_timestamp, to_timestamp=args.to_timestamp,
+        sources=args.source, limit=args.limit, raw_query=args.raw
+    )
+    elapsed_time = time.time() - start_time
+
+    for source, field, rowid, timestamp, snippet, score in rows:
+        print(f'{timestamp}  {source}#{rowid} {field}  ({-score:.2f})')
+        print(f'    {" ".join(snippet.split())}')
+    print(f'\n{len(rows)} results in {elapsed_time * 1000:.1f} ms')
+def run_optimize(configManager, databaseManager, args):
+    start_time = time.time()
+    databaseManager.optimize_search_index()
+    print(f'Optimized search index in {time.time() - start_time:.2f} seconds.')
+
+def run_rebuild(configManager, databaseManager, args):
+    start_time = time.time()
+    databaseManager.rebuild_search_index()
+    print(f'Rebuilt search index in {time.time() - start_time:.2f} seconds.')
+def run_similar(configManager, databaseManager, args):
+    embeddingManager = EmbeddingManager(configManager, ControlManager(configManager), databaseManager)
+
+    start_time = time.time()
+    rows = embeddingManager.search_similar(args.query, from_timestamp=args.from_timestamp, to_timestamp=args.to_timestamp, sources=args.source, limit=args.limit)
+    elapsed_time = time.time() - start_time
+
+    for source, field, rowid, timestamp, text, score in rows:
+        print(f'{timestamp}  {source}#{rowid} {field}  ({score:.2f})')
+        print(f'    {" ".join(text.split())[:200]}')
+    print(f'\n{len(rows)} results in {elapsed_time * 1000:.1f} ms')
+def run_ask(configManager, databaseManager, args):
+    controlManager = ControlManager(configManager)
+    rateLimitManager = RateLimitManager(configManager)
+    cacheManager = CacheManager(configManager)
+    modelManager = ModelManager(configManager, rateLimitManager, cacheManager)
+    promptManager = PromptManager(configManager)
+    embeddingManager = EmbeddingManager(configManager, controlManager, databaseManager)
+    agentManager = AgentManager(configManager, controlManager, modelManager, promptManager, embeddingManager, databaseManager, MediaManager())
+
+    print(agentManager.answer_question(args.question, from_timestamp=args.from_timestamp, to_timestamp=args.to_timestamp))
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Search everything EYES has captured and ask questions about it.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    search_parser = subparsers.add_parser('search', help='ranked full text search over OCR, descriptions, transcripts and summaries')
+    search_parser.add_argument('query')
+    search_parser.add_argument('--from', dest='from_timestamp', help="'YYYY-MM-DD HH:MM:SS', inclusive")
+    search_parser.add_argument('--to', dest='to_timestamp', help="'YYYY-MM-DD HH:MM:SS', inclusive")
+    search_parser.add_argument('--source', action='append', choices=['screenshots', 'photos', 'audio', 'summary'])
+    search_parser.add_argument('--limit', type=int, default=20)
+    search_parser.add_argument('--raw', action='store_true', help='pass the query through as FTS5 syntax (OR, NEAR, prefix*)')
+    search_parser.set_defaults(handler=run_search)
+
+    similar_parser = subparsers.add_parser('similar', help='semantic search over the embedded descriptions, transcripts and summaries')
+    similar_parser.add_argument('query')
+    similar_parser.add_argument('--from', dest='from_timestamp', help="'YYYY-MM-DD HH:MM:SS', inclusive")
+    similar_parser.add_argument('--to', dest='to_timestamp', help="'YYYY-MM-DD HH:MM:SS', inclusive")
+    similar_parser.add_argument('--source', action='append', choices=['screenshots', 'photos', 'audio', 'summary'])
+    similar_parser.add_argument('--limit', type=int, default=20)
+    similar_parser.set_defaults(handler=run_similar)
+
+    ask_parser = subparsers.add_parser('ask', help='answer a question about past activity from the relevant captures')
+    ask_parser.add_argument('question')
+    ask_parser.add_argument('--from', dest='from_timestamp', help="'YYYY-MM-DD HH:MM:SS', inclusive")
+    ask_parser.add_argument('--to', dest='to_timestamp', help="'YYYY-MM-DD HH:MM:SS', inclusive")
+    ask_parser.set_defaults(handler=run_ask)
+
+    optimize_parser = subparsers.add_parser('optimize', help='merge the search index segments')
+    optimize_parser.set_defaults(handler=run_optimize)
+
+    rebuild_parser = subparsers.add_parser('rebuild', help='index every captured row from scratch')
+    rebuild_parser.set_defaults(handler=run_rebuild)
+
+    return parser
+# endregion
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+
+    configManager = ConfigurationManager()
+    databaseManager = DatabaseManager(
+        configManager
+    )
+    databaseManager.initialize_db()
+
+    args.handler(configManager, databaseManager, args)
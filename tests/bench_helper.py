@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import random
+import sqlite3
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app_db import DatabaseManager
+
+# Shared stand-ins for the benchmark scripts, run directly for the full numbers or through pytest for the smaller checks
+
+# Words every generated row draws from
+VOCABULARY = [f'word{index}' for index in range(5000)]
+# Seven in ten captures are screenshots, two audio and one a photo
+SOURCE_CYCLE = ['screenshots'] * 7 + ['audio'] * 2 + ['photos']
+
+class BenchConfig:
+    """ConfigurationManager without a config file, every key falls back to the manager's own default unless set here."""
+    def __init__(self, config_data=None):
+        self.config_data = dict(config_data or {})
+    def get_config(self, key, default=None):
+        return self.config_data.get(key, default)
+
+class BenchControl:
+    def __init__(self):
+        self.stop_event = threading.Event()
+    def is_running(self):
+        return not self.stop_event.is_set()
+
+def make_database_manager(tmp_dir, configManager=None):
+    """DatabaseManager with data.db and the shards inside tmp_dir, not yet initialized."""
+
+    databaseManager = DatabaseManager(configManager or BenchConfig())
+    databaseManager.sql_folder_path = tmp_dir
+    databaseManager.db_path = os.path.join(tmp_dir, 'data.db')
+    databaseManager.shard_folder_path = os.path.join(tmp_dir, 'shards')
+    databaseManager.shard_cache_folder_path = os.path.join(tmp_dir, 'shards', 'cache')
+    return databaseManager
+
+def make_model_manager(tmp_dir, configManager=None):
+    """ModelManager whose response cache lives inside tmp_dir."""
+
+    # Imported here, the model stack pulls in clients the database benchmarks do not need
+    from app_helper import ModelManager
+    from app_ratelimit import RateLimitManager
+    from app_cache import CacheManager
+
+    configManager = configManager or BenchConfig()
+    cacheManager = CacheManager(configManager)
+    cacheManager.sql_folder_path = tmp_dir
+    cacheManager.cache_db_path = os.path.join(tmp_dir, 'cache.db')
+    return ModelManager(configManager, RateLimitManager(configManager), cacheManager)
+
+def make_embedding_manager(tmp_dir, databaseManager, configManager=None):
+    """EmbeddingManager whose vector files live inside tmp_dir, store not yet opened."""
+
+    from app_embedding import EmbeddingManager
+
+    embeddingManager = EmbeddingManager(configManager or BenchConfig(), BenchControl(), databaseManager)
+    embeddingManager.sql_folder_path = tmp_dir
+    embeddingManager.vectors_path = os.path.join(tmp_dir, 'embeddings.f32')
+    embeddingManager.records_path = os.path.join(tmp_dir, 'embeddings.ids')
+    embeddingManager.meta_path = os.path.join(tmp_dir, 'embeddings.json')
+    return embeddingManager
+
+def make_vocabulary_text(rng, min_word_count=10, max_word_count=40):
+    return ' '.join(rng.choices(VOCABULARY, k=rng.randint(min_word_count, max_word_count)))
+
+def fill_text_corpus(db_path, row_count, make_row_text=None, start_timestamp='2024-01-01 09:00:00', day_count=365, seconds_between_rows=60, source_cycle=SOURCE_CYCLE):
+    """Spread row_count rows over day_count days in the original schema, like an install that predates the migrations.
+
+    make_row_text(rng, index) gives every text column of a row, each day's rows start at the time of day of start_timestamp."""
+
+    make_row_text = make_row_text or (lambda rng, index: make_vocabulary_text(rng))
+    rng = random.Random(0)
+    start_epoch = time.mktime(time.strptime(start_timestamp, '%Y-%m-%d %H:%M:%S'))
+    rows_per_day = -(-row_count // day_count)
+    rows = {'screenshots': [], 'photos': [], 'audio': []}
+    for index in range(row_count):
+        day, slot = divmod(index, rows_per_day)
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_epoch + day * 86400 + slot * seconds_between_rows))
+        source = source_cycle[index % len(source_cycle)]
+        if source == 'photos':
+            rows[source].append((timestamp, f'{index}.webp', make_row_text(rng, index)))
+        else:
+            rows[source].append((timestamp, f'{index}.{"flac" if source == "audio" else "webp"}', make_row_text(rng, index), make_row_text(rng, index)))
+
+    conn = sqlite3.connect(db_path)
+    conn.executescript('''
+    CREATE TABLE screenshots (timestamp TEXT, image_path TEXT, ocr_text TEXT, description_text TEXT);
+    CREATE TABLE photos (timestamp TEXT, image_path TEXT, description_text TEXT);
+    CREATE TABLE audio (timestamp TEXT, audio_path TEXT, transcript_text TEXT, description_text TEXT);
+    CREATE TABLE summary (timestamp TEXT, from_timestamp TEXT, to_timestamp TEXT, payload TEXT, content_text TEXT);
+    ''')
+    conn.executemany("INSERT INTO screenshots VALUES (?, ?, ?, ?)", rows['screenshots'])
+    conn.executemany("INSERT INTO photos VALUES (?, ?, ?)", rows['photos'])
+    conn.executemany("INSERT INTO audio VALUES (?, ?, ?, ?)", rows['audio'])
+    conn.commit()
+    conn.close()
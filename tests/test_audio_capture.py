@@ -0,0 +1,76 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# The capture module opens PyAudio streams, without PortAudio there is nothing to import
+pytest.importorskip("pyaudio")
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app_audio import AudioRingBuffer, AudioResampler
+
+OUTPUT_RATE = 16000
+
+def test_write_across_the_wrap_point():
+    ring_buffer = AudioRingBuffer(8)
+    ring_buffer.write(b'abcdef')
+    assert ring_buffer.read(4) == b'abcd'
+
+    # Starts at offset 6, the last two bytes land at the front of the buffer
+    ring_buffer.write(b'ghij')
+    assert ring_buffer.buffer[:2] == b'ij'
+    assert ring_buffer.read(100) == b'efghij'
+    assert ring_buffer.dropped_bytes == 0
+
+def test_overflow_drops_the_oldest_bytes():
+    ring_buffer = AudioRingBuffer(8)
+    ring_buffer.write(b'abcdef')
+    ring_buffer.write(b'ghijk')
+
+    assert ring_buffer.dropped_bytes == 3
+    assert ring_buffer.read(100) == b'defghijk'
+
+    # A single write larger than the buffer keeps only its newest bytes
+    ring_buffer.write(b'0123456789')
+    assert ring_buffer.dropped_bytes == 5
+    assert ring_buffer.read(100) == b'23456789'
+
+def test_read_times_out_empty():
+    ring_buffer = AudioRingBuffer(8)
+    assert ring_buffer.read(4, timeout=0.01) == b''
+
+def make_stereo_sine(input_rate, seconds, frequency):
+    t = np.arange(int(input_rate * seconds)) / input_rate
+    left = 8000 * np.sin(2 * np.pi * frequency * t)
+    # Right channel in phase but quieter, the downmix is their mean
+    return np.stack((left, left / 2), axis=1).round().astype(np.int16)
+
+def dominant_frequency(samples, sample_rate):
+    spectrum = np.abs(np.fft.rfft(samples * np.hanning(len(samples))))
+    return np.fft.rfftfreq(len(samples), 1 / sample_rate)[np.argmax(spectrum)]
+
+@pytest.mark.parametrize("input_rate", [44100, 48000])
+def test_stereo_is_resampled_to_16k_mono(input_rate):
+    resampler = AudioResampler(input_rate, OUTPUT_RATE, 2)
+    frames = make_stereo_sine(input_rate, 2, 440)
+
+    # Fed in capture sized chunks that don't line up with the output rate
+    chunks = [resampler.process(frames[offset:offset + 1024].tobytes()) for offset in range(0, len(frames), 1024)]
+    samples = np.concatenate(chunks)
+
+    assert samples.dtype == np.int16
+    assert abs(len(samples) - 2 * OUTPUT_RATE) <= 1
+    assert abs(dominant_frequency(samples.astype(np.float64), OUTPUT_RATE) - 440) < 2
+    # Mean of the two channels, 0.75 of the left one, once the filter has settled
+    steady = samples[OUTPUT_RATE // 2:]
+    assert abs(np.abs(steady).max() - 6000) < 200
+
+def test_empty_input_gives_no_samples():
+    resampler = AudioResampler(48000, OUTPUT_RATE, 2)
+    resampler.process(make_stereo_sine(48000, 0.1, 440).tobytes())
+    position = resampler.position
+
+    samples = resampler.process(b'')
+    assert samples.dtype == np.int16
+    assert len(samples) == 0
+    assert resampler.position == position
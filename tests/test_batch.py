@@ -0,0 +1,126 @@
+import os
+import sys
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app_batch import BatchManager
+from bench_helper import BenchConfig
+
+MODEL = "together/mistralai/Mixtral-8x7B-Instruct-v0.1"
+SYSTEM_PROMPT = "Describe the screen"
+
+class StubCache:
+    def __init__(self):
+        self.responses = {}
+    def make_key(self, payload):
+        return json.dumps(payload, sort_keys=True)
+    def get(self, key):
+        return self.responses.get(key)
+    def set(self, key, model, response_text):
+        self.responses[key] = response_text
+
+class StubRateLimit:
+    def get_thread_priority(self):
+        return "live"
+
+class StubModelManager:
+    """Answers every single call with "answer: <text>", batch calls with whatever answer_batch(texts) returns."""
+    def __init__(self, answer_batch=None):
+        self.cacheManager = StubCache()
+        self.rateLimitManager = StubRateLimit()
+        self.answer_batch = answer_batch or (lambda texts: json.dumps({"results": [{"id": index, "response": f'answer: {text}'} for index, text in reversed(list(enumerate(texts)))]}))
+        self.calls_lock = threading.Lock()
+        self.batch_calls = []
+        self.single_calls = []
+    def send_text_to_llm_api(self, payload, priority=None):
+        system_prompt, text = payload["messages"][0]["content"], payload["messages"][1]["content"]
+        if system_prompt == SYSTEM_PROMPT:
+            with self.calls_lock:
+                self.single_calls.append(text)
+            return f'answer: {text}'
+        texts = [item["text"] for item in json.loads(text)]
+        with self.calls_lock:
+            self.batch_calls.append(texts)
+        return self.answer_batch(texts)
+
+def make_batch_manager(config_data=None, answer_batch=None):
+    modelManager = StubModelManager(answer_batch)
+    return BatchManager(BenchConfig(config_data), modelManager), modelManager
+
+def describe_all(batchManager, texts):
+    # Every text from its own thread, like the inference workers
+    with ThreadPoolExecutor(len(texts)) as executor:
+        return list(executor.map(lambda text: batchManager.describe(MODEL, SYSTEM_PROMPT, text), texts))
+
+def test_window_flush_routes_answers_by_id():
+    batchManager, modelManager = make_batch_manager({"batch_window_in_ms": 200})
+    texts = ['editor', 'browser', 'terminal']
+
+    # The stub lists the results in reverse, answers still have to reach their own caller
+    assert describe_all(batchManager, texts) == [f'answer: {text}' for text in texts]
+    assert len(modelManager.batch_calls) == 1
+    assert sorted(modelManager.batch_calls[0]) == sorted(texts)
+    assert modelManager.single_calls == []
+    assert batchManager.get_stats() == {"items": 3, "cached_items": 0, "batches": 1, "fallback_items": 0}
+
+def test_full_batch_is_sent_before_the_window():
+    batchManager, modelManager = make_batch_manager({"batch_window_in_ms": 60000, "batch_max_items": 2, "batch_timeout_in_sec": 5})
+
+    assert describe_all(batchManager, ['editor', 'browser']) == ['answer: editor', 'answer: browser']
+    assert len(modelManager.batch_calls) == 1
+
+def test_token_cap_starts_a_new_batch():
+    # Each 40 character text counts as 11 tokens, two of them would not fit under 15
+    batchManager, modelManager = make_batch_manager({"batch_window_in_ms": 200, "batch_max_tokens": 15})
+    texts = ['a' * 40, 'b' * 40]
+
+    assert describe_all(batchManager, texts) == [f'answer: {text}' for text in texts]
+    assert modelManager.batch_calls == []
+    assert sorted(modelManager.single_calls) == sorted(texts)
+
+def test_missing_items_fall_back_to_single_calls():
+    answer_first_only = lambda texts: json.dumps({"results": [{"id": 0, "response": f'answer: {texts[0]}'}]})
+    batchManager, modelManager = make_batch_manager({"batch_window_in_ms": 60000, "batch_max_items": 3, "batch_timeout_in_sec": 5}, answer_first_only)
+    texts = ['editor', 'browser', 'terminal']
+
+    assert describe_all(batchManager, texts) == [f'answer: {text}' for text in texts]
+    assert len(modelManager.batch_calls) == 1
+    assert sorted(modelManager.single_calls) == sorted(text for text in texts if text != modelManager.batch_calls[0][0])
+    assert batchManager.get_stats()["fallback_items"] == 2
+
+@pytest.mark.parametrize("response_text", [
+    "Sorry, I can only describe one screen at a time.",
+    '{"results": "answer: editor"}',
+    '{"results": [{"id": "first", "response": "answer: editor"}, {"id": 7, "response": "answer: browser"}]}',
+    '{"results": [{"id": 0}, {"id": 1, "response": null}]}',
+    '{"answers": [{"id": 0, "response": "answer: editor"}]}',
+    '```json\n{"results": [{"id": 0, "response": "answer: editor"}\n```',
+])
+def test_unparsable_batches_fall_back_to_single_calls(response_text):
+    batchManager, modelManager = make_batch_manager({"batch_window_in_ms": 60000, "batch_max_items": 2, "batch_timeout_in_sec": 5}, lambda texts: response_text)
+
+    assert describe_all(batchManager, ['editor', 'browser']) == ['answer: editor', 'answer: browser']
+    assert len(modelManager.batch_calls) == 1
+    assert sorted(modelManager.single_calls) == ['browser', 'editor']
+    assert batchManager.get_stats()["fallback_items"] == 2
+
+def test_failed_batch_call_falls_back_to_single_calls():
+    def fail(texts):
+        raise ConnectionError("batch call failed")
+    batchManager, modelManager = make_batch_manager({"batch_window_in_ms": 60000, "batch_max_items": 2, "batch_timeout_in_sec": 5}, fail)
+
+    assert describe_all(batchManager, ['editor', 'browser']) == ['answer: editor', 'answer: browser']
+    assert sorted(modelManager.single_calls) == ['browser', 'editor']
+
+def test_batch_answers_are_cached_per_item():
+    batchManager, modelManager = make_batch_manager({"batch_window_in_ms": 60000, "batch_max_items": 2, "batch_timeout_in_sec": 5})
+    describe_all(batchManager, ['editor', 'browser'])
+
+    # A repeat is served from the cache without joining a batch
+    assert batchManager.describe(MODEL, SYSTEM_PROMPT, 'browser') == 'answer: browser'
+    assert len(modelManager.batch_calls) == 1
+    assert modelManager.single_calls == []
+    assert batchManager.get_stats()["cached_items"] == 1
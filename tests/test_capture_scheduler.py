@@ -0,0 +1,108 @@
+import os
+import sys
+import time
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import app_helper
+from app_helper import ControlManager
+from bench_helper import BenchConfig
+
+class FakeClock:
+    """Stands in for the time module inside app_helper, only plan_next_capture reads it in these tests."""
+    def __init__(self):
+        self.now = 1000.0
+    def time(self):
+        return self.now
+
+def make_control_manager(monkeypatch=None, config_data=None):
+    clock = None
+    if monkeypatch is not None:
+        clock = FakeClock()
+        monkeypatch.setattr(app_helper, 'time', clock)
+    controlManager = ControlManager(BenchConfig(config_data))
+    controlManager.start()
+    return controlManager, clock
+
+def plan(controlManager, clock, source, activity, seconds=None):
+    # One capture: its change signal, then the interval until the next one
+    controlManager.report_activity(source, activity)
+    interval = controlManager.plan_next_capture(source)
+    clock.now += interval if seconds is None else seconds
+    return interval
+
+def test_interval_backs_off_while_idle_and_drops_on_activity(monkeypatch):
+    controlManager, clock = make_control_manager(monkeypatch)
+    controlManager.register_capture('screenshot', 60, 10, 300)
+
+    assert [plan(controlManager, clock, 'screenshot', 0.2) for _ in range(4)] == [120, 240, 300, 300]
+    assert plan(controlManager, clock, 'screenshot', 1.5) == 10
+    assert plan(controlManager, clock, 'screenshot', 1.0) == 10
+    assert [plan(controlManager, clock, 'screenshot', 0.0) for _ in range(3)] == [20, 40, 80]
+
+def test_interval_stays_within_min_and_max(monkeypatch):
+    controlManager, clock = make_control_manager(monkeypatch, {"scheduler_backoff_factor": 3})
+    # Bounds that don't contain the base interval are widened to it
+    controlManager.register_capture('photo', 60, 90, 30)
+
+    intervals = [plan(controlManager, clock, 'photo', activity) for activity in (0, 0, 2, 0, 0.5, 3, 0)]
+    assert intervals == [60, 60, 60, 60, 60, 60, 60]
+
+    controlManager.register_capture('audio', 60, 5, 600)
+    intervals = [plan(controlManager, clock, 'audio', activity) for activity in (0, 0, 0, 0, 5, 0, 0, 0, 0, 0)]
+    assert intervals == [180, 540, 600, 600, 5, 15, 45, 135, 405, 600]
+    assert all(5 <= interval <= 600 for interval in intervals)
+
+def test_activity_elsewhere_pulls_idle_sources_forward(monkeypatch):
+    controlManager, clock = make_control_manager(monkeypatch)
+    controlManager.register_capture('screenshot', 60, 10, 300)
+    controlManager.register_capture('audio', 60, 30, 600)
+    assert [plan(controlManager, clock, 'screenshot', 0) for _ in range(2)] == [120, 240]
+
+    # Speech since the last screenshot halves the screenshot interval, down to its minimum
+    controlManager.report_activity('audio', 2.0)
+    assert [plan(controlManager, clock, 'screenshot', 0, seconds=1) for _ in range(5)] == [120, 60, 30, 15, 10]
+
+    # Activity older than the current interval no longer counts
+    clock.now += 60
+    assert plan(controlManager, clock, 'screenshot', 0) == 20
+
+def test_disabled_scheduler_keeps_the_base_interval(monkeypatch):
+    controlManager, clock = make_control_manager(monkeypatch, {"scheduler_enabled": False})
+    controlManager.register_capture('screenshot', 60, 10, 300)
+
+    assert [plan(controlManager, clock, 'screenshot', activity) for activity in (0, 0, 5, 0)] == [60, 60, 60, 60]
+
+def test_activity_elsewhere_cuts_the_wait_short():
+    controlManager, _ = make_control_manager()
+    controlManager.register_capture('photo', 2, 0.05, 4)
+    controlManager.register_capture('screenshot', 2, 0.05, 4)
+    controlManager.report_activity('photo', 0)
+
+    waits = []
+    def wait():
+        start_time = time.time()
+        waits.append((controlManager.wait_for_next_capture('photo'), time.time() - start_time))
+    thread = threading.Thread(target=wait)
+    thread.start()
+    time.sleep(0.1)
+    controlManager.report_activity('screenshot', 1.5)
+    thread.join(5)
+
+    # Idle photo planned 4 seconds, the burst captures after the minimum instead
+    assert controlManager.get_capture_interval('photo') == 4
+    assert waits[0][0] is False
+    assert waits[0][1] < 1
+
+def test_stop_ends_the_wait():
+    controlManager, _ = make_control_manager()
+    controlManager.register_capture('photo', 30, 10, 60)
+
+    waits = []
+    thread = threading.Thread(target=lambda: waits.append(controlManager.wait_for_next_capture('photo')))
+    thread.start()
+    time.sleep(0.1)
+    controlManager.stop()
+    thread.join(5)
+
+    assert waits == [True]
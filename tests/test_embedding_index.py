@@ -0,0 +1,168 @@
+import os
+import sys
+import time
+import random
+import threading
+import tempfile
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from bench_helper import BenchConfig, make_database_manager, make_embedding_manager
+
+VECTOR_COUNT = 1000000
+APPEND_BATCH = 50000
+EMBED_TEXT_COUNT = 2000
+QUERY_REPEATS = 5
+START_EPOCH = 1704067200
+
+class BenchDatabase:
+    # Just enough of DatabaseManager for the store, every entry resolves to a made up row
+    search_fields = [(2, 'screenshots', 'description_text'), (4, 'audio', 'transcript_text')]
+    def retrieve_search_entries(self, search_rowids):
+        return [(search_rowid, 'screenshots', 'description_text', search_rowid // 16, '2024-01-01 00:00:00', '') for search_rowid in search_rowids]
+    def requeue_embeddings(self):
+        pass
+
+def measure(function):
+    latencies = []
+    for _ in range(QUERY_REPEATS):
+        start_time = time.time()
+        rows = function()
+        latencies.append(time.time() - start_time)
+    return sorted(latencies)[len(latencies) // 2] * 1000, len(rows)
+
+def make_indexed_database(tmp_dir, descriptions):
+    databaseManager = make_database_manager(tmp_dir)
+    databaseManager.initialize_db()
+    rowids = []
+    for index, description_text in enumerate(descriptions):
+        rowid = databaseManager.save_to_screenshot_db(f'2024-01-{index + 1:02d} 10:00:00', f'{index}.webp', None, None)
+        databaseManager.update_screenshot_db(rowid, None, description_text)
+        rowids.append(rowid)
+    return databaseManager, rowids
+
+DESCRIPTIONS = [
+    'Spreadsheet with the Q3 spend review open in Excel',
+    'Terminal running the postgres migration for the invoices table',
+    'Browser on the airline website booking flights to Lisbon',
+    'Code editor with a flamegraph of the render loop',
+]
+
+def test_store_indexes_supersedes_and_reopens(tmp_path):
+    databaseManager, rowids = make_indexed_database(str(tmp_path), DESCRIPTIONS)
+    embeddingManager = make_embedding_manager(str(tmp_path), databaseManager, BenchConfig({"embedding_model": "hashing"}))
+    embeddingManager.open_store()
+
+    assert embeddingManager.process_queue() == len(DESCRIPTIONS)
+    assert embeddingManager.search_similar('postgres invoices migration', limit=1)[0][2] == rowids[1]
+    assert {row[2] for row in embeddingManager.search_similar('postgres invoices migration', '2024-01-03 00:00:00', limit=4)} == set(rowids[2:])
+
+    # A re-described row only keeps its latest vector, the old text stops matching
+    databaseManager.update_screenshot_db(rowids[1], None, 'Chess board in the browser')
+    assert embeddingManager.process_queue() == 1
+    assert len(embeddingManager.latest) == len(DESCRIPTIONS)
+    assert embeddingManager.search_similar('chess board', limit=1)[0][2] == rowids[1]
+
+    # Reopening maps the same live vectors back
+    reopened = make_embedding_manager(str(tmp_path), databaseManager, BenchConfig({"embedding_model": "hashing"}))
+    reopened.open_store(read_only=True)
+    assert reopened.count == embeddingManager.count
+    assert [row[2] for row in reopened.search_similar('chess board', limit=1)] == [rowids[1]]
+
+def test_compaction_waits_for_searches_and_readers_remap(tmp_path):
+    databaseManager, rowids = make_indexed_database(str(tmp_path), DESCRIPTIONS)
+    config = BenchConfig({"embedding_model": "hashing", "embedding_compact_ratio": 0.2})
+    embeddingManager = make_embedding_manager(str(tmp_path), databaseManager, config)
+    embeddingManager.open_store()
+    embeddingManager.process_queue()
+    reader = make_embedding_manager(str(tmp_path), databaseManager, config)
+    reader.open_store(read_only=True)
+
+    # Half the vectors superseded, compaction has to hold off while a search still holds the maps
+    databaseManager.update_screenshot_db(rowids[0], None, 'Chess board in the browser')
+    databaseManager.update_screenshot_db(rowids[1], None, 'Crossword puzzle in the newspaper app')
+    with embeddingManager.store_lock:
+        embeddingManager.active_searches += 1
+    worker = threading.Thread(target=embeddingManager.process_queue)
+    worker.start()
+    worker.join(0.5)
+    assert worker.is_alive()
+    assert embeddingManager.generation == 0
+    with embeddingManager.store_condition:
+        embeddingManager.active_searches -= 1
+        embeddingManager.store_condition.notify_all()
+    worker.join(5)
+
+    assert not worker.is_alive()
+    assert embeddingManager.generation == 1
+    assert embeddingManager.count == len(DESCRIPTIONS)
+    assert not os.path.exists(embeddingManager.vectors_path + '.tmp')
+    # The reader notices the new generation and maps the compacted files
+    assert reader.search_similar('chess board', limit=1)[0][2] == rowids[0]
+    assert reader.generation == 1
+    assert reader.count == len(DESCRIPTIONS)
+
+def test_auto_model_falls_back_to_hashing(tmp_path):
+    databaseManager, _ = make_indexed_database(str(tmp_path), DESCRIPTIONS)
+    # A local path that does not exist fails at once, without going to the model hub
+    embeddingManager = make_embedding_manager(str(tmp_path), databaseManager, BenchConfig({"embedding_auto_model": str(tmp_path / 'missing-model')}))
+    embeddingManager.open_store()
+
+    assert embeddingManager.embedding_model == "hashing"
+    assert embeddingManager.process_queue() == len(DESCRIPTIONS)
+
+def test_default_model_matches_paraphrases(tmp_path):
+    # Needs the sentence-transformers model, hashing only matches shared words
+    pytest.importorskip("sentence_transformers")
+    databaseManager, rowids = make_indexed_database(str(tmp_path), DESCRIPTIONS)
+    embeddingManager = make_embedding_manager(str(tmp_path), databaseManager)
+    embeddingManager.open_store()
+    if embeddingManager.embedding_model == "hashing":
+        pytest.skip("default sentence-transformers model could not be loaded")
+    embeddingManager.process_queue()
+
+    assert embeddingManager.search_similar('budget meeting', limit=1)[0][2] == rowids[0]
+    assert embeddingManager.search_similar('database schema change', limit=1)[0][2] == rowids[1]
+    assert embeddingManager.search_similar('travel plans', limit=1)[0][2] == rowids[2]
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Random vectors below stand in for the embedded captures, the hashing dimensions keep the sizes comparable
+        embeddingManager = make_embedding_manager(tmp_dir, BenchDatabase(), BenchConfig({"embedding_model": "hashing"}))
+        embeddingManager.open_store()
+
+        rng = random.Random(0)
+        words = [f'word{index}' for index in range(5000)]
+        texts = [' '.join(rng.choices(words, k=30)) for _ in range(EMBED_TEXT_COUNT)]
+        start_time = time.time()
+        embeddingManager.embed(texts)
+        print(f'Hashing embedder: {EMBED_TEXT_COUNT / (time.time() - start_time):.0f} texts/s')
+
+        # Random unit vectors stand in for a year of embedded captures, a month apart per 1/12 of the rows
+        generator = np.random.default_rng(0)
+        start_time = time.time()
+        for offset in range(0, VECTOR_COUNT, APPEND_BATCH):
+            vectors = generator.standard_normal((APPEND_BATCH, embeddingManager.dimensions), dtype=np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            search_rowids = (np.arange(offset, offset + APPEND_BATCH) * 16 + 2).tolist()
+            timestamp_epochs = START_EPOCH + np.arange(offset, offset + APPEND_BATCH) * (365 * 24 * 3600 // VECTOR_COUNT)
+            embeddingManager.append_vectors(search_rowids, timestamp_epochs, vectors)
+        print(f'Appended {VECTOR_COUNT} x {embeddingManager.dimensions} vectors in {time.time() - start_time:.1f}s, {os.path.getsize(embeddingManager.vectors_path) / 1024 / 1024:.0f} MB mapped')
+
+        start_time = time.time()
+        embeddingManager.open_store()
+        print(f'Reopened store in {time.time() - start_time:.2f}s\n')
+
+        full_ms, full_count = measure(lambda: embeddingManager.search_similar('word42 word7 meeting budget'))
+        print(f'Top 20 over the whole year: {full_ms:.1f} ms ({full_count} hits)')
+        month_ms, month_count = measure(lambda: embeddingManager.search_similar('word42 word7 meeting budget', '2024-06-01 00:00:00', '2024-06-30 23:59:59'))
+        print(f'Top 20 within one month:    {month_ms:.1f} ms ({month_count} hits)')
+
+        # Brute force in pure Python over a slice, to put the vectorised scan in perspective
+        query_vector = embeddingManager.embed(['word42 word7 meeting budget'])[0].tolist()
+        sample_count = 20000
+        start_time = time.time()
+        sample_scores = [sum(a * b for a, b in zip(vector, query_vector)) for vector in embeddingManager.vectors[:sample_count].tolist()]
+        python_ms = (time.time() - start_time) * 1000 * VECTOR_COUNT / sample_count
+        print(f'Pure Python scan estimate:  {python_ms:.0f} ms ({python_ms / full_ms:.0f}x slower)')
@@ -0,0 +1,98 @@
+import os
+import io
+import sys
+import time
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app_helper import MediaManager
+
+FRAMES = 20
+WIDTH = 3840
+HEIGHT = 1080
+QUALITY = 30
+
+def make_frame():
+    # Mostly flat desktop with some text-like noise, what mss hands back as BGRA
+    rng = np.random.default_rng(0)
+    frame = np.full((HEIGHT, WIDTH, 4), 235, dtype=np.uint8)
+    frame[::24, :, :3] = rng.integers(0, 255, size=(len(range(0, HEIGHT, 24)), WIDTH, 3), dtype=np.uint8)
+    return frame
+
+def run_old_path(raw_bytes):
+    copied_bytes = 0
+
+    # take_screenshot: BGRA -> RGB bytes -> image -> JPEG
+    rgb = np.frombuffer(raw_bytes, dtype=np.uint8).reshape(HEIGHT, WIDTH, 4)[:, :, 2::-1].tobytes()
+    screenshot = Image.frombytes('RGB', (WIDTH, HEIGHT), rgb)
+    img_byte_arr = io.BytesIO()
+    screenshot.save(img_byte_arr, format='JPEG')
+    original_image_bytes = img_byte_arr.getvalue()
+    copied_bytes += len(rgb) + WIDTH * HEIGHT * 4 + len(original_image_bytes)
+
+    # negate_image: decode -> per pixel lambda -> JPEG
+    img = Image.open(io.BytesIO(original_image_bytes)).convert('L')
+    negated = Image.eval(img, lambda x: 255 - x)
+    img_byte_arr = io.BytesIO()
+    negated.save(img_byte_arr, format='JPEG')
+    negated_image_bytes = img_byte_arr.getvalue()
+    copied_bytes += WIDTH * HEIGHT * 4 + WIDTH * HEIGHT * 2 + len(negated_image_bytes)
+
+    # OCR tiles: decode negated JPEG to an array
+    with Image.open(io.BytesIO(negated_image_bytes)) as img:
+        gray = np.asarray(img.convert('L'))
+    copied_bytes += gray.nbytes * 2
+
+    # downscale_image: decode the original again -> JPEG at the configured quality
+    img = Image.open(io.BytesIO(original_image_bytes))
+    img_byte_arr = io.BytesIO()
+    img.save(img_byte_arr, format='JPEG', quality=QUALITY)
+    copied_bytes += WIDTH * HEIGHT * 4 + len(img_byte_arr.getvalue())
+
+    return copied_bytes
+
+def run_new_path(mediaManager, raw_bytes):
+    frame = np.frombuffer(raw_bytes, dtype=np.uint8).reshape(HEIGHT, WIDTH, 4)
+    negated_frame = mediaManager.negate_frame(frame)
+    mediaManager.compute_array_signature(negated_frame)
+    image_bytes = mediaManager.encode_frame(frame, quality=QUALITY)
+    return negated_frame.nbytes + WIDTH * HEIGHT * 4 + len(image_bytes)
+
+def measure(name, path_function):
+    latencies = []
+    copied_bytes = 0
+    for _ in range(FRAMES):
+        start_time = time.time()
+        copied_bytes = path_function()
+        latencies.append(time.time() - start_time)
+
+    avg_ms = sum(latencies) / len(latencies) * 1000
+    print(f"{name}: avg {avg_ms:.1f}ms | {copied_bytes / 1e6:.1f} MB copied per {WIDTH}x{HEIGHT} frame")
+    return avg_ms, copied_bytes
+
+def test_frame_path_matches_pil_round_trip():
+    frame = make_frame()
+    mediaManager = MediaManager()
+
+    # Same grayscale weights as PIL, inverted, without touching mss' buffer
+    negated_frame = mediaManager.negate_frame(frame)
+    expected = 255 - np.asarray(Image.fromarray(np.ascontiguousarray(frame[:, :, 2::-1])).convert('L')).astype(np.int16)
+    assert negated_frame.shape == (HEIGHT, WIDTH)
+    assert np.abs(negated_frame.astype(np.int16) - expected).max() <= 1
+    assert (frame[:, :, :3] == make_frame()[:, :, :3]).all()
+
+    # The JPEG written to disk decodes back to the same negated frame the OCR saw
+    image_bytes = mediaManager.encode_frame(frame, quality=90)
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        assert img.size == (WIDTH, HEIGHT)
+    decoded_frame = mediaManager.decode_negated_frame(image_bytes)
+    assert np.abs(decoded_frame.astype(np.int16) - negated_frame).mean() < 4
+
+if __name__ == "__main__":
+    raw_bytes = bytearray(make_frame().tobytes())
+    mediaManager = MediaManager()
+
+    old_ms, old_bytes = measure("PIL round trips", lambda: run_old_path(raw_bytes))
+    new_ms, new_bytes = measure("NumPy frame path", lambda: run_new_path(mediaManager, raw_bytes))
+    print(f"Saved {old_ms - new_ms:.1f}ms and {(old_bytes - new_bytes) / 1e6:.1f} MB per frame ({old_ms / new_ms:.2f}x faster)")
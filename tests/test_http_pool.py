@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import requests
+from threading import Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from bench_helper import make_model_manager
+
+CALLS = 200
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so the stub keeps connections alive like the real APIs
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    # Client (host, port) of every request, one per TCP connection opened
+    client_addresses = set()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        StubHandler.client_addresses.add(self.client_address)
+        body = json.dumps({"choices": [{"message": {"content": "stub"}}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+
+def measure(name, url, post_function, calls=CALLS):
+    """Average latency and how many connections the server saw for calls sequential posts."""
+
+    headers = {"Content-Type": "application/json"}
+    payload = {"model": "stub", "messages": [{"role": "user", "content": "hi"}]}
+
+    StubHandler.client_addresses = set()
+    latencies = []
+    for _ in range(calls):
+        start_time = time.time()
+        post_function(url, headers, payload).json()
+        latencies.append(time.time() - start_time)
+
+    latencies.sort()
+    avg_ms = sum(latencies) / len(latencies) * 1000
+    p95_ms = latencies[int(len(latencies) * 0.95)] * 1000
+    connection_count = len(StubHandler.client_addresses)
+    print(f"{name}: avg {avg_ms:.2f}ms | p95 {p95_ms:.2f}ms over {calls} calls on {connection_count} connections")
+    return avg_ms, connection_count
+
+def test_pooled_session_keeps_one_connection(tmp_path):
+    server, url = start_stub_server()
+    try:
+        modelManager = make_model_manager(str(tmp_path))
+        _, bare_connection_count = measure("requests.post", url, lambda url, headers, payload: requests.post(url, headers=headers, json=payload), calls=20)
+        _, pooled_connection_count = measure("pooled session", url, lambda url, headers, payload: modelManager.post_to_api(url, headers, json=payload), calls=20)
+    finally:
+        server.shutdown()
+
+    # Sequential calls through the pool reuse a single keep-alive connection
+    assert bare_connection_count == 20
+    assert pooled_connection_count == 1
+
+if __name__ == "__main__":
+    server, url = start_stub_server()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        modelManager = make_model_manager(tmp_dir)
+
+        # Plain HTTP on loopback only shows the TCP setup cost, TLS to the real APIs adds a handshake on top
+        bare_avg_ms, _ = measure("requests.post", url, lambda url, headers, payload: requests.post(url, headers=headers, json=payload))
+        pooled_avg_ms, _ = measure("pooled session", url, lambda url, headers, payload: modelManager.post_to_api(url, headers, json=payload))
+        print(f"Per-call latency dropped by {(1 - pooled_avg_ms / bare_avg_ms) * 100:.1f}%")
+
+    server.shutdown()
@@ -0,0 +1,82 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from bench_helper import make_database_manager
+
+def make_database(tmp_dir):
+    databaseManager = make_database_manager(tmp_dir)
+    databaseManager.initialize_db()
+    return databaseManager
+
+def summarize(databaseManager, summarized):
+    """One live summary pass, returns the rowids it read per source and commits the watermarks like the agent does."""
+
+    _, screenshot_rows, photo_rows, audio_rows, _, watermarks = databaseManager.retrieve_all_sources_text_content_for_livesummary()
+    read = {'screenshots': [row[0] for row in screenshot_rows], 'photos': [row[0] for row in photo_rows], 'audio': [row[0] for row in audio_rows]}
+    for source, rowids in read.items():
+        summarized[source].extend(rowids)
+    if any(read.values()):
+        databaseManager.save_to_summary_db('2024-01-01 12:00:00', '2024-01-01 10:00:00', '2024-01-01 12:00:00', '', 'summary', watermarks)
+    else:
+        databaseManager.advance_livesummary_watermarks(watermarks)
+    return read
+
+def test_rows_finishing_out_of_order_are_summarized_once(tmp_path):
+    databaseManager = make_database(str(tmp_path))
+    rowids = [databaseManager.save_to_screenshot_db(f'2024-01-01 10:0{index}:00', f'{index}.jpeg', None, None) for index in range(5)]
+    photo_rowid = databaseManager.save_to_photo_db('2024-01-01 10:00:00', '0.jpeg', None)
+    summarized = {'screenshots': [], 'photos': [], 'audio': []}
+
+    # Later rows finish first, the watermark has to wait for the oldest pending one
+    databaseManager.update_screenshot_db(rowids[1], 'ocr', 'second')
+    databaseManager.update_screenshot_db(rowids[3], 'ocr', 'fourth')
+    assert summarize(databaseManager, summarized)['screenshots'] == []
+
+    databaseManager.update_screenshot_db(rowids[0], 'ocr', 'first')
+    assert summarize(databaseManager, summarized)['screenshots'] == rowids[:2]
+    assert summarize(databaseManager, summarized)['screenshots'] == []
+
+    # An in flight row blocks like a pending one, a failed row is passed over
+    assert databaseManager.claim_row('screenshots', rowids[2])
+    assert summarize(databaseManager, summarized)['screenshots'] == []
+    databaseManager.release_row('screenshots', rowids[2], 'timeout', max_attempts=1)
+    databaseManager.update_screenshot_db(rowids[4], 'ocr', 'fifth')
+    assert summarize(databaseManager, summarized)['screenshots'] == [rowids[3], rowids[4]]
+
+    # Sources keep their own watermark, the photo still pending held nothing else back
+    databaseManager.update_photo_db(photo_rowid, 'A desk')
+    assert summarize(databaseManager, summarized) == {'screenshots': [], 'photos': [photo_rowid], 'audio': []}
+
+    assert summarized['screenshots'] == [rowids[0], rowids[1], rowids[3], rowids[4]]
+    assert summarized['photos'] == [photo_rowid]
+
+def test_streaming_audio_holds_the_audio_watermark(tmp_path):
+    databaseManager = make_database(str(tmp_path))
+    streaming_rowid = databaseManager.save_streaming_audio_to_db('2024-01-01 10:00:00', '0.flac')
+    finished_rowid = databaseManager.save_to_audio_db('2024-01-01 10:05:00', '1.flac', None, None)
+    databaseManager.update_audio_db(finished_rowid, 'hello there', 'A greeting')
+    summarized = {'screenshots': [], 'photos': [], 'audio': []}
+
+    assert summarize(databaseManager, summarized)['audio'] == []
+
+    databaseManager.append_audio_transcript(streaming_rowid, 'good morning')
+    databaseManager.finish_streaming_audio(streaming_rowid)
+    assert summarize(databaseManager, summarized)['audio'] == []
+    databaseManager.update_audio_db(streaming_rowid, 'good morning', 'Another greeting')
+    assert summarize(databaseManager, summarized)['audio'] == [streaming_rowid, finished_rowid]
+    assert summarize(databaseManager, summarized)['audio'] == []
+
+def test_rows_without_text_only_advance_the_watermark(tmp_path):
+    databaseManager = make_database(str(tmp_path))
+    reference_rowid = databaseManager.save_to_screenshot_db('2024-01-01 10:00:00', '0.jpeg', None, None)
+    databaseManager.update_screenshot_db(reference_rowid, 'ocr', 'An editor')
+    duplicate_rowid = databaseManager.save_duplicate_to_screenshot_db('2024-01-01 10:01:00', reference_rowid)
+    summarized = {'screenshots': [], 'photos': [], 'audio': []}
+
+    # The duplicate repeats its reference's text, only the reference is summarized
+    assert summarize(databaseManager, summarized)['screenshots'] == [reference_rowid]
+    conn = databaseManager.get_connection()
+    assert conn.execute("SELECT last_rowid FROM livesummary_watermark WHERE source = 'screenshots'").fetchone() == (duplicate_rowid,)
+    conn.commit()
+    assert summarize(databaseManager, summarized)['screenshots'] == []
@@ -0,0 +1,114 @@
+import os
+import sys
+import time
+import numpy as np
+import pytesseract
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app_ocr import OCRManager
+from app_helper import MediaManager
+from bench_helper import BenchConfig
+
+# Path to the Tesseract executable, update this if Tesseract is installed in a different location
+pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+
+CORPUS_SIZE = 20
+WORDS = "the quick brown fox jumps over lazy dog file edit view window help search commit branch merge build test deploy".split()
+band_count = 8
+monitor_count = 2
+mediaManager = MediaManager()
+
+def make_screenshot(rng, font, width=1920 * monitor_count, height=1080):
+    # A light desktop with a column of text lines per monitor, negated like the frames the capture loop hands to OCR
+    img = Image.new('L', (width, height), 240)
+    draw = ImageDraw.Draw(img)
+    for monitor in range(monitor_count):
+        left = monitor * width // monitor_count + 40
+        for top in range(30, height - 30, int(rng.integers(22, 30))):
+            draw.text((left, top), ' '.join(rng.choice(WORDS, int(rng.integers(4, 14)))), fill=20, font=font)
+    return 255 - np.asarray(img)
+
+def make_corpus(corpus_size=CORPUS_SIZE):
+    """Fixed synthetic corpus, the same seed gives the same screenshots on every run."""
+    rng = np.random.default_rng(0)
+    font = ImageFont.load_default(size=16)
+    return [make_screenshot(rng, font) for _ in range(corpus_size)]
+
+def split_into_tiles(gray):
+    height, width = gray.shape
+    tiles = []
+    for monitor in range(monitor_count):
+        left = monitor * width // monitor_count
+        right = (monitor + 1) * width // monitor_count
+        for top, bottom in mediaManager.split_bands(gray[:, left:right], band_count):
+            tiles.append(gray[top:bottom, left:right])
+    return tiles
+
+def make_text_frame(line_tops, line_height=14, height=1080, width=1920):
+    # Negated desktop, dark background with bright glyph-like strokes on each text line
+    rng = np.random.default_rng(0)
+    gray = np.zeros((height, width), dtype=np.uint8)
+    for top in line_tops:
+        gray[top:top + line_height, 40:width - 40] = rng.integers(0, 2, (line_height, width - 80), dtype=np.uint8) * 220
+    return gray
+
+def test_bands_are_cut_between_text_lines():
+    # Lines every 20 px from an odd offset, so most even cuts (every 135 px) land inside a line
+    line_tops = list(range(7, 1060, 20))
+    gray = make_text_frame(line_tops)
+    bands = mediaManager.split_bands(gray, band_count)
+
+    assert len(bands) == band_count
+    assert bands[0][0] == 0 and bands[-1][1] == gray.shape[0]
+    assert all(previous[1] == band[0] for previous, band in zip(bands, bands[1:]))
+    for _, cut in bands[:-1]:
+        assert not any(top <= cut < top + 14 for top in line_tops)
+        assert abs(cut - round(cut / (gray.shape[0] / band_count)) * gray.shape[0] / band_count) <= gray.shape[0] // band_count // 4
+
+def test_blank_frame_keeps_even_bands():
+    bands = mediaManager.split_bands(np.zeros((1080, 1920), dtype=np.uint8), band_count)
+    assert bands == [(band * 135, (band + 1) * 135) for band in range(band_count)]
+
+def test_broken_pool_is_restarted():
+    ocrManager = OCRManager(BenchConfig({"ocr_process_count": 2}), pytesseract.pytesseract.tesseract_cmd)
+    tiles = split_into_tiles(make_corpus(1)[0])
+    try:
+        assert len(ocrManager.recognise_tiles(tiles)) == len(tiles)
+        # A worker dying mid-run breaks a ProcessPoolExecutor for good
+        broken_executor = ocrManager.executor
+        for process in list(broken_executor._processes.values()):
+            process.kill()
+        assert len(ocrManager.recognise_tiles(tiles)) == len(tiles)
+        assert ocrManager.executor is not broken_executor
+    finally:
+        ocrManager.shutdown()
+
+def run_serial(corpus):
+    for gray in corpus:
+        pytesseract.image_to_string(Image.fromarray(gray))
+
+def run_pooled(ocrManager, corpus):
+    for gray in corpus:
+        ocrManager.recognise_tiles(split_into_tiles(gray))
+
+if __name__ == "__main__":
+    corpus = make_corpus()
+    print(f"Generated {len(corpus)} screenshots")
+
+    start_time = time.time()
+    run_serial(corpus)
+    serial_time = time.time() - start_time
+    print(f"Serial full-frame OCR: {len(corpus) / serial_time:.2f} screenshots/s")
+
+    ocrManager = OCRManager(BenchConfig(), pytesseract.pytesseract.tesseract_cmd)
+    # Warm the pool so process start-up is not counted
+    ocrManager.recognise_tiles(split_into_tiles(corpus[0]))
+
+    start_time = time.time()
+    run_pooled(ocrManager, corpus)
+    pooled_time = time.time() - start_time
+    print(f"Pooled band OCR on {ocrManager.ocr_process_count} processes: {len(corpus) / pooled_time:.2f} screenshots/s")
+    print(f"Speedup: {serial_time / pooled_time:.2f}x")
+
+    ocrManager.shutdown()
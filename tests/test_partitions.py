@@ -0,0 +1,112 @@
+import os
+import sys
+import time
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from bench_helper import fill_text_corpus, make_database_manager
+
+# A year of captures at one row a minute through an 8 hour day
+ROW_COUNT = 175000
+WRITE_COUNT = 500
+QUERY_REPEATS = 5
+QUERIES = [
+    ('one month', 'word42', '2024-06-01 00:00:00', '2024-06-30 23:59:59'),
+    ('whole year', 'word42', None, None),
+]
+
+def fill_corpus(db_path, row_count=ROW_COUNT):
+    fill_text_corpus(db_path, row_count, source_cycle=['screenshots'])
+
+def report(name, databaseManager):
+    conn = databaseManager.get_connection()
+    page_count, freelist_count, page_size = (conn.execute(f"PRAGMA {pragma}").fetchone()[0] for pragma in ('page_count', 'freelist_count', 'page_size'))
+    conn.commit()
+    print(f'{name}: data.db {os.path.getsize(databaseManager.db_path) / 1024 / 1024:.0f} MB, {(page_count - freelist_count) * page_size / 1024 / 1024:.0f} MB in use')
+
+    # A fresh connection per query so the page cache of the previous one does not flatter it
+    for query_name, text, from_timestamp, to_timestamp in QUERIES:
+        latencies = []
+        for _ in range(QUERY_REPEATS):
+            databaseManager.local.conn = None
+            databaseManager.shard_generation += 1
+            start_time = time.time()
+            rows = databaseManager.search_text(text, from_timestamp, to_timestamp)
+            latencies.append(time.time() - start_time)
+        print(f'    {query_name:12} search {sorted(latencies)[len(latencies) // 2] * 1000:7.2f} ms ({len(rows)} hits)')
+
+    latencies = []
+    for index in range(WRITE_COUNT):
+        start_time = time.time()
+        rowid = databaseManager.save_to_screenshot_db('2025-01-15 10:00:00', f'live{index}.webp', None, None)
+        databaseManager.update_screenshot_db(rowid, 'live ocr text', 'live description')
+        latencies.append(time.time() - start_time)
+    print(f'    live save and update avg {sum(latencies) / len(latencies) * 1000:.2f} ms')
+
+def make_summarized_database(tmp_dir, row_count=ROW_COUNT):
+    databaseManager = make_database_manager(tmp_dir)
+    fill_corpus(databaseManager.db_path, row_count)
+    databaseManager.initialize_db()
+    # Everything counts as processed and summarized so the whole year may leave
+    databaseManager.execute_write([
+        ("UPDATE screenshots SET processing_state = 'done'", ()),
+        ("INSERT INTO livesummary_watermark (source, last_rowid) VALUES ('screenshots', ?)", (row_count,)),
+    ])
+    return databaseManager
+
+def count_embeddable_entries(databaseManager):
+    codes = ', '.join(str(code) for code in databaseManager.embedding_field_codes)
+    connections = [databaseManager.get_connection()] + [databaseManager.get_shard_connection(partition) for partition in databaseManager.get_shard_partitions()]
+    return sum(conn.execute(f"SELECT COUNT(*) FROM search_index WHERE rowid % 16 IN ({codes})").fetchone()[0] for conn in connections)
+
+def test_archive_moves_closed_months_and_keeps_them_searchable(tmp_path):
+    row_count = 3650
+    databaseManager = make_summarized_database(str(tmp_path), row_count)
+    # Hits without the snippet and score, bm25 statistics are per file
+    expected_rows = {query_name: sorted(row[:4] for row in databaseManager.search_text(text, from_timestamp, to_timestamp, limit=1000)) for query_name, text, from_timestamp, to_timestamp in QUERIES}
+    assert expected_rows['one month']
+
+    # Every row but the newest leaves, one shard per month
+    assert databaseManager.archive_partitions() == row_count - 1
+    assert databaseManager.get_shard_partitions() == [f'2024-{month:02d}' for month in range(1, 13)]
+    conn = databaseManager.get_connection()
+    assert conn.execute("SELECT COUNT(*) FROM screenshots").fetchone()[0] == 1
+    conn.commit()
+    for query_name, text, from_timestamp, to_timestamp in QUERIES:
+        assert sorted(row[:4] for row in databaseManager.search_text(text, from_timestamp, to_timestamp, limit=1000)) == expected_rows[query_name]
+
+    # Queued texts archived before the embedder got to them are still read, from their shard
+    queue_rows = databaseManager.retrieve_embedding_queue(0, 100000)
+    assert len(queue_rows) == count_embeddable_entries(databaseManager)
+    assert all(content is not None for _, _, content, _ in queue_rows)
+    # A model change queues the archived texts again too
+    databaseManager.requeue_embeddings()
+    assert len(databaseManager.retrieve_embedding_queue(0, 100000)) == count_embeddable_entries(databaseManager)
+
+def test_unsummarized_month_is_left_alone(tmp_path):
+    databaseManager = make_summarized_database(str(tmp_path), 730)
+    databaseManager.archive_partitions()
+    for index in range(3):
+        rowid = databaseManager.save_to_screenshot_db('2025-01-15 10:00:00', f'live{index}.webp', None, None)
+        databaseManager.update_screenshot_db(rowid, 'live ocr text', 'live description')
+
+    # Processed but past the summary watermark, only December's last row moves now that it is not the newest,
+    # and no empty shard is made for January
+    assert databaseManager.archive_partitions() == 1
+    assert '2025-01' not in databaseManager.get_shard_partitions()
+    assert not os.path.exists(databaseManager.get_shard_path('2025-01'))
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        databaseManager = make_summarized_database(tmp_dir)
+        report('Single file', databaseManager)
+
+        start_time = time.time()
+        moved_count = databaseManager.archive_partitions()
+        shard_size = sum(os.path.getsize(os.path.join(databaseManager.shard_folder_path, filename)) for filename in os.listdir(databaseManager.shard_folder_path) if filename.endswith('.db'))
+        print(f'\nArchived {moved_count} rows into {len(databaseManager.get_shard_partitions())} monthly shards ({shard_size / 1024 / 1024:.0f} MB) in {time.time() - start_time:.1f}s')
+        # VACUUM would renumber the rowids watermarks, duplicates and the search index point at, freed pages are reused instead
+        conn = databaseManager.open_connection()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+        report('Partitioned', databaseManager)
@@ -0,0 +1,100 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from bench_helper import make_database_manager
+
+def make_database(tmp_dir):
+    databaseManager = make_database_manager(tmp_dir)
+    databaseManager.initialize_db()
+    return databaseManager
+
+def get_state(databaseManager, table_name, rowid):
+    conn = databaseManager.get_connection()
+    row = conn.execute(f"SELECT processing_state, attempt_count, last_error FROM {table_name} WHERE rowid = ?", (rowid,)).fetchone()
+    conn.commit()
+    return row
+
+def test_row_is_claimed_once(tmp_path):
+    databaseManager = make_database(str(tmp_path))
+    rowid = databaseManager.save_to_photo_db('2024-01-01 10:00:00', '0.jpeg', None)
+
+    assert get_state(databaseManager, 'photos', rowid) == ('pending', 0, None)
+    assert databaseManager.claim_row('photos', rowid)
+    assert not databaseManager.claim_row('photos', rowid)
+    assert get_state(databaseManager, 'photos', rowid) == ('in_flight', 1, None)
+
+    # Done rows are never claimed again either
+    databaseManager.update_photo_db(rowid, 'A desk')
+    assert not databaseManager.claim_row('photos', rowid)
+    assert get_state(databaseManager, 'photos', rowid) == ('done', 1, None)
+
+def test_release_retries_until_max_attempts(tmp_path):
+    databaseManager = make_database(str(tmp_path))
+    rowid = databaseManager.save_to_screenshot_db('2024-01-01 10:00:00', '0.jpeg', None, None)
+
+    for attempt in range(1, 3):
+        assert databaseManager.claim_row('screenshots', rowid)
+        databaseManager.release_row('screenshots', rowid, f'timeout {attempt}', max_attempts=3)
+        assert get_state(databaseManager, 'screenshots', rowid) == ('pending', attempt, f'timeout {attempt}')
+        assert [row[0] for row in databaseManager.retrieve_pending_rows('screenshots', 'image_path', 0, '2024-01-02 00:00:00', 10)] == [rowid]
+
+    # The last attempt fails the row for good, the backlog stops picking it up
+    assert databaseManager.claim_row('screenshots', rowid)
+    databaseManager.release_row('screenshots', rowid, 'timeout 3', max_attempts=3)
+    assert get_state(databaseManager, 'screenshots', rowid) == ('failed', 3, 'timeout 3')
+    assert not databaseManager.claim_row('screenshots', rowid)
+    assert databaseManager.retrieve_pending_rows('screenshots', 'image_path', 0, '2024-01-02 00:00:00', 10) == []
+
+    # Releasing a row that isn't in flight changes nothing
+    databaseManager.release_row('screenshots', rowid, 'late', max_attempts=3)
+    assert get_state(databaseManager, 'screenshots', rowid) == ('failed', 3, 'timeout 3')
+
+def test_reset_recovers_rows_after_a_crash(tmp_path):
+    databaseManager = make_database(str(tmp_path))
+    in_flight_rowid = databaseManager.save_to_audio_db('2024-01-01 10:00:00', '0.flac', None, None)
+    done_rowid = databaseManager.save_to_audio_db('2024-01-01 10:05:00', '1.flac', None, None)
+    assert databaseManager.claim_row('audio', in_flight_rowid)
+    assert databaseManager.claim_row('audio', done_rowid)
+    databaseManager.update_audio_db(done_rowid, 'hello', 'A greeting')
+
+    # A new run over the same file, as after the app was killed mid job
+    restarted = make_database(str(tmp_path))
+    restarted.reset_in_flight_rows()
+
+    assert get_state(restarted, 'audio', in_flight_rowid) == ('pending', 1, None)
+    assert get_state(restarted, 'audio', done_rowid) == ('done', 1, None)
+    assert [row[0] for row in restarted.retrieve_pending_rows('audio', 'audio_path', 0, '2024-01-02 00:00:00', 10)] == [in_flight_rowid]
+    assert restarted.claim_row('audio', in_flight_rowid)
+
+def test_pending_rows_page_by_rowid_and_age(tmp_path):
+    databaseManager = make_database(str(tmp_path))
+    rowids = [databaseManager.save_to_photo_db(f'2024-01-01 10:0{index}:00', f'{index}.jpeg', None) for index in range(4)]
+
+    assert databaseManager.retrieve_pending_rows('photos', 'image_path', 0, '2024-01-01 10:02:00', 10) == [(rowids[0], '0.jpeg'), (rowids[1], '1.jpeg')]
+    assert databaseManager.retrieve_pending_rows('photos', 'image_path', rowids[0], '2024-01-02 00:00:00', 2) == [(rowids[1], '1.jpeg'), (rowids[2], '2.jpeg')]
+
+def test_reset_restarts_cut_off_streams(tmp_path):
+    databaseManager = make_database(str(tmp_path))
+    streaming_rowid = databaseManager.save_streaming_audio_to_db('2024-01-01 10:00:00', '0.flac')
+    databaseManager.append_audio_transcript(streaming_rowid, 'good mor')
+    empty_rowid = databaseManager.save_streaming_audio_to_db('2024-01-01 10:05:00', '1.flac')
+
+    restarted = make_database(str(tmp_path))
+    restarted.reset_in_flight_rows()
+
+    # The partial transcript goes, the batch path transcribes the saved file whole
+    assert restarted.retrieve_audio_transcript(streaming_rowid) is None
+    assert get_state(restarted, 'audio', streaming_rowid) == ('pending', 0, None)
+    assert [row[0] for row in restarted.retrieve_pending_rows('audio', 'audio_path', 0, '2024-01-02 00:00:00', 10)] == [streaming_rowid, empty_rowid]
+
+def test_streams_without_audio_are_deleted(tmp_path):
+    databaseManager = make_database(str(tmp_path))
+    streaming_rowid = databaseManager.save_streaming_audio_to_db('2024-01-01 10:00:00', '0.flac')
+    finished_rowid = databaseManager.save_to_audio_db('2024-01-01 10:05:00', '1.flac', None, None)
+
+    databaseManager.delete_streaming_audio(streaming_rowid)
+    databaseManager.delete_streaming_audio(finished_rowid)
+
+    assert get_state(databaseManager, 'audio', streaming_rowid) is None
+    assert get_state(databaseManager, 'audio', finished_rowid) == ('pending', 0, None)
@@ -0,0 +1,73 @@
+import os
+import sys
+import random
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app_prompt import PromptManager
+from bench_helper import BenchConfig, make_vocabulary_text
+
+MODEL = "openai/gpt-4-turbo-preview"
+
+def count_packed_tokens(promptManager, lines):
+    # Same per line cost pack_lines charges, one token for the newline joining them
+    return sum(promptManager.count_tokens(line, MODEL) + 1 for line in lines)
+
+def test_packed_lines_stay_inside_the_budget():
+    promptManager = PromptManager(BenchConfig())
+    rng = random.Random(0)
+    lines = [make_vocabulary_text(rng) for _ in range(500)]
+
+    for budget in (0, 50, 500, 5000):
+        packed_lines = promptManager.pack_lines(MODEL, lines, budget)
+        assert count_packed_tokens(promptManager, packed_lines) <= budget
+    # Everything fits a budget as large as the input
+    assert promptManager.pack_lines(MODEL, lines, count_packed_tokens(promptManager, lines)) == lines
+
+def test_pack_text_leaves_room_for_the_rest_of_the_request():
+    promptManager = PromptManager(BenchConfig({"prompt_token_budgets": {"gpt-4-turbo-preview": 300}}))
+    rng = random.Random(1)
+    system_prompt = make_vocabulary_text(rng, 40, 40)
+    text = '\n'.join(make_vocabulary_text(rng) for _ in range(100))
+
+    packed_text = promptManager.pack_text(MODEL, text, reserved_texts=(system_prompt,), reserved_tokens=20)
+
+    budget = 300 - 20 - promptManager.count_tokens(system_prompt, MODEL)
+    assert 0 < count_packed_tokens(promptManager, packed_text.splitlines()) <= budget
+
+def test_near_duplicate_lines_are_collapsed():
+    promptManager = PromptManager(BenchConfig())
+    lines = [
+        'File  Edit  View  Help',
+        'Quarterly invoice review with finance',
+        'file edit view help',
+        '   File Edit View Help   ',
+        'Quarterly invoice review with finance',
+        '',
+    ]
+
+    # First spelling kept, stripped, in its original place
+    assert promptManager.pack_lines(MODEL, lines, 1000) == ['File  Edit  View  Help', 'Quarterly invoice review with finance']
+
+def test_best_ranked_lines_survive_truncation():
+    promptManager = PromptManager(BenchConfig())
+    noise = ['|||  ---  |||', '## ## ## ##', '1 2 3 4 5 6']
+    words = ['Reviewing the quarterly invoices from the finance team in the spreadsheet', 'Meeting notes about the kubernetes migration plan']
+    filler = ['ok ' * 30 + 'the']
+    lines = noise[:1] + words[:1] + filler + noise[1:2] + words[1:] + noise[2:]
+
+    # Room for the two wordy lines, not for the long low scoring one as well
+    budget = count_packed_tokens(promptManager, words)
+    packed_lines = promptManager.pack_lines(MODEL, lines, budget)
+
+    assert packed_lines == words
+    # Noise without a real word never goes out, whatever the budget
+    assert not set(noise) & set(promptManager.pack_lines(MODEL, lines, 100000))
+
+def test_custom_rank_keeps_the_most_recent_lines():
+    promptManager = PromptManager(BenchConfig())
+    lines = [f'[2024-01-01 10:{minute:02d}:00] Screenshot: editing the report' for minute in range(60)]
+    budget = count_packed_tokens(promptManager, lines[-10:])
+
+    packed_lines = promptManager.pack_lines(MODEL, lines, budget, rank=lambda line: line)
+
+    assert packed_lines == lines[-10:]
@@ -0,0 +1,120 @@
+import os
+import sys
+import time
+import tempfile
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app_prompt import PromptManager
+from app_agent import AgentManager
+from bench_helper import BenchConfig, BenchControl, fill_text_corpus, make_database_manager, make_embedding_manager, make_vocabulary_text
+
+# A year of captures at one row a minute through an 8 hour day
+ROW_COUNT = 175000
+STUB_LLM_LATENCY_IN_SEC = 0.3
+# Planted events the questions are about
+EVENTS = [
+    'Zoom call with the finance team going through the Q3 spend review spreadsheet',
+    'Reading the postgres query plan for the slow invoices report',
+    'Booking flights to Lisbon for the offsite in the airline website',
+]
+QUESTIONS = [
+    ('whole year', 'When did I look at the Q3 spend review?', None, None),
+    ('whole year, repeated', 'When did I look at the Q3 spend review?', None, None),
+    ('one month', 'What was wrong with the invoices report query?', '2024-06-01 00:00:00', '2024-06-30 23:59:59'),
+    # No word in common with the planted event, only a sentence embedding model finds it
+    ('paraphrase', 'When was the budget meeting with finance?', None, None),
+    ('nothing relevant', 'Did I ever play chess?', None, None),
+]
+CONFIG_DATA = {
+    "agent_livesummary_loop_time_in_min": 5,
+    "agent_livesummary_text_model": "local/stub",
+}
+
+class StubModelManager:
+    # Stands in for a local LLM, answers after a fixed delay and records the prompt size
+    def __init__(self, promptManager, latency_in_sec=STUB_LLM_LATENCY_IN_SEC):
+        self.promptManager = promptManager
+        self.latency_in_sec = latency_in_sec
+        self.prompt_tokens = []
+        self.payloads = []
+    def send_text_to_llm_api(self, payload, priority=None):
+        self.prompt_tokens.append(sum(self.promptManager.count_tokens(message["content"], payload["model"]) for message in payload["messages"]))
+        self.payloads.append(payload)
+        time.sleep(self.latency_in_sec)
+        return 'stub answer'
+
+def make_text(rng, index):
+    words = make_vocabulary_text(rng, 10, 30).split()
+    if index % 10007 == 0:
+        words.insert(rng.randrange(len(words)), EVENTS[(index // 10007) % len(EVENTS)])
+    return ' '.join(words)
+
+def fill_corpus(db_path, row_count=ROW_COUNT):
+    fill_text_corpus(db_path, row_count, make_text)
+
+def make_agent_manager(tmp_dir, config_data, row_count=ROW_COUNT, latency_in_sec=STUB_LLM_LATENCY_IN_SEC):
+    configManager = BenchConfig({**CONFIG_DATA, **config_data})
+    databaseManager = make_database_manager(tmp_dir, configManager)
+    fill_corpus(databaseManager.db_path, row_count)
+    databaseManager.initialize_db()
+
+    embeddingManager = make_embedding_manager(tmp_dir, databaseManager, configManager)
+    embeddingManager.open_store()
+    embeddingManager.process_queue()
+
+    promptManager = PromptManager(configManager)
+    modelManager = StubModelManager(promptManager, latency_in_sec)
+    return AgentManager(configManager, BenchControl(), modelManager, promptManager, embeddingManager, databaseManager, None), modelManager
+
+def test_context_holds_the_event_or_nothing(tmp_path):
+    # Events land on rows 0, 10007 and 20014
+    agentManager, modelManager = make_agent_manager(str(tmp_path), {"embedding_model": "hashing"}, row_count=30000, latency_in_sec=0)
+
+    context_text = agentManager.retrieve_context('When did I look at the Q3 spend review?')
+    assert 'Q3 spend review' in context_text
+    assert context_text.count('\n') + 1 <= agentManager.agent_qa_context_count
+    context_text = agentManager.retrieve_context('What was wrong with the invoices report query?', '2024-01-01 00:00:00', '2024-06-30 23:59:59')
+    assert 'postgres query plan' in context_text
+
+    # Nothing about chess was ever captured, the model is told so instead of getting random rows
+    assert agentManager.retrieve_context('Did I ever play chess?') == ''
+    assert agentManager.answer_question('Did I ever play chess?') == 'stub answer'
+    assert '(nothing relevant found)' in modelManager.payloads[-1]["messages"][1]["content"]
+
+def test_default_model_answers_paraphrases(tmp_path):
+    pytest.importorskip("sentence_transformers")
+    agentManager, _ = make_agent_manager(str(tmp_path), {}, row_count=30000, latency_in_sec=0)
+    if agentManager.embeddingManager.embedding_model == "hashing":
+        pytest.skip("default sentence-transformers model could not be loaded")
+
+    assert 'Q3 spend review' in agentManager.retrieve_context('When was the budget meeting with finance?')
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        configManager = BenchConfig(CONFIG_DATA)
+        databaseManager = make_database_manager(tmp_dir, configManager)
+
+        start_time = time.time()
+        fill_corpus(databaseManager.db_path)
+        databaseManager.initialize_db()
+        print(f'Generated, migrated and indexed {ROW_COUNT} rows in {time.time() - start_time:.1f}s')
+
+        embeddingManager = make_embedding_manager(tmp_dir, databaseManager, configManager)
+        embeddingManager.open_store()
+        start_time = time.time()
+        embedded_count = embeddingManager.process_queue()
+        print(f'Embedded {embedded_count} texts in {time.time() - start_time:.1f}s\n')
+
+        promptManager = PromptManager(configManager)
+        modelManager = StubModelManager(promptManager)
+        agentManager = AgentManager(configManager, BenchControl(), modelManager, promptManager, embeddingManager, databaseManager, None)
+
+        for name, question, from_timestamp, to_timestamp in QUESTIONS:
+            start_time = time.time()
+            agentManager.answer_question(question, from_timestamp, to_timestamp)
+            elapsed_time = time.time() - start_time
+            print(f'>> {name:22} {elapsed_time:.2f}s end to end ({elapsed_time - STUB_LLM_LATENCY_IN_SEC:.2f}s without the stub LLM), prompt {modelManager.prompt_tokens[-1]} tokens')
+
+        print()
+        print(agentManager.retrieve_context(QUESTIONS[0][1])[:600])
@@ -0,0 +1,162 @@
+import os
+import sys
+import threading
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import app_ratelimit
+from app_ratelimit import RateLimitManager
+from bench_helper import BenchConfig
+
+KEY = "openai/gpt-4-turbo-preview"
+
+class FakeClock:
+    """Stands in for the time module inside app_ratelimit, sleeping moves the clock instead of the test."""
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+        self.on_sleep = None
+    def time(self):
+        return self.now
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        if self.on_sleep is not None:
+            self.on_sleep(delay)
+        self.now += delay
+
+class StubResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+def make_rate_limit_manager(monkeypatch, config_data=None):
+    clock = FakeClock()
+    monkeypatch.setattr(app_ratelimit, 'time', clock)
+    return RateLimitManager(BenchConfig(config_data)), clock
+
+def advance(rateLimitManager, clock, seconds):
+    # Wake the waiters at once rather than after their (real time) condition timeout
+    with rateLimitManager.condition:
+        clock.now += seconds
+        rateLimitManager.condition.notify_all()
+
+def wait_for_waiters(rateLimitManager, count):
+    for _ in range(200):
+        with rateLimitManager.condition:
+            if len(rateLimitManager.get_bucket(KEY)["waiters"]) == count:
+                return
+        threading.Event().wait(0.01)
+    raise AssertionError(f'{count} callers never queued up')
+
+def test_waiters_are_served_by_priority(monkeypatch):
+    rateLimitManager, clock = make_rate_limit_manager(monkeypatch, {"rate_limits": {KEY: {"rpm": 1, "tpm": 100000}}})
+    rateLimitManager.acquire(KEY, 10)
+
+    # Queued lowest priority first, the bucket is empty until the clock moves
+    served = []
+    def acquire(priority):
+        rateLimitManager.acquire(KEY, 10, priority)
+        served.append(priority)
+    threads = []
+    for priority in ("backfill", "live", "summary"):
+        thread = threading.Thread(target=acquire, args=(priority,))
+        thread.start()
+        threads.append(thread)
+        wait_for_waiters(rateLimitManager, len(threads))
+
+    # One request refills per simulated minute, so exactly one waiter gets through each time
+    for served_count in range(1, 4):
+        advance(rateLimitManager, clock, 60)
+        for _ in range(200):
+            if len(served) == served_count:
+                break
+            threading.Event().wait(0.01)
+        assert len(served) == served_count
+    for thread in threads:
+        thread.join(5)
+
+    assert served == ["summary", "live", "backfill"]
+    assert rateLimitManager.get_stats()[KEY]["requests"] == 4
+
+def test_thread_priority_is_the_default(monkeypatch):
+    rateLimitManager, _ = make_rate_limit_manager(monkeypatch)
+
+    assert rateLimitManager.get_thread_priority() == "live"
+    rateLimitManager.set_thread_priority("backfill")
+    assert rateLimitManager.get_thread_priority() == "backfill"
+    # Other threads keep their own default
+    other_priorities = []
+    thread = threading.Thread(target=lambda: other_priorities.append(rateLimitManager.get_thread_priority()))
+    thread.start()
+    thread.join()
+    assert other_priorities == ["live"]
+
+def test_429_holds_back_every_caller_until_retry_after(monkeypatch):
+    rateLimitManager, clock = make_rate_limit_manager(monkeypatch)
+    responses = [StubResponse(429, {"Retry-After": "30"}), StubResponse(200)]
+    held = []
+
+    def on_sleep(delay):
+        # While the throttled call backs off, another caller of the same bucket has to wait as well
+        other = threading.Thread(target=rateLimitManager.acquire, args=(KEY, 10, "summary"))
+        other.start()
+        other.join(0.3)
+        assert other.is_alive()
+        with rateLimitManager.condition:
+            assert rateLimitManager.get_bucket(KEY)["blocked_until"] == clock.now + 30
+        held.append(other)
+    clock.on_sleep = on_sleep
+
+    response = rateLimitManager.call(KEY, 10, lambda: responses.pop(0))
+    held[0].join(5)
+
+    assert response.status_code == 200
+    assert not held[0].is_alive()
+    # Retry-After wins over the shorter jittered backoff
+    assert clock.sleeps == [30.0]
+    stats = rateLimitManager.get_stats()[KEY]
+    assert stats["throttled"] == 1
+    assert stats["retries"] == 1
+    assert stats["requests"] == 3
+
+def test_server_errors_retry_with_jittered_backoff(monkeypatch):
+    rateLimitManager, clock = make_rate_limit_manager(monkeypatch, {"rate_limit_max_retries": 2})
+    responses = [StubResponse(503), StubResponse(502), StubResponse(200)]
+
+    response = rateLimitManager.call(KEY, 10, lambda: responses.pop(0))
+
+    assert response.status_code == 200
+    # Full jitter below base * 2 ** attempt, and no hold on the bucket for errors that aren't throttling
+    assert len(clock.sleeps) == 2
+    assert 0 <= clock.sleeps[0] <= 1
+    assert 0 <= clock.sleeps[1] <= 2
+    with rateLimitManager.condition:
+        assert rateLimitManager.get_bucket(KEY)["blocked_until"] == 0.0
+    assert rateLimitManager.get_stats()[KEY]["errors"] == 2
+
+def test_exhausted_retries_raise_without_a_response(monkeypatch):
+    rateLimitManager, _ = make_rate_limit_manager(monkeypatch, {"rate_limit_max_retries": 1})
+
+    def send_request():
+        raise ConnectionResetError("connection reset")
+    with pytest.raises(ConnectionError, match="connection reset"):
+        rateLimitManager.call(KEY, 10, send_request)
+
+def test_usage_settles_the_estimate(monkeypatch):
+    rateLimitManager, clock = make_rate_limit_manager(monkeypatch, {"rate_limits": {KEY: {"rpm": 60, "tpm": 1000}}})
+
+    # Overestimated call gives the unused tokens back
+    rateLimitManager.acquire(KEY, 800)
+    assert rateLimitManager.get_stats()[KEY]["tokens_available"] == 200
+    rateLimitManager.record_usage(KEY, 800, 300)
+    stats = rateLimitManager.get_stats()[KEY]
+    assert stats["tokens_available"] == 700
+    assert stats["tokens"] == 300
+
+    # Underestimated call takes the rest from the bucket, an estimate over the whole budget was clamped to it
+    clock.now += 60
+    rateLimitManager.acquire(KEY, 5000)
+    rateLimitManager.record_usage(KEY, 5000, 1200)
+    stats = rateLimitManager.get_stats()[KEY]
+    assert stats["tokens_available"] == -200
+    assert stats["tokens"] == 1500
@@ -0,0 +1,71 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import app_cache
+from app_cache import CacheManager
+from bench_helper import BenchConfig
+
+HOUR = 3600
+
+class FakeClock:
+    """Stands in for the time module inside app_cache."""
+    def __init__(self):
+        self.now = 1704067200.0
+    def time(self):
+        return self.now
+
+def make_cache_manager(monkeypatch, tmp_dir, config_data=None):
+    clock = FakeClock()
+    monkeypatch.setattr(app_cache, 'time', clock)
+    cacheManager = CacheManager(BenchConfig(config_data))
+    cacheManager.sql_folder_path = tmp_dir
+    cacheManager.cache_db_path = os.path.join(tmp_dir, 'cache.db')
+    return cacheManager, clock
+
+def get_keys(cacheManager):
+    return sorted(row[0] for row in cacheManager.get_connection().execute("SELECT key FROM response_cache"))
+
+def test_expired_entry_is_a_miss(monkeypatch, tmp_path):
+    cacheManager, clock = make_cache_manager(monkeypatch, str(tmp_path), {"cache_ttl_in_hours": 1})
+    cacheManager.set('a', 'gpt', 'answer')
+
+    clock.now += HOUR / 2
+    assert cacheManager.get('a') == 'answer'
+    clock.now += HOUR
+    assert cacheManager.get('a') is None
+    assert cacheManager.get_stats()["hits"] == 1
+    assert cacheManager.get_stats()["misses"] == 1
+
+    # Eviction deletes it for good
+    cacheManager.evict()
+    assert get_keys(cacheManager) == []
+    assert cacheManager.get_stats()["evicted"] == 1
+
+def test_least_recently_used_entry_is_evicted_past_the_size_cap(monkeypatch, tmp_path):
+    # 100 bytes of responses at most, eviction after every insert
+    cacheManager, clock = make_cache_manager(monkeypatch, str(tmp_path), {"cache_max_size_in_mb": 100 / 1024 / 1024, "cache_eviction_interval": 1})
+    cacheManager.set('a', 'gpt', 'a' * 40)
+    clock.now += 2 * HOUR
+    cacheManager.set('b', 'gpt', 'b' * 40)
+    assert get_keys(cacheManager) == ['a', 'b']
+
+    clock.now += 2 * HOUR
+    cacheManager.set('c', 'gpt', 'c' * 40)
+
+    assert get_keys(cacheManager) == ['b', 'c']
+    assert cacheManager.get_stats()["evicted"] == 1
+
+def test_hit_refreshes_recency(monkeypatch, tmp_path):
+    cacheManager, clock = make_cache_manager(monkeypatch, str(tmp_path), {"cache_max_size_in_mb": 100 / 1024 / 1024, "cache_eviction_interval": 1})
+    cacheManager.set('a', 'gpt', 'a' * 40)
+    clock.now += 2 * HOUR
+    cacheManager.set('b', 'gpt', 'b' * 40)
+
+    # Reading the older entry makes the newer one the least recently used
+    clock.now += 2 * HOUR
+    assert cacheManager.get('a') == 'a' * 40
+    clock.now += 2 * HOUR
+    cacheManager.set('c', 'gpt', 'c' * 40)
+
+    assert get_keys(cacheManager) == ['a', 'c']
@@ -0,0 +1,163 @@
+import io
+import os
+import sys
+import time
+import random
+import tempfile
+import numpy as np
+import soundfile
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app_helper import MediaManager
+from app_retention import RetentionManager
+from bench_helper import BenchConfig, BenchControl, make_database_manager
+
+# Four months of captures, a screenshot every 15 minutes through an 8 hour day and a voice note every other hour
+DAY_COUNT = 120
+SCREENSHOTS_PER_DAY = 32
+AUDIOS_PER_DAY = 4
+DUPLICATE_SHARE = 0.3
+AUDIO_LENGTH_IN_SEC = 10
+
+def make_screenshot(rng):
+    # Flat panels with noisy text-like stripes compress about like a real desktop capture
+    pixels = np.full((1080, 1920, 3), rng.integers(200, 256), dtype=np.uint8)
+    for top in range(40, 1040, 24):
+        pixels[top:top + 12, 80:rng.integers(400, 1840)] = rng.integers(0, 80, (12, 1, 3), dtype=np.uint8)
+    pixels[::3, ::3] ^= rng.integers(0, 24, pixels[::3, ::3].shape, dtype=np.uint8)
+    image_bytes = io.BytesIO()
+    Image.fromarray(pixels).save(image_bytes, format='JPEG', quality=90)
+    return image_bytes.getvalue()
+
+def fill_corpus(databaseManager, screenshots_folder_path, audios_folder_path, day_count=DAY_COUNT, screenshots_per_day=SCREENSHOTS_PER_DAY, audios_per_day=AUDIOS_PER_DAY, skipped_ages_in_days=()):
+    rng = np.random.default_rng(0)
+    duplicate_rng = random.Random(0)
+    screenshot_variants = [make_screenshot(rng) for _ in range(16)]
+    audio_data = (np.sin(np.arange(16000 * AUDIO_LENGTH_IN_SEC) * 2 * np.pi * 220 / 16000) * 8000 + rng.normal(0, 500, 16000 * AUDIO_LENGTH_IN_SEC)).astype(np.int16)
+
+    start_epoch = time.time() - day_count * 86400
+    for day in range(day_count):
+        # A day's captures are up to day_count - day days old, skipped days keep the rest clear of a cutoff
+        if day_count - day in skipped_ages_in_days:
+            continue
+        reference_rowid = None
+        for index in range(screenshots_per_day):
+            timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_epoch + day * 86400 + index * 900))
+            if reference_rowid and duplicate_rng.random() < DUPLICATE_SHARE:
+                databaseManager.save_duplicate_to_screenshot_db(timestamp, reference_rowid)
+                continue
+            filename = f'{day}-{index}.jpeg'
+            with open(os.path.join(screenshots_folder_path, filename), 'wb') as image_file:
+                image_file.write(screenshot_variants[(day + index) % len(screenshot_variants)])
+            reference_rowid = databaseManager.save_to_screenshot_db(timestamp, filename, None, None)
+            databaseManager.update_screenshot_db(reference_rowid, f'ocr text {day} {index}', f'description {day} {index}')
+        for index in range(audios_per_day):
+            timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_epoch + day * 86400 + index * 7200))
+            filename = f'{day}-{index}.flac'
+            soundfile.write(os.path.join(audios_folder_path, filename), audio_data, 16000, format='FLAC', subtype='PCM_16')
+            rowid = databaseManager.save_to_audio_db(timestamp, filename, None, None)
+            databaseManager.update_audio_db(rowid, f'transcript {day} {index}', f'description {day} {index}')
+
+    # Everything counts as summarized so the older months move into shards
+    databaseManager.execute_write([
+        (f"INSERT OR REPLACE INTO livesummary_watermark (source, last_rowid) SELECT '{table_name}', MAX(rowid) FROM {table_name}", ())
+        for table_name in ('screenshots', 'photos', 'audio')
+    ])
+    databaseManager.archive_partitions()
+
+def collect_media_rows(databaseManager):
+    """(table_name, timestamp, media_tier, filename) of every row in data.db and the shards, duplicates included."""
+    media_rows = []
+    connections = [databaseManager.get_shard_connection(partition) for partition in databaseManager.get_shard_partitions()]
+    for conn in connections + [databaseManager.get_connection()]:
+        for table_name, media_column in databaseManager.media_tables:
+            media_rows += [(table_name, *row) for row in conn.execute(f"SELECT timestamp, media_tier, {media_column} FROM {table_name}")]
+        conn.commit()
+    return media_rows
+
+def count_tiers(databaseManager):
+    tiers = {}
+    for table_name, _, media_tier, _ in collect_media_rows(databaseManager):
+        tiers[(table_name, media_tier)] = tiers.get((table_name, media_tier), 0) + 1
+    return tiers
+
+def count_broken_paths(databaseManager, retentionManager):
+    # Every path left in data.db or a shard, duplicates included, has to still be on disk
+    return sum(
+        not os.path.exists(os.path.join(retentionManager.media_folders[table_name], filename))
+        for table_name, _, _, filename in collect_media_rows(databaseManager) if filename is not None
+    )
+
+def report(name, databaseManager, retentionManager):
+    print(f'{name}: media {retentionManager.get_media_size() / 1024 / 1024:.0f} MB, {count_broken_paths(databaseManager, retentionManager)} broken paths')
+    print('    ' + ', '.join(f'{table_name} {media_tier} {count}' for (table_name, media_tier), count in sorted(count_tiers(databaseManager).items())))
+
+def make_retention_manager(tmp_dir):
+    configManager = BenchConfig({"retention_batch_pause_in_sec": 0})
+    databaseManager = make_database_manager(tmp_dir, configManager)
+    databaseManager.initialize_db()
+
+    retentionManager = RetentionManager(configManager, BenchControl(), databaseManager, MediaManager())
+    retentionManager.media_folders = {table_name: os.path.join(tmp_dir, table_name) for table_name in retentionManager.media_folders}
+    for folder_path in retentionManager.media_folders.values():
+        os.makedirs(folder_path)
+    return databaseManager, retentionManager
+
+def test_tiers_follow_age_and_quota_without_broken_paths(tmp_path):
+    databaseManager, retentionManager = make_retention_manager(str(tmp_path))
+    # Every row stays a day away from the 7 and 90 day cutoffs, a slow pass cannot age rows across one before the next
+    skipped_ages_in_days = (retentionManager.retention_full_days, retentionManager.retention_full_days + 1, retentionManager.retention_thumbnail_days, retentionManager.retention_thumbnail_days + 1)
+    fill_corpus(databaseManager, retentionManager.media_folders['screenshots'], retentionManager.media_folders['audio'], day_count=100, screenshots_per_day=2, audios_per_day=1, skipped_ages_in_days=skipped_ages_in_days)
+    assert databaseManager.get_shard_partitions()
+    full_media_size = retentionManager.get_media_size()
+
+    assert retentionManager.process_retention() > 0
+    assert count_broken_paths(databaseManager, retentionManager) == 0
+    now = time.time()
+    for table_name, timestamp, media_tier, filename in collect_media_rows(databaseManager):
+        age_in_days = (now - time.mktime(time.strptime(timestamp, '%Y-%m-%d %H:%M:%S'))) / 86400
+        if age_in_days > retentionManager.retention_thumbnail_days:
+            assert (media_tier, filename) == ('text', None)
+        elif age_in_days > retentionManager.retention_full_days:
+            assert media_tier == ('full' if table_name == 'audio' and not retentionManager.audio_thumbnail_enabled else 'thumbnail')
+        else:
+            assert media_tier == 'full'
+    assert retentionManager.get_media_size() < full_media_size
+
+    # Nothing left to do on the second pass
+    assert retentionManager.process_retention() == 0
+
+    # A quota below the last week's size pulls the newest files down too
+    retentionManager.retention_max_media_size_in_mb = retentionManager.get_media_size() / 1024 / 1024 / 2
+    assert retentionManager.process_retention() > 0
+    assert retentionManager.get_media_size() <= retentionManager.retention_max_media_size_in_mb * 1024 * 1024
+    assert count_broken_paths(databaseManager, retentionManager) == 0
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        databaseManager, retentionManager = make_retention_manager(tmp_dir)
+
+        start_time = time.time()
+        fill_corpus(databaseManager, retentionManager.media_folders['screenshots'], retentionManager.media_folders['audio'])
+        print(f'Captured {DAY_COUNT} days into {len(databaseManager.get_shard_partitions())} shards and data.db in {time.time() - start_time:.1f}s')
+        report('Before', databaseManager, retentionManager)
+
+        # Age policy: full for a week, thumbnails up to 90 days, text only after that
+        start_time = time.time()
+        reclaimed_bytes = retentionManager.process_retention()
+        elapsed_time = time.time() - start_time
+        print(f'\nAge pass reclaimed {reclaimed_bytes / 1024 / 1024:.0f} MB in {elapsed_time:.1f}s, {(retentionManager.thumbnail_count + retentionManager.removed_count) / elapsed_time:.1f} files/s')
+        report('After age policy', databaseManager, retentionManager)
+
+        # The second pass has nothing left to do and should cost next to nothing
+        start_time = time.time()
+        retentionManager.process_retention()
+        print(f'\nIdle pass in {(time.time() - start_time) * 1000:.0f} ms')
+
+        # A quota below what the last week takes pulls the newest files down early too
+        retentionManager.retention_max_media_size_in_mb = int(retentionManager.get_media_size() / 1024 / 1024 / 2)
+        start_time = time.time()
+        reclaimed_bytes = retentionManager.process_retention()
+        print(f'\nQuota pass ({retentionManager.retention_max_media_size_in_mb} MB) reclaimed {reclaimed_bytes / 1024 / 1024:.0f} MB in {time.time() - start_time:.1f}s')
+        report('After quota policy', databaseManager, retentionManager)
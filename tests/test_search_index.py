@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+import random
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from bench_helper import fill_text_corpus, make_database_manager, make_vocabulary_text
+
+ROW_COUNT = 1000000
+LIVE_SAVE_COUNT = 1000
+QUERY_REPEATS = 5
+# A few rare words that only show up now and then like real search targets
+RARE_WORDS = ['kubernetes', 'invoice', 'quarterly', 'flamegraph', 'postgres']
+QUERIES = [
+    ('common term', 'word42', None),
+    ('rare term', 'flamegraph', None),
+    ('two common terms', 'word7 word11', None),
+    ('rare term, last day', 'kubernetes', ('2024-01-31 00:00:00', '2024-01-31 23:59:59')),
+]
+
+def make_text(rng, index=None):
+    text = make_vocabulary_text(rng)
+    if rng.random() < 0.001:
+        words = text.split()
+        words[rng.randrange(len(words))] = rng.choice(RARE_WORDS)
+        text = ' '.join(words)
+    return text
+
+def fill_corpus(db_path, row_count=ROW_COUNT):
+    """Spread row_count rows over January, like an install that predates the index."""
+    fill_text_corpus(db_path, row_count, make_text, start_timestamp='2024-01-01 00:00:00', day_count=31, seconds_between_rows=0.5)
+
+def like_search(conn, text, time_range):
+    # What finding something looked like before the index, every text column of every row and nothing to rank by
+    pattern = f'%{text.split()[0]}%'
+    time_filter = "AND timestamp_epoch BETWEEN CAST(strftime('%s', ?) AS INTEGER) AND CAST(strftime('%s', ?) AS INTEGER)" if time_range else ""
+    time_params = list(time_range) if time_range else []
+    rows = []
+    for table_name, columns in (('screenshots', ('ocr_text', 'description_text')), ('photos', ('description_text',)), ('audio', ('transcript_text', 'description_text'))):
+        where = ' OR '.join(f'{column} LIKE ?' for column in columns)
+        rows += conn.execute(f"SELECT rowid, timestamp FROM {table_name} WHERE ({where}) {time_filter}", [pattern] * len(columns) + time_params).fetchall()
+    return rows
+
+def measure(function):
+    latencies = []
+    for _ in range(QUERY_REPEATS):
+        start_time = time.time()
+        rows = function()
+        latencies.append(time.time() - start_time)
+    return sorted(latencies)[len(latencies) // 2] * 1000, len(rows)
+
+def test_index_backfills_and_follows_saves(tmp_path):
+    databaseManager = make_database_manager(str(tmp_path))
+    fill_corpus(databaseManager.db_path, row_count=2000)
+    databaseManager.initialize_db()
+    conn = databaseManager.get_connection()
+
+    # Migration backfill, two fields per screenshot and audio row and one per photo
+    assert conn.execute("SELECT COUNT(*) FROM search_index").fetchone()[0] == 1400 * 2 + 400 * 2 + 200
+    conn.commit()
+    # The index answers the same rows a LIKE scan finds, ranked
+    like_rows = {(timestamp, rowid) for rowid, timestamp in like_search(conn, 'word4999', None)}
+    assert like_rows
+    fts_rows = databaseManager.search_text('word4999', limit=1000)
+    assert {(timestamp, rowid) for _, _, rowid, timestamp, _, _ in fts_rows} == like_rows
+    assert [row[5] for row in fts_rows] == sorted(row[5] for row in fts_rows)
+
+    # Live saves are indexed by the triggers in the same commit, and edits replace the old text
+    rowid = databaseManager.save_to_screenshot_db('2024-02-01 12:00:00', 'live.webp', None, None)
+    databaseManager.update_screenshot_db(rowid, 'flamegraph of the postgres planner', 'a terminal')
+    assert [row[:4] for row in databaseManager.search_text('flamegraph')] == [('screenshots', 'ocr_text', rowid, '2024-02-01 12:00:00')]
+    assert databaseManager.search_text('flamegraph', to_timestamp='2024-01-31 23:59:59') == []
+    assert databaseManager.search_text('flamegraph', sources=['audio']) == []
+    databaseManager.update_screenshot_db(rowid, 'kubernetes dashboard', 'a browser')
+    assert databaseManager.search_text('flamegraph') == []
+    assert [row[2] for row in databaseManager.search_text('kubernetes dashboard')] == [rowid]
+
+    # User input is quoted, FTS5 syntax characters are plain text
+    assert databaseManager.search_text('C++ "unbalanced') == []
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        databaseManager = make_database_manager(tmp_dir)
+
+        start_time = time.time()
+        fill_corpus(databaseManager.db_path)
+        print(f'Generated {ROW_COUNT} rows in {time.time() - start_time:.1f}s')
+
+        # Migrations add the epoch columns and backfill the index in one pass
+        start_time = time.time()
+        databaseManager.initialize_db()
+        print(f'Migrated and indexed in {time.time() - start_time:.1f}s')
+
+        conn = databaseManager.get_connection()
+        indexed_count = conn.execute("SELECT COUNT(*) FROM search_index").fetchone()[0]
+        print(f'{indexed_count} indexed fields, database {os.path.getsize(databaseManager.db_path) / 1024 / 1024:.0f} MB')
+
+        # The capture loops save one row per commit, the triggers index it inside the same commit
+        save_latencies = []
+        for index in range(LIVE_SAVE_COUNT):
+            start_time = time.time()
+            rowid = databaseManager.save_to_screenshot_db('2024-02-01 00:00:00', f'live{index}.webp', None, None)
+            databaseManager.update_screenshot_db(rowid, make_text(random.Random(index)), make_text(random.Random(-index)))
+            save_latencies.append(time.time() - start_time)
+        print(f'Live save and update with indexing: avg {sum(save_latencies) / len(save_latencies) * 1000:.2f} ms\n')
+
+        for name, text, time_range in QUERIES:
+            from_timestamp, to_timestamp = time_range or (None, None)
+            fts_ms, fts_count = measure(lambda: databaseManager.search_text(text, from_timestamp, to_timestamp))
+            like_ms, like_count = measure(lambda: like_search(conn, text, time_range))
+            print(f'{name:22} fts5 top 20 {fts_ms:8.2f} ms ({fts_count} hits) | LIKE scan {like_ms:9.2f} ms ({like_count} matching rows, unranked) | {like_ms / max(fts_ms, 0.001):.0f}x')
+
+        print()
+        for source, field, rowid, timestamp, snippet, score in databaseManager.search_text('flamegraph', limit=3):
+            print(f'{timestamp} {source}#{rowid} {field} {score:.2f}: {snippet}')
@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import wave
+import tempfile
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app_helper import MediaManager
+from bench_helper import make_model_manager
+
+SAMPLE_RATE = 16000
+WINDOW_IN_SEC = 30
+FEED_IN_MS = 20
+STUB_SECONDS_PER_AUDIO_SECOND = 0.05
+stub_word_count = 0
+
+def stub_transcriber(audio_path, base_delay_in_sec=0.2):
+    global stub_word_count
+    # Stands in for a local Whisper server, time grows with the audio length like the real thing
+    with wave.open(audio_path, 'rb') as wf:
+        duration = wf.getnframes() / wf.getframerate()
+    time.sleep(base_delay_in_sec + duration * STUB_SECONDS_PER_AUDIO_SECOND)
+    words = [f'word{stub_word_count + index}' for index in range(int(duration * 2))]
+    stub_word_count += len(words)
+    return ' '.join(words)
+
+def make_audio(window_in_sec=WINDOW_IN_SEC):
+    t = np.arange(window_in_sec * SAMPLE_RATE) / SAMPLE_RATE
+    return (6000 * np.sin(2 * np.pi * 220 * t) * (1 + np.sin(2 * np.pi * 2 * t))).astype(np.int16)
+
+def feed_all(stream, audio, feed_length=SAMPLE_RATE * FEED_IN_MS // 1000):
+    for offset in range(0, len(audio), feed_length):
+        stream.feed(audio[offset:offset + feed_length])
+    stream.close()
+
+def test_stream_sends_only_speech_chunks(tmp_path):
+    modelManager = make_model_manager(str(tmp_path))
+    transcribed_lengths = []
+    def transcriber(audio_path):
+        with wave.open(audio_path, 'rb') as wf:
+            transcribed_lengths.append(wf.getnframes())
+        return f'piece{len(transcribed_lengths)}'
+    modelManager.register_transcriber("stub", transcriber)
+
+    mediaManager = MediaManager()
+    vad = lambda samples, sample_rate: mediaManager.detect_speech(samples, sample_rate, 1, padding_in_sec=0) is not None
+    # First chunk silent, second chunk talking, with the default 5s chunks and 1s overlap
+    audio = np.concatenate((np.zeros(5 * SAMPLE_RATE, dtype=np.int16), make_audio(5)))
+    delivered = []
+    stream = modelManager.open_transcription_stream("stub", SAMPLE_RATE, lambda text, latency: delivered.append(text), vad=vad)
+    feed_all(stream, audio)
+
+    assert delivered == ['piece1']
+    assert transcribed_lengths == [6 * SAMPLE_RATE]
+    # Every fed sample is accounted for once, the overlap resent with the second chunk is not counted again
+    assert stream.silent_length == 5 * SAMPLE_RATE
+    assert stream.speech_length == 5 * SAMPLE_RATE
+
+def test_stream_delivers_before_the_window_closes(tmp_path):
+    modelManager = make_model_manager(str(tmp_path))
+    modelManager.register_transcriber("stub", lambda audio_path: stub_transcriber(audio_path, base_delay_in_sec=0))
+
+    delivered = []
+    stream = modelManager.open_transcription_stream("stub", SAMPLE_RATE, lambda text, latency: delivered.append(text))
+    feed_all(stream, make_audio(12))
+
+    # 5s, 5s and the 2s left at close, each after the 1s overlap merge
+    assert len(delivered) == 3
+    assert len(stream.latencies) == 3
+    assert max(stream.latencies) < 1
+    # Without a vad nothing is counted
+    assert stream.speech_length == stream.silent_length == 0
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        modelManager = make_model_manager(tmp_dir)
+        modelManager.register_transcriber("stub", stub_transcriber)
+        audio = make_audio()
+        feed_length = SAMPLE_RATE * FEED_IN_MS // 1000
+
+        # Streaming: feed at capture pace, record when each piece of text lands
+        delivered = []
+        stream = modelManager.open_transcription_stream("stub", SAMPLE_RATE, lambda text, latency: delivered.append((time.time(), latency)))
+        start_time = time.time()
+        for offset in range(0, len(audio), feed_length):
+            stream.feed(audio[offset:offset + feed_length])
+            time.sleep(max(start_time + (offset + feed_length) / SAMPLE_RATE - time.time(), 0))
+        stream.close()
+
+        chunk_in_sec = modelManager.audio_stream_chunk_in_sec
+        stream_latencies = [latency for _, latency in delivered]
+        # A word waits half a chunk on average before its chunk is cut
+        streaming_avg = chunk_in_sec / 2 + sum(stream_latencies) / len(stream_latencies)
+        print(f"Streaming ({chunk_in_sec}s chunks): {len(delivered)} pieces, chunk-to-text avg {sum(stream_latencies) / len(stream_latencies):.2f}s, max {max(stream_latencies):.2f}s, speech-to-text avg {streaming_avg:.2f}s")
+
+        # Batch: the whole window is transcribed once it closes
+        batch_start = time.time()
+        batch_window_path = os.path.join(tmp_dir, 'batch_window.wav')
+        with wave.open(batch_window_path, 'wb') as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(SAMPLE_RATE)
+            wf.writeframes(audio.tobytes())
+        modelManager.send_audio_to_api(batch_window_path, "stub")
+        batch_latency = time.time() - batch_start
+        batch_avg = WINDOW_IN_SEC / 2 + batch_latency
+        print(f"Batch ({WINDOW_IN_SEC}s window): window-to-text {batch_latency:.2f}s, speech-to-text avg {batch_avg:.2f}s")
+        print(f"Speech-to-text latency {batch_avg / streaming_avg:.1f}x lower when streaming")
@@ -0,0 +1,114 @@
+import os
+import sys
+import time
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app_agent import AgentManager
+from app_prompt import PromptManager
+from bench_helper import BenchConfig
+
+MODEL = "together/mistralai/Mixtral-8x7B-Instruct-v0.1"
+
+class StubModelManager:
+    """Counts LLM calls, every chunk summary is one short line."""
+    def __init__(self):
+        self.calls_lock = threading.Lock()
+        self.call_count = 0
+    def send_text_to_llm_api(self, payload, priority=None):
+        with self.calls_lock:
+            self.call_count += 1
+            return f'Summary {self.call_count} of {payload["messages"][1]["content"].count(chr(10)) + 1} lines'
+
+class StubDatabase:
+    def __init__(self):
+        self.summary_chunks = {}
+    def retrieve_summary_chunk(self, chunk_key):
+        return self.summary_chunks.get(chunk_key)
+    def save_summary_chunk(self, chunk_key, level, from_timestamp, to_timestamp, item_count, content_text):
+        self.summary_chunks[chunk_key] = content_text
+
+def make_agent_manager(config_data=None):
+    configManager = BenchConfig(dict({"agent_livesummary_loop_time_in_min": 5, "agent_livesummary_text_model": MODEL}, **(config_data or {})))
+    modelManager = StubModelManager()
+    agentManager = AgentManager(configManager, None, modelManager, PromptManager(configManager), None, StubDatabase(), None)
+    return agentManager, modelManager
+
+def make_rows(count, seconds_between_rows, word_count=20):
+    start_epoch = time.mktime(time.strptime('2024-01-01 09:00:00', '%Y-%m-%d %H:%M:%S'))
+    return [
+        (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_epoch + index * seconds_between_rows)), "Screenshot", ' '.join(f'word{index}x{word}' for word in range(word_count)))
+        for index in range(count)
+    ]
+
+def get_row_tokens(agentManager, row):
+    return agentManager.estimate_tokens(f"[{row[0]}] {row[1]}: {row[2]}")
+
+def test_chunks_follow_windows_and_token_budget():
+    agentManager, _ = make_agent_manager({"agent_summary_chunk_max_tokens": 100000})
+    # Three rows a minute apart, then one in another 10 minute window of the same hour
+    rows = make_rows(3, 60) + [('2024-01-01 09:40:00', "Photo", 'A desk')]
+    chunks = agentManager.build_summary_chunks(rows)
+
+    assert [len(chunk["lines"]) for chunk in chunks] == [3, 1]
+    assert chunks[0]["from_timestamp"] == '2024-01-01 09:00:00'
+    assert chunks[0]["to_timestamp"] == '2024-01-01 09:02:00'
+
+    # A budget of about two rows cuts the same window into several chunks
+    line_tokens = get_row_tokens(agentManager, rows[0])
+    agentManager.agent_summary_chunk_max_tokens = line_tokens * 2
+    assert [len(chunk["lines"]) for chunk in agentManager.build_summary_chunks(rows)] == [2, 1, 1]
+
+    # The next level's hour long window takes in the later row
+    agentManager.agent_summary_chunk_max_tokens = 100000
+    assert [len(chunk["lines"]) for chunk in agentManager.build_summary_chunks(rows, level=1)] == [4]
+
+def test_dense_rows_take_one_call_per_chunk():
+    agentManager, modelManager = make_agent_manager()
+    # 30 rows inside one 10 minute window, ten of the longest fit a chunk
+    rows = make_rows(30, 10)
+    line_tokens = get_row_tokens(agentManager, rows[-1])
+    agentManager.agent_summary_chunk_max_tokens = line_tokens * 10
+    agentManager.agent_summary_reduce_max_tokens = line_tokens * 5
+
+    reduced_text = agentManager.reduce_rows(rows)
+
+    assert modelManager.call_count == 3
+    assert len(reduced_text.splitlines()) == 3
+    assert sum(agentManager.estimate_tokens(line) for line in reduced_text.splitlines()) <= agentManager.agent_summary_reduce_max_tokens
+
+def test_thin_rows_are_not_summarized_one_call_each():
+    agentManager, modelManager = make_agent_manager()
+    line_tokens = get_row_tokens(agentManager, make_rows(1, 0)[0])
+    agentManager.agent_summary_reduce_max_tokens = line_tokens * 5
+    # One row every 20 minutes for a day, each alone in its 10 minute window
+    rows = make_rows(72, 20 * 60)
+
+    reduced_text = agentManager.reduce_rows(rows)
+
+    assert modelManager.call_count <= len(rows) // 4
+    assert sum(agentManager.estimate_tokens(line) for line in reduced_text.splitlines()) <= agentManager.agent_summary_reduce_max_tokens
+
+def test_rows_larger_than_a_chunk_are_left_alone():
+    agentManager, modelManager = make_agent_manager()
+    rows = make_rows(10, 60, word_count=100)
+    line_tokens = get_row_tokens(agentManager, rows[0])
+    # No two rows fit one chunk, summarizing them one by one would not shrink anything
+    agentManager.agent_summary_chunk_max_tokens = line_tokens + 1
+    agentManager.agent_summary_reduce_max_tokens = line_tokens * 5
+
+    reduced_text = agentManager.reduce_rows(rows)
+
+    assert modelManager.call_count == 0
+    assert len(reduced_text.splitlines()) == len(rows)
+
+def test_repeated_reduce_reuses_stored_chunks():
+    agentManager, modelManager = make_agent_manager()
+    line_tokens = get_row_tokens(agentManager, make_rows(1, 0)[0])
+    agentManager.agent_summary_reduce_max_tokens = line_tokens * 5
+    rows = make_rows(72, 20 * 60)
+
+    first_text = agentManager.reduce_rows(rows)
+    call_count = modelManager.call_count
+    assert agentManager.reduce_rows(rows) == first_text
+    assert modelManager.call_count == call_count
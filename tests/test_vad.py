@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app_helper import MediaManager
+
+SAMPLE_RATE = 16000
+
+def make_room(seconds, level=0.0005, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(0, level, int(seconds * SAMPLE_RATE))
+
+def make_voice(seconds, level=0.1):
+    # Voiced harmonics with a syllable-rate envelope that never drops to silence, like someone talking without pause
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    harmonics = sum(np.sin(2 * np.pi * 140 * k * t) / k for k in range(1, 6))
+    envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 4 * t)
+    return level * harmonics * envelope
+
+def to_samples(signal):
+    return (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+
+def covers_all(speech_range, sample_count, frame_length=SAMPLE_RATE * 30 // 1000):
+    # Ranges end on a frame boundary, the last partial frame is never judged
+    return speech_range is not None and speech_range[0] == 0 and speech_range[1] > sample_count - frame_length
+
+def test_continuous_speech_is_speech():
+    mediaManager = MediaManager()
+    samples = to_samples(make_voice(10) + make_room(10))
+
+    # Without a tracked floor the segment's own quiet end is speech too
+    assert covers_all(mediaManager.detect_speech(samples, SAMPLE_RATE, 1, padding_in_sec=0), len(samples))
+    # Judged against the room floor tracked from earlier segments
+    room_floor_in_db = mediaManager.estimate_noise_floor(to_samples(make_room(10)), SAMPLE_RATE, 1)
+    assert covers_all(mediaManager.detect_speech(samples, SAMPLE_RATE, 1, padding_in_sec=0, noise_floor_in_db=room_floor_in_db), len(samples))
+
+def test_steady_tone_settles_into_the_noise_floor():
+    mediaManager = MediaManager()
+    t = np.arange(5 * SAMPLE_RATE) / SAMPLE_RATE
+    tone = to_samples(0.1 * np.sin(2 * np.pi * 220 * t) + make_room(5))
+    noise_floor_in_db = mediaManager.update_noise_floor(None, to_samples(make_room(5)), SAMPLE_RATE, 1)
+
+    # Judged against the room at first, then the floor climbs to the tone and stays there
+    judgements = []
+    for _ in range(8):
+        noise_floor_in_db = mediaManager.update_noise_floor(noise_floor_in_db, tone, SAMPLE_RATE, 1)
+        judgements.append(mediaManager.detect_speech(tone, SAMPLE_RATE, 1, noise_floor_in_db=noise_floor_in_db) is not None)
+    assert judgements[0]
+    assert not any(judgements[-4:])
+
+    # Speech over a settled floor still rises above it, the floor falls back once the room is quiet again
+    samples = to_samples(make_voice(5, level=0.3) + make_room(5))
+    assert mediaManager.detect_speech(samples, SAMPLE_RATE, 1, noise_floor_in_db=noise_floor_in_db) is not None
+    assert mediaManager.update_noise_floor(noise_floor_in_db, samples, SAMPLE_RATE, 1) < noise_floor_in_db + 3
+    assert mediaManager.update_noise_floor(noise_floor_in_db, to_samples(make_room(5)), SAMPLE_RATE, 1) < -60
+
+def test_continuous_speech_does_not_become_the_floor():
+    mediaManager = MediaManager()
+    samples = to_samples(make_voice(5) + make_room(5))
+    noise_floor_in_db = mediaManager.update_noise_floor(None, to_samples(make_room(5)), SAMPLE_RATE, 1)
+
+    for _ in range(8):
+        noise_floor_in_db = mediaManager.update_noise_floor(noise_floor_in_db, samples, SAMPLE_RATE, 1)
+        assert covers_all(mediaManager.detect_speech(samples, SAMPLE_RATE, 1, padding_in_sec=0, noise_floor_in_db=noise_floor_in_db), len(samples))
+
+def test_quiet_room_is_silent():
+    mediaManager = MediaManager()
+    samples = to_samples(make_room(10))
+    assert mediaManager.detect_speech(samples, SAMPLE_RATE, 1) is None
+    assert mediaManager.detect_speech(samples, SAMPLE_RATE, 1, noise_floor_in_db=mediaManager.estimate_noise_floor(samples, SAMPLE_RATE, 1)) is None
+
+def test_speech_in_silence_is_trimmed():
+    signal = make_room(10)
+    signal[4 * SAMPLE_RATE:6 * SAMPLE_RATE] += make_voice(2)
+    start, end = MediaManager().detect_speech(to_samples(signal), SAMPLE_RATE, 1, padding_in_sec=0.5)
+
+    assert abs(start - int(3.5 * SAMPLE_RATE)) < SAMPLE_RATE // 10
+    assert abs(end - int(6.5 * SAMPLE_RATE)) < SAMPLE_RATE // 10
+
+def test_stereo_frames_are_counted_once():
+    mono = to_samples(make_voice(2) + make_room(2))
+    stereo = np.repeat(mono, 2)
+    assert covers_all(MediaManager().detect_speech(stereo, SAMPLE_RATE, 2, padding_in_sec=0), len(mono))
+
+if __name__ == "__main__":
+    mediaManager = MediaManager()
+    samples = to_samples(np.concatenate([make_room(30), make_voice(30) + make_room(30, seed=1)]))
+
+    start_time = time.time()
+    speech_range = mediaManager.detect_speech(samples, SAMPLE_RATE, 1)
+    elapsed_time = time.time() - start_time
+    print(f"VAD over {len(samples) / SAMPLE_RATE:.0f}s in {elapsed_time * 1000:.1f} ms, speech {speech_range}")